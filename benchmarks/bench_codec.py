@@ -0,0 +1,104 @@
+"""
+Compare websocket RPC codecs on typical messages.
+
+Measures encode/decode time and frame size of a `list` response for a fleet
+of applications and of a stream of task progress events.
+
+Usage:
+
+    python benchmarks/bench_codec.py [number of applications]
+"""
+import sys
+import timeit
+
+from mcloud.codec import CODECS
+
+
+def make_service(app, n):
+    name = '%s%s.%s' % ('web' if n == 0 else 'worker', n, app)
+
+    return {
+        'shortname': name.split('.')[0],
+        'name': name,
+        'ip': '172.17.0.%s' % (n + 2),
+        'error': None,
+        'ports': {'80/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '%s' % (32000 + n)}]},
+        'hosts_path': '/var/lib/docker/containers/%s/hosts' % ('a1b2c3d4' * 8),
+        'volumes': {'/var/www': '/home/mcloud/%s/www' % app, '/var/log': '/home/mcloud/%s/log' % app},
+        'started_at': '2015-06-01T12:00:00.000000000Z',
+        'fullname': '%s.mcloud.lh' % name,
+        'is_web': n == 0,
+        'running': True,
+        'created': True,
+        'stats': {'cpu': 1.25, 'memory': 134217728, 'net_in': 1024000, 'net_out': 2048000},
+        'cpu_history': [0.5 + i * 0.01 for i in range(60)],
+    }
+
+
+def make_app(n, services=4):
+    app = 'app%s' % n
+
+    return {
+        'name': app,
+        'deployment': 'default',
+        'hosts': ['%s.example.com' % app],
+        'volumes': {},
+        'fullname': '%s.mcloud.lh' % app,
+        'web_ip': '172.17.0.2',
+        'web_port': 80,
+        'web_target': '172.17.0.2:80',
+        'web_service': 'web0.%s' % app,
+        'ssl_ip': None,
+        'ssl_port': None,
+        'ssl_target': None,
+        'ssl_service': None,
+        'public_urls': [],
+        'config': '/home/mcloud/%s/mcloud.yml' % app,
+        'services': [make_service(app, i) for i in range(services)],
+        'stats': {'cpu': 5.0, 'memory': 536870912, 'net_in': 4096000, 'net_out': 8192000},
+        'running': True,
+        'status': 'RUNNING',
+        'errors': [],
+    }
+
+
+def list_response(apps):
+    return {'type': 'event', 'name': 'task.success.1', 'data': [make_app(i) for i in range(apps)]}
+
+
+def progress_events(count=200):
+    return [{'type': 'event', 'name': 'task.progress.1',
+             'data': {'status': 'Downloading', 'id': '%012x' % i,
+                      'progressDetail': {'current': i * 1024, 'total': 204800},
+                      'progress': '[=====>      ] %s kB/200 kB' % i}}
+            for i in range(count)]
+
+
+def measure(codec, messages, repeat=5):
+    frames = [codec.encode(message) for message in messages]
+
+    encode = min(timeit.repeat(lambda: [codec.encode(message) for message in messages], number=1, repeat=repeat))
+    decode = min(timeit.repeat(lambda: [codec.decode(frame) for frame in frames], number=1, repeat=repeat))
+
+    return sum(len(frame) for frame in frames), encode, decode
+
+
+def main(apps=100):
+    cases = [
+        ('list, %s apps' % apps, [list_response(apps)]),
+        ('progress, 200 events', progress_events()),
+    ]
+
+    if len(CODECS) == 1:
+        print 'Only %s is available, install msgpack to compare' % CODECS[0].name
+
+    print '%-22s %-16s %12s %12s %12s' % ('case', 'codec', 'bytes', 'encode ms', 'decode ms')
+
+    for case, messages in cases:
+        for codec in CODECS:
+            size, encode, decode = measure(codec, messages)
+            print '%-22s %-16s %12d %12.2f %12.2f' % (case, codec.name, size, encode * 1000, decode * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
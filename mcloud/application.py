@@ -61,7 +61,10 @@ class Application(object):
 
 
     @defer.inlineCallbacks
-    def load(self, need_details=False):
+    def load(self, need_details=False, history=False):
+        """
+        :param history: add recent cpu usage of services to details
+        """
 
         try:
             if 'source' in self.config:
@@ -91,7 +94,7 @@ class Application(object):
 
 
             if need_details:
-                defer.returnValue(self._details(yaml_config, deployment))
+                defer.returnValue(self._details(yaml_config, deployment, history=history))
             else:
                 defer.returnValue(yaml_config)
 
@@ -102,7 +105,7 @@ class Application(object):
 
 
 
-    def _details(self, app_config, deployment):
+    def _details(self, app_config, deployment, history=False):
         is_running = True
         status = 'RUNNING'
         errors = []
@@ -131,7 +134,7 @@ class Application(object):
                         full_stats[key] = 0
                     full_stats[key] += val
 
-            services.append({
+            details = {
                 'shortname': service.shortname,
                 'name': service.name,
                 'ip': service.ip(),
@@ -145,7 +148,13 @@ class Application(object):
                 'running': service.is_running(),
                 'created': service.is_created(),
                 'stats': stats,
-            })
+            }
+
+            # list goes to every client often, history only when asked for
+            if history:
+                details['cpu_history'] = service.stats_history
+
+            services.append(details)
 
             if service.is_running():
                 if service.is_web():
@@ -322,7 +331,7 @@ class ApplicationController(object):
         defer.returnValue(result)
 
     @defer.inlineCallbacks
-    def list(self, *args):
+    def list(self, history=False):
 
         deps = yield self.redis.hgetall('mcloud-deployments')
 
@@ -363,7 +372,7 @@ class ApplicationController(object):
 
             cfg = yield self.load_app_config(app_config)
             app = Application(cfg, name=name, public_urls=public_urls)
-            all_apps.append(app.load(need_details=True))
+            all_apps.append(app.load(need_details=True, history=history))
 
         results = yield defer.gatherResults(all_apps, consumeErrors=True)
 
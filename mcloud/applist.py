@@ -0,0 +1,272 @@
+import logging
+
+import inject
+from mcloud.application import ApplicationController
+from mcloud.events import EventBus
+from mcloud.remote import ApiRpcServer
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall
+
+logger = logging.getLogger('mcloud.applist')
+
+
+def escape(key):
+    return unicode(key).replace('~', '~0').replace('/', '~1')
+
+
+def unescape(key):
+    return key.replace('~1', '/').replace('~0', '~')
+
+
+def diff(old, new, path=''):
+    """
+    Return list of operations, that turn `old` into `new`.
+
+    Operations are JSON-patch style dicts: {'op': 'add'|'remove'|'replace',
+    'path': '/json/pointer', 'value': ...}. Dicts are compared key by key,
+    lists of the same length item by item, list of other length is replaced
+    as a whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': '%s/%s' % (path, escape(key))})
+
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': '%s/%s' % (path, escape(key)), 'value': value})
+            else:
+                ops.extend(diff(old[key], value, '%s/%s' % (path, escape(key))))
+
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        ops = []
+
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            ops.extend(diff(old_item, new_item, '%s/%s' % (path, index)))
+
+        return ops
+
+    if type(old) != type(new) or old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+
+    return []
+
+
+def apply_patch(doc, ops):
+    """
+    Apply operations produced by diff() and return updated document.
+
+    Document is modified in place, except when root itself is replaced.
+    """
+    for op in ops:
+        if not op['path']:
+            doc = op['value']
+            continue
+
+        keys = [unescape(key) for key in op['path'].split('/')[1:]]
+
+        target = doc
+        for key in keys[:-1]:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+
+        key = keys[-1]
+        if isinstance(target, list):
+            key = int(key)
+
+        if op['op'] == 'remove':
+            del target[key]
+        else:
+            target[key] = op['value']
+
+    return doc
+
+
+class AppListFeed(object):
+    """
+    Pushes application list to subscribed tasks.
+
+    While there are subscribers, list is loaded once per interval (and right
+    after containers or deployments change), no matter how many clients
+    follow it. Subscriber gets full snapshot first and then only deltas:
+
+        {'list': 'snapshot', 'rev': 1, 'apps': {name: app}}
+        {'list': 'delta', 'rev': 2, 'ops': [...]}
+
+    Subscriber, whose client does not keep up with messages, is skipped and
+    gets fresh snapshot when it's outbound queue is drained. Feed runs in
+    the process client is connected to (see ApiRpcServer.LOCAL_TASKS),
+    so the queue is always known here.
+
+    Messages are not written to ticket log, deltas are of no use without
+    the snapshot they follow, so client, that re-attaches, gets fresh
+    snapshot instead.
+    """
+
+    app_controller = inject.attr(ApplicationController)
+    rpc_server = inject.attr(ApiRpcServer)
+    eb = inject.attr(EventBus)
+
+    TRIGGERS = ('containers-updated', 'new-deployment', 'remove-deployment')
+
+    history = False
+    """ services carry recent cpu usage """
+
+    def __init__(self, interval=1.0, backlog_limit=100, clock=None):
+        self.interval = interval
+        self.backlog_limit = backlog_limit
+        self.clock = clock or reactor
+
+        self.apps = None
+        self.rev = 0
+
+        self.subscribers = {}
+        """ ticket id -> revision subscriber has, None if it needs snapshot """
+
+        self.loading = False
+        self.reload = False
+
+        self._loop = None
+
+    def subscribe(self, ticket_id):
+        """
+        Start pushing updates to the task. Returned deferred never fires, cancel it to unsubscribe.
+        """
+        d = defer.Deferred(lambda d: self.unsubscribe(ticket_id))
+
+        self.subscribers[ticket_id] = None
+        self.rpc_server.attach_handlers[ticket_id] = lambda: self.resync(ticket_id)
+
+        if self.apps is not None:
+            self._send_snapshot(ticket_id)
+
+        if not self._loop:
+            self._start()
+        else:
+            self.refresh()
+
+        return d
+
+    def unsubscribe(self, ticket_id):
+        self.subscribers.pop(ticket_id, None)
+        self.rpc_server.attach_handlers.pop(ticket_id, None)
+
+        if not self.subscribers:
+            self._stop()
+
+    def resync(self, ticket_id):
+        """
+        Send snapshot to the subscriber again.
+        """
+        if ticket_id not in self.subscribers:
+            return
+
+        self.subscribers[ticket_id] = None
+
+        if self.apps is not None:
+            self._send_snapshot(ticket_id)
+
+    def _start(self):
+        logger.debug('Application list feed started')
+
+        for event in self.TRIGGERS:
+            self.eb.on(event, self._on_event)
+
+        self._loop = LoopingCall(self.refresh)
+        self._loop.clock = self.clock
+        self._loop.start(self.interval)
+
+    def _stop(self):
+        logger.debug('Application list feed stopped')
+
+        for event in self.TRIGGERS:
+            self.eb.cancel(event, self._on_event)
+
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+        # nobody keeps it current anymore
+        self.apps = None
+
+    def _on_event(self, channel, message):
+        self.clock.callLater(0, self.refresh)
+
+    def refresh(self):
+        """
+        Reload list and push changes, list is never loaded twice at the same time.
+        """
+        if self.loading:
+            self.reload = True
+            return
+
+        self.loading = True
+
+        d = self.app_controller.list(history=self.history)
+        d.addCallbacks(self._on_loaded, self._on_failed)
+        d.addBoth(self._on_done)
+        return d
+
+    def _on_done(self, result):
+        self.loading = False
+
+        if self.reload and self.subscribers:
+            self.reload = False
+            self.refresh()
+
+    def _on_failed(self, failure):
+        logger.error('Can not load application list: %s', failure.getErrorMessage())
+
+    def _on_loaded(self, results):
+        if not self.subscribers:
+            return
+
+        apps = dict((app['name'], app) for app in results)
+
+        ops = diff(self.apps, apps) if self.apps is not None else None
+        if ops is not None and not ops:
+            # nothing changed, only lagging subscribers may need something
+            self._send_snapshots()
+            return
+
+        self.apps = apps
+        self.rev += 1
+
+        for ticket_id, rev in self.subscribers.items():
+            if self.rpc_server.task_backlog(ticket_id) > self.backlog_limit:
+                self.subscribers[ticket_id] = None
+
+            elif rev is None or rev != self.rev - 1:
+                self._send_snapshot(ticket_id)
+
+            else:
+                self.rpc_server.task_progress({'list': 'delta', 'rev': self.rev, 'ops': ops}, ticket_id,
+                                              droppable=False, logged=False)
+                self.subscribers[ticket_id] = self.rev
+
+    def _send_snapshots(self):
+        for ticket_id, rev in self.subscribers.items():
+            if rev is None:
+                self._send_snapshot(ticket_id)
+
+    def _send_snapshot(self, ticket_id):
+        if self.rpc_server.task_backlog(ticket_id) > self.backlog_limit:
+            return
+
+        self.rpc_server.task_progress({'list': 'snapshot', 'rev': self.rev, 'apps': self.apps}, ticket_id,
+                                      droppable=False, logged=False)
+        self.subscribers[ticket_id] = self.rev
+
+    def stats(self):
+        return {'subscribers': len(self.subscribers), 'rev': self.rev}
+
+
+class HistoryAppListFeed(AppListFeed):
+    """
+    Application list with recent cpu usage of services, for clients, that show it.
+    """
+
+    history = True
@@ -1,4 +1,3 @@
-from base64 import b64encode, b64decode
 import pty
 
 from twisted.internet import defer
@@ -141,7 +140,7 @@ class AttachStdinProtocol(Protocol):
             self.term.start()
             self.started = True
 
-        self.transport.write(b64decode(data))
+        self.transport.write(data)
 
     def stop(self):
         self.transport.loseConnection()
@@ -157,10 +156,13 @@ class AttachStdinProtocol(Protocol):
             reactor.stop()
 
         if self.listener:
-            self.listener(b64encode(data))
+            self.listener(data)
 
 
 class Attach(basic.LineReceiver):
+    on_connected = None
+    """ called with transport, when connection is made """
+
     def __init__(self, finnished, container_id):
         self.finished = finnished
         self.container_id = container_id
@@ -168,6 +170,10 @@ class Attach(basic.LineReceiver):
     def connectionMade(self):
         """ """
         print 'Attach Connected!'
+
+        if self.on_connected:
+            self.on_connected(self.transport)
+
         self.transport.write(
             'POST /v1.19/containers/%s/attach?logs=0&stream=1&stdout=1&stdin=1 HTTP/1.1\r\n' % str(self.container_id))
         self.transport.write('Connection: Upgrade\r\n')
@@ -175,7 +181,7 @@ class Attach(basic.LineReceiver):
         self.transport.write('\r\n')
 
     def rawDataReceived(self, data):
-        self.stdout_write(b64encode(data))
+        self.stdout_write(data)
 
     def lineReceived(self, line):
         # print 'Line: ', line
@@ -184,7 +190,7 @@ class Attach(basic.LineReceiver):
             self.setRawMode()
 
     def stdin_on_input(self, data):
-        self.transport.write(b64decode(data))
+        self.transport.write(data)
 
     def stdout_write(self, data):
         pass
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+import stat
+
+import inject
+from mcloud.context import walk_context
+from twisted.internet import defer
+from twisted.internet.defer import inlineCallbacks
+import txredisapi
+
+logger = logging.getLogger('mcloud.buildcache')
+
+
+def file_digest(path, block_size=64 * 1024):
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def directory_digest(path, matcher=None):
+    """
+    Calculate content digest of build context directory.
+
+    Names, modes and contents of all entries, that are not ignored, are
+    included, modification times are not, so touching a file does not
+    invalidate cache.
+
+    @type matcher: mcloud.context.IgnoreMatcher
+    """
+    digest = hashlib.sha1()
+
+    for rel_path, full_path, st in walk_context(path, matcher):
+        digest.update('%s\0%o\0' % (rel_path, st.st_mode))
+
+        if stat.S_ISLNK(st.st_mode):
+            digest.update(os.readlink(full_path))
+        elif stat.S_ISREG(st.st_mode):
+            digest.update(file_digest(full_path))
+
+        digest.update('\0')
+
+    return digest.hexdigest()
+
+
+def files_digest(files):
+    """
+    Calculate content digest of in-memory build context (file name -> content).
+    """
+    digest = hashlib.sha1()
+
+    for name, source in sorted(files.items()):
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+
+        digest.update('%s\0%s\0%s\0' % (name, len(source), hashlib.sha1(source).hexdigest()))
+
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """
+    Maps content digest of build context to id of image built from it.
+
+    Records are kept in redis per docker daemon, image is verified to still
+    exist before it's reused.
+    """
+
+    redis = inject.attr(txredisapi.Connection)
+
+    KEY = 'mcloud-build-cache'
+
+    def _field(self, client, digest):
+        return '%s %s' % (client.url, digest)
+
+    @inlineCallbacks
+    def get(self, client, digest):
+        """
+        Return id of image built from context with given digest, or None.
+
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        field = self._field(client, digest)
+
+        image_id = yield self.redis.hget(self.KEY, field)
+        if not image_id:
+            defer.returnValue(None)
+
+        image = yield client.inspect_image(image_id)
+        if not image:
+            logger.debug('Cached image %s is gone', image_id)
+            yield self.redis.hdel(self.KEY, field)
+            defer.returnValue(None)
+
+        defer.returnValue(image_id)
+
+    def set(self, client, digest, image_id):
+        return self.redis.hset(self.KEY, self._field(client, digest), image_id)
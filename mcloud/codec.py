@@ -0,0 +1,82 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec(object):
+    """
+    Messages as JSON text frames. Understood by every client, including web UI.
+    """
+    name = 'mcloud.json'
+    binary = False
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class MsgpackCodec(object):
+    """
+    Messages as msgpack binary frames.
+
+    Encoded message is always a map, so first byte of the frame is 0x80 or
+    above and frame can't be confused with binary stream frame.
+    """
+    name = 'mcloud.msgpack'
+    binary = True
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+JSON = JsonCodec()
+
+CODECS = [JSON]
+""" available codecs, most preferred first """
+
+if msgpack:
+    CODECS.insert(0, MsgpackCodec())
+
+
+def codec_names():
+    """
+    Names of available codecs, offered as websocket subprotocols.
+    """
+    return [codec.name for codec in CODECS]
+
+
+def get_codec(name):
+    """
+    Return codec by name, JSON if name is unknown or None.
+    """
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+
+    return JSON
+
+
+def negotiate(offered):
+    """
+    Choose codec from subprotocols offered by the client.
+
+    Client lists subprotocols in order of it's preference, first one we
+    support wins. Client, that offers nothing, talks JSON.
+
+    :return: (codec, subprotocol name to confirm or None)
+    """
+    names = codec_names()
+
+    for name in offered or []:
+        if name in names:
+            return get_codec(name), name
+
+    return JSON, None
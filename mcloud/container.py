@@ -1,10 +1,15 @@
 from StringIO import StringIO
 import logging
 import tarfile
-from tempfile import mkdtemp
 from abc import abstractmethod
+from mcloud.buildcache import BuildCache, directory_digest, files_digest
+from mcloud.context import IgnoreMatcher, walk_context, context_sizes, format_context_sizes
+from mcloud.deployment import docker_settings
+from mcloud.images import split_image_name
 from mcloud.util import Interface
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, threads
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from zope.interface import implementer
 
 logger = logging.getLogger('mcloud.application')
 from twisted.python import log
@@ -33,20 +38,22 @@ class PrebuiltImageBuilder(IImageBuilder):
 
         log.msg('[%s] Building image "%s".', ticket_id, self.image)
 
-        name = self.image
-        tag = None
-        if ':' in name:
-            name, tag = name.split(':')
+        name, tag, digest = split_image_name(self.image)
 
-        images = yield service.client.images(name=name)
+        if service.client.image_index:
+            exists = yield service.client.image_index.find(self.image)
+        else:
+            images = yield service.client.images(name=name)
 
-        if tag:
-            images = [x for x in images if self.image in x['RepoTags']]
+            if tag:
+                images = [x for x in images if self.image in x['RepoTags']]
 
-        if not images:
+            exists = bool(images)
+
+        if not exists:
             log.msg('[%s] Image is not there. Pulling "%s" ...', ticket_id, self.image)
 
-            yield service.client.pull(name, ticket_id, tag)
+            yield service.client.pull(name, ticket_id, tag or digest)
 
         log.msg('[%s] Image "%s" is ready to use.', ticket_id, self.image)
         defer.returnValue(self.image)
@@ -56,40 +63,229 @@ class CanNotAccessPath(Exception):
     pass
 
 
+class ProducerStopped(Exception):
+    pass
+
+
+class _ChunkWriter(object):
+    """
+    File-like object, that passes data written by tarfile to producer in chunks.
+
+    Used from worker thread.
+    """
+
+    def __init__(self, producer, chunk_size):
+        self.producer = producer
+        self.chunk_size = chunk_size
+
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+
+        threads.blockingCallFromThread(reactor, self.producer.write_chunk, data)
+
+
+@implementer(IBodyProducer)
+class ArchiveProducer(object):
+    """
+    Request body, that streams tar archive of a directory.
+
+    Archive is built in a worker thread and written to consumer chunk by chunk.
+    Worker waits until each chunk is written and while consumer is paused, so
+    only one chunk is kept in memory whatever size of the directory is.
+
+    Entries matched by ignore rules are skipped, rules are loaded from context
+    directory if matcher is not given.
+
+    Archive of in-memory files (name -> content) is built if files are given
+    instead of path.
+    """
+
+    length = UNKNOWN_LENGTH
+
+    def __init__(self, path=None, compress=False, chunk_size=64 * 1024, files=None, matcher=None):
+        self.path = path
+        self.files = files
+        self.matcher = matcher
+        self.compress = compress
+        self.chunk_size = chunk_size
+
+        self.consumer = None
+        self.paused = False
+        self.stopped = False
+        self.resumed = None
+
+    def startProducing(self, consumer):
+        self.consumer = consumer
+
+        finished = defer.Deferred()
+
+        def done(result):
+            # consumer is not interested in result after it stopped us
+            if not self.stopped:
+                finished.callback(result)
+
+        d = threads.deferToThread(self.archive)
+        d.addBoth(done)
+
+        return finished
+
+    def archive(self):
+        writer = _ChunkWriter(self, self.chunk_size)
+
+        try:
+            t = tarfile.open(mode='w|gz' if self.compress else 'w|', fileobj=writer)
+
+            if self.files is not None:
+                for name, source in sorted(self.files.items()):
+                    if isinstance(source, unicode):
+                        source = source.encode('utf-8')
+
+                    info = tarfile.TarInfo('./%s' % name)
+                    info.size = len(source)
+                    info.mode = 0644
+                    t.addfile(info, StringIO(source))
+            else:
+                matcher = self.matcher
+                if matcher is None:
+                    matcher = IgnoreMatcher.from_directory(self.path)
+
+                t.add(self.path, arcname='.', recursive=False)
+
+                for rel_path, full_path, st in walk_context(self.path, matcher):
+                    t.add(full_path, arcname='./%s' % rel_path, recursive=False)
+
+            t.close()
+        except EnvironmentError as e:
+            raise CanNotAccessPath('Can not access %s: %s' % (self.path, str(e)))
+
+        writer.flush()
+
+    def write_chunk(self, data):
+        if self.stopped:
+            raise ProducerStopped()
+
+        self.consumer.write(data)
+
+        # consumer may pause us while writing
+        if self.paused:
+            self.resumed = defer.Deferred()
+            return self.resumed
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+        if self.resumed:
+            d, self.resumed = self.resumed, None
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+
+        if self.resumed:
+            d, self.resumed = self.resumed, None
+            d.errback(ProducerStopped())
+
+
+def get_build_cache():
+    """
+    Return build cache, or None if it's disabled by server settings.
+    """
+    settings = docker_settings()
+
+    if settings and settings.build_cache:
+        return BuildCache()
+
+    return None
+
+
 class DockerfileImageBuilder(IImageBuilder):
     def __init__(self, path):
         super(DockerfileImageBuilder, self).__init__()
         self.path = path
 
         self.image_id = None
+        self.matcher = None
+
+    def scan_context(self):
+        """
+        Load ignore rules and calculate size of build context.
+
+        Called in worker thread.
+        """
+        self.matcher = IgnoreMatcher.from_directory(self.path)
+        return context_sizes(self.path, self.matcher)
+
+    @defer.inlineCallbacks
+    def prepare_context(self, ticket_id, service):
+        d = threads.deferToThread(self.scan_context)
+
+        def on_error(failure):
+            failure.trap(EnvironmentError)
+            raise CanNotAccessPath('Can not access %s: %s' % (self.path, failure.getErrorMessage()))
+
+        d.addErrback(on_error)
+
+        total, sizes = yield d
+        service.client.task_log(ticket_id, format_context_sizes(total, sizes))
 
     def create_archive(self):
-        d = defer.Deferred()
-
-        def archive():
-            memfile = StringIO()
-            try:
-                t = tarfile.open(mode='w', fileobj=memfile)
-                t.add(self.path, arcname='.')
-                d.callback(memfile.getvalue())
-            except OSError as e:
-                d.errback(CanNotAccessPath('Can not access %s: %s' % (self.path, str(e))))
-            except Exception as e:
-                d.errback(e)
-            finally:
-                memfile.close()
-
-        reactor.callLater(0, archive)
-        return d
+        """
+        Return build context as request body producer.
+        """
+        settings = docker_settings()
+
+        return ArchiveProducer(self.path, compress=bool(settings and settings.build_context_gzip), matcher=self.matcher)
+
+    def context_digest(self):
+        return threads.deferToThread(directory_digest, self.path, self.matcher)
 
     @defer.inlineCallbacks
     def build_image(self, ticket_id, service):
-        archive = yield self.create_archive()
+        yield self.prepare_context(ticket_id, service)
+
+        cache = get_build_cache()
+
+        if cache:
+            digest = yield self.context_digest()
+
+            image_id = yield cache.get(service.client, digest)
+            if image_id:
+                log.msg('[%s] Build context is not changed, using image %s', ticket_id, image_id)
+                self.image_id = image_id
+                defer.returnValue(image_id)
+
+        archive = self.create_archive()
         ret = yield service.client.build_image(archive, ticket_id=ticket_id)
+
+        if cache:
+            yield cache.set(service.client, digest, ret)
+
+        self.image_id = ret
         defer.returnValue(ret)
 
 
 class VirtualFolderImageBuilder(DockerfileImageBuilder):
+    """
+    Builds image from files kept in memory.
+    """
 
     def __init__(self, files):
         self.files = files
@@ -98,16 +294,16 @@ class VirtualFolderImageBuilder(DockerfileImageBuilder):
 
         self.image_id = None
 
-    def build_image(self, ticket_id, service):
+    def create_archive(self):
+        settings = docker_settings()
 
-        tdir = mkdtemp()
-        for file_, source in self.files.items():
-            with open(tdir + '/%s' % file_, 'w+') as f:
-                f.write(source)
+        return ArchiveProducer(files=self.files, compress=bool(settings and settings.build_context_gzip))
 
-        self.path = tdir
+    def prepare_context(self, ticket_id, service):
+        return defer.succeed(None)
 
-        return super(VirtualFolderImageBuilder, self).build_image(ticket_id, service)
+    def context_digest(self):
+        return defer.succeed(files_digest(self.files))
 
 
 class InlineDockerfileImageBuilder(VirtualFolderImageBuilder):
@@ -0,0 +1,220 @@
+import errno
+import os
+import re
+import stat
+
+
+class IgnoreMatcher(object):
+    """
+    Matches paths of build context against ignore rules.
+
+    Rules are read from .dockerignore and .mcignore in context root. Each line
+    is a glob pattern ("*", "?", "[...]" do not cross directory boundary,
+    "**" matches any number of directories), trailing slash matches
+    directories only. In .mcignore pattern without slash matches entry name
+    on any depth (like in rsync exclude file), pattern with slash is relative
+    to context root. Patterns of .dockerignore are always relative to context
+    root, as docker reads them, so context is the same docker build would use.
+    Pattern prefixed with "!" re-includes matching entries, last matching
+    pattern wins. Entries inside ignored directory are ignored as well.
+
+    Patterns are compiled once. If there are no "!" patterns, all of them are
+    joined into single regular expression.
+    """
+
+    DOCKER_IGNORE_FILE = '.dockerignore'
+    IGNORE_FILE = '.mcignore'
+
+    def __init__(self, patterns, docker_patterns=()):
+        """
+        :param patterns: Patterns of .mcignore
+        :param docker_patterns: Patterns of .dockerignore, they go before .mcignore ones
+        """
+        self.rules = []
+
+        for anchored, lines in ((True, docker_patterns), (False, patterns)):
+            for pattern in lines:
+                pattern = pattern.strip()
+
+                if not pattern or pattern.startswith('#'):
+                    continue
+
+                negate = pattern.startswith('!')
+                if negate:
+                    pattern = pattern[1:].strip()
+
+                regex = self.translate(pattern, anchored)
+                if regex:
+                    self.rules.append((regex, negate))
+
+        self.negations = any(negate for regex, negate in self.rules)
+
+        if self.negations:
+            self.compiled = [(re.compile(regex), negate) for regex, negate in self.rules]
+            self.regex = None
+        elif self.rules:
+            self.regex = re.compile('|'.join('(?:%s)' % regex for regex, negate in self.rules))
+        else:
+            self.regex = None
+
+    def __nonzero__(self):
+        return bool(self.rules)
+
+    @classmethod
+    def from_directory(cls, path):
+        def read(name):
+            ignore_file = os.path.join(path, name)
+
+            if not os.path.exists(ignore_file):
+                return []
+
+            with open(ignore_file) as f:
+                return f.read().splitlines()
+
+        return cls(read(cls.IGNORE_FILE), read(cls.DOCKER_IGNORE_FILE))
+
+    @staticmethod
+    def translate(pattern, anchored=False):
+        """
+        Convert ignore pattern into regular expression matching relative path.
+
+        :param anchored: Match from context root, even if there is no slash in pattern
+        """
+        dir_only = pattern.endswith('/')
+        anchored = anchored or '/' in pattern.rstrip('/')
+        pattern = pattern.strip('/')
+
+        if not pattern:
+            return None
+
+        if anchored:
+            regex = '^'
+        else:
+            regex = '^(?:.*/)?'
+
+        i = 0
+        n = len(pattern)
+        while i < n:
+            c = pattern[i]
+
+            if pattern.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+                continue
+            elif pattern.startswith('**', i):
+                regex += '.*'
+                i += 2
+                continue
+            elif c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                end = pattern.find(']', i + 1)
+                if end == -1:
+                    regex += re.escape(c)
+                else:
+                    body = pattern[i + 1:end]
+                    if body.startswith('!'):
+                        body = '^' + body[1:]
+                    regex += '[%s]' % body.replace('\\', '\\\\')
+                    i = end
+            else:
+                regex += re.escape(c)
+
+            i += 1
+
+        # directories are matched with trailing slash, so everything inside
+        # matching directory matches too
+        if dir_only:
+            return regex + '/.*$'
+
+        return regex + '(?:/.*)?$'
+
+    def match(self, path, is_dir=False):
+        """
+        Check if entry is ignored.
+
+        :param path: Path relative to context root, separated with "/"
+        """
+        if is_dir:
+            path += '/'
+
+        if self.regex:
+            return bool(self.regex.match(path))
+
+        if not self.negations:
+            return False
+
+        ignored = False
+        for regex, negate in self.compiled:
+            if regex.match(path):
+                ignored = not negate
+
+        return ignored
+
+
+def walk_context(path, matcher=None):
+    """
+    Iterate over entries of build context, that are not ignored.
+
+    Yields (relative path, full path, lstat result) in stable order: entries
+    of directory sorted by name, then contents of it's subdirectories.
+
+    @type matcher: IgnoreMatcher
+    """
+    if not os.path.isdir(path):
+        raise OSError(errno.ENOENT, 'No such directory', path)
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        rel_root = os.path.relpath(root, path)
+
+        for name in sorted(dirs + files):
+            full_path = os.path.join(root, name)
+            rel_path = name if rel_root == '.' else '%s/%s' % (rel_root.replace(os.sep, '/'), name)
+
+            st = os.lstat(full_path)
+            is_dir = stat.S_ISDIR(st.st_mode)
+
+            # docker needs Dockerfile whatever ignore rules say
+            if matcher and rel_path != 'Dockerfile' and matcher.match(rel_path, is_dir):
+                # without "!" rules nothing inside can be re-included
+                if is_dir and not matcher.negations:
+                    dirs.remove(name)
+                continue
+
+            yield rel_path, full_path, st
+
+
+def context_sizes(path, matcher=None):
+    """
+    Return total size of files in build context and sizes per top-level entry.
+    """
+    total = 0
+    sizes = {}
+
+    for rel_path, full_path, st in walk_context(path, matcher):
+        if stat.S_ISREG(st.st_mode):
+            top = rel_path.split('/', 1)[0]
+            sizes[top] = sizes.get(top, 0) + st.st_size
+            total += st.st_size
+
+    return total, sizes
+
+
+def format_size(size):
+    if size < 1024:
+        return '%d B' % size
+
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def format_context_sizes(total, sizes, limit=5):
+    largest = sorted(sizes.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    return 'Build context: %s. Largest entries: %s' % (
+        format_size(total), ', '.join('%s %s' % (name, format_size(size)) for name, size in largest))
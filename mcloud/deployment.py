@@ -28,8 +28,37 @@ class IDeploymentPublishListener(Interface):
 
 
 
+def docker_settings():
+    """
+    Return docker section of server settings, or None if server is not configured.
+    """
+    try:
+        settings = inject.instance('settings')
+    except inject.InjectorException:
+        return None
+
+    return getattr(settings, 'docker', None)
+
+
+def docker_processes():
+    """
+    Number of processes, that send requests to docker daemon: server and it's task workers.
+    """
+    try:
+        settings = inject.instance('settings')
+    except inject.InjectorException:
+        return 1
+
+    return (getattr(settings, 'workers', 0) or 0) + 1
+
+
 class Deployment(object):
 
+    # Docker clients are shared by all Deployment instances describing the same
+    # deployment, so connection pools survive between requests.
+    # name -> (connection parameters, client)
+    clients = {}
+
     def __init__(self,
                  name=None,
                  exports=None,
@@ -84,6 +113,15 @@ class Deployment(object):
             self.key = key or None
 
 
+    @classmethod
+    def drop_client(cls, name):
+        """
+        Forget shared client of deployment and close it's connections.
+        """
+        if name in cls.clients:
+            params, client = cls.clients.pop(name)
+            client.close()
+
     def get_client(self):
         if self.client:
             return self.client
@@ -107,7 +145,54 @@ class Deployment(object):
             port = self.port or '2375'
             url = '%s://%s:%s' % (scheme, host, port)
 
-        self.client = DockerTwistedClient(url=url.encode(), key=self.key, crt=self.cert, ca=self.ca)
+        params = (url, self.key, self.cert, self.ca)
+
+        if self.name in self.clients:
+            cached_params, client = self.clients[self.name]
+
+            if cached_params == params:
+                self.client = client
+                return self.client
+
+            self.drop_client(self.name)
+
+        settings = docker_settings()
+        pool_kwargs = {}
+        if settings:
+            pool_kwargs = {
+                'pool_max_per_host': settings.pool_max_per_host,
+                'pool_idle_timeout': settings.pool_idle_timeout,
+                'pool_retry': settings.pool_retry,
+            }
+
+        self.client = DockerTwistedClient(url=url.encode(), key=self.key, crt=self.cert, ca=self.ca, **pool_kwargs)
+
+        if settings and settings.state_cache:
+            self.client.enable_state_cache()
+
+        if settings and settings.max_concurrent_requests:
+            # limit is shared by all processes
+            self.client.enable_limiter(limit=max(settings.max_concurrent_requests // docker_processes(), 2),
+                                       interactive_reserve=settings.interactive_reserve)
+
+        if settings and settings.coalesce_requests:
+            self.client.enable_coalescing()
+
+        if settings and settings.stats_stream:
+            self.client.enable_stats_collector(history=settings.stats_history)
+
+        if settings and settings.log_hub:
+            self.client.enable_log_hub(history=settings.log_history)
+
+        if settings and settings.image_index:
+            self.client.enable_image_index(reconcile_interval=settings.image_index_reconcile)
+
+        if settings and settings.max_concurrent_pulls:
+            self.client.enable_pull_coordinator(limit=settings.max_concurrent_pulls)
+
+        if self.name:
+            self.clients[self.name] = (params, self.client)
+
         return self.client
 
 
@@ -164,6 +249,10 @@ class DeploymentController(object):
 
         deployment.update(**kwargs)
 
+        # parsed tls material and pooled connections belong to old credentials
+        if any(kwargs.get(x) is not None for x in ('ca', 'cert', 'key')):
+            Deployment.drop_client(name)
+
         yield self._persist_dployment(deployment)
         data = yield deployment.load_data()
 
@@ -171,6 +260,7 @@ class DeploymentController(object):
         defer.returnValue(deployment)
 
     def remove(self, name):
+        Deployment.drop_client(name)
         self.eb.fire_event('remove-deployment', name=name)
         return self.redis.hdel('mcloud-deployments', name)
 
@@ -0,0 +1,158 @@
+import logging
+
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+
+logger = logging.getLogger('mcloud.images')
+
+
+def split_image_name(image):
+    """
+    Split image reference into repository, tag and digest.
+
+    >>> split_image_name('localhost:5000/foo/bar:1.0')
+    ('localhost:5000/foo/bar', '1.0', None)
+
+    :return: (repository, tag, digest), tag and digest may be None
+    """
+    if '@' in image:
+        repo, digest = image.split('@', 1)
+        return repo, None, digest
+
+    repo, sep, tag = image.rpartition(':')
+
+    # colon of registry port is not a tag separator
+    if not sep or '/' in tag:
+        return image, None, None
+
+    return repo, tag, None
+
+
+class ImageIndex(object):
+    """
+    Index of images present on docker daemon.
+
+    Index is loaded with single image listing and is reloaded lazily when
+    image event (pull, tag, untag, delete) arrives, our own pull or build
+    completes, or reconciliation period passes. Lookups are dict reads.
+    """
+
+    IMAGE_EVENTS = ('pull', 'tag', 'untag', 'delete', 'import')
+
+    def __init__(self, client, reconcile_interval=300):
+        """
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        self.client = client
+        self.reconcile_interval = reconcile_interval
+
+        self.tags = {}
+        """ repo:tag -> image id """
+
+        self.repos = {}
+        """ repo -> id of any image of the repository """
+
+        self.digests = {}
+        """ repo@digest -> image id """
+
+        self.ready = False
+        self.generation = 0
+        self._waiters = []
+        self._reconcile = None
+
+    def start(self):
+        if self.reconcile_interval and not self._reconcile:
+            self._reconcile = LoopingCall(self.invalidate)
+            self._reconcile.start(self.reconcile_interval, now=False)
+
+    def stop(self):
+        if self._reconcile and self._reconcile.running:
+            self._reconcile.stop()
+        self._reconcile = None
+
+    def on_event(self, event):
+        if event.get('status') in self.IMAGE_EVENTS:
+            self.invalidate()
+
+    def invalidate(self):
+        self.ready = False
+        self.generation += 1
+
+    def load(self):
+        """
+        Reload index, concurrent calls share single image listing.
+        """
+        d = defer.Deferred()
+        self._waiters.append(d)
+
+        if len(self._waiters) == 1:
+            generation = self.generation
+
+            r = self.client.images()
+            r.addCallbacks(self._on_loaded, self._on_failed, callbackArgs=(generation,))
+
+        return d
+
+    def _on_loaded(self, images, generation):
+        waiters, self._waiters = self._waiters, []
+
+        self._fill(images or [])
+
+        # something changed while we were listing, reload on next lookup
+        self.ready = generation == self.generation
+
+        for d in waiters:
+            d.callback(self)
+
+    def _on_failed(self, failure):
+        waiters, self._waiters = self._waiters, []
+
+        for d in waiters:
+            d.errback(failure)
+
+    def _fill(self, images):
+        self.tags = {}
+        self.repos = {}
+        self.digests = {}
+
+        for image in images:
+            for repo_tag in image.get('RepoTags') or []:
+                if repo_tag == '<none>:<none>':
+                    continue
+
+                self.tags[repo_tag] = image['Id']
+
+                repo, tag, digest = split_image_name(repo_tag)
+                self.repos[repo] = image['Id']
+
+            for repo_digest in image.get('RepoDigests') or []:
+                if repo_digest != '<none>@<none>':
+                    self.digests[repo_digest] = image['Id']
+
+        logger.debug('Image index is loaded: %s tags', len(self.tags))
+
+    def lookup(self, image):
+        """
+        Return id of local image, or None if image is not there.
+
+        Reference without tag matches any image of the repository.
+        """
+        repo, tag, digest = split_image_name(image)
+
+        if digest:
+            return self.digests.get(image)
+
+        if tag:
+            return self.tags.get(image)
+
+        return self.repos.get(repo)
+
+    @defer.inlineCallbacks
+    def find(self, image):
+        """
+        Same as lookup, but loads index first if it's outdated.
+        """
+        if not self.ready:
+            yield self.load()
+
+        defer.returnValue(self.lookup(image))
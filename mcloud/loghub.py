@@ -0,0 +1,199 @@
+from collections import deque
+import logging
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+logger = logging.getLogger('mcloud.loghub')
+
+
+def split_timestamp(line):
+    """
+    Split line of log requested with timestamps into (timestamp, line).
+    """
+    parts = line.split(' ', 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+class LogFeed(object):
+    """
+    Single upstream follow stream of container log, shared by subscribers.
+    """
+
+    def __init__(self, history):
+        self.lines = deque(maxlen=history)
+        """ recent (timestamp, line, stream) """
+
+        self.subscribers = []
+        self.upstream = None
+
+        self.loaded = False
+        self.backlog = None
+        """ request of log history, while it's loading """
+
+        self.waiting = []
+        """ (entry, tail) of subscribers, that wait for history to get their tail """
+
+    def on_line(self, line, stream):
+        """
+        Line of follow stream, it comes with timestamp.
+        """
+        timestamp, line = split_timestamp(line)
+        self.lines.append((timestamp, line, stream))
+
+        # subscriber may leave while we are iterating
+        for on_log, d in list(self.subscribers):
+            on_log(line, stream)
+
+    def on_history(self, history):
+        """
+        Put history in front of lines followed so far.
+
+        Lines, that were written between the two requests, come in both,
+        they are taken once. Lines are told apart by timestamp, so the same
+        text written twice is kept twice.
+
+        :param history: (timestamp, line, stream) list
+        """
+        followed = list(self.lines)
+        seen = set(followed)
+
+        self.lines.clear()
+        self.lines.extend([entry for entry in history if entry not in seen] + followed)
+        self.loaded = True
+
+        waiting, self.waiting = self.waiting, []
+        for entry, tail in waiting:
+            self.add(entry, tail)
+
+    def add(self, entry, tail):
+        if tail and not self.loaded:
+            self.waiting.append((entry, tail))
+            return
+
+        if tail:
+            for timestamp, line, stream in list(self.lines)[-tail:]:
+                entry[0](line, stream)
+
+        self.subscribers.append(entry)
+
+    def remove(self, entry):
+        self.subscribers = [x for x in self.subscribers if x is not entry]
+        self.waiting = [x for x in self.waiting if x[0] is not entry]
+
+    def entries(self):
+        return self.subscribers + [entry for entry, tail in self.waiting]
+
+
+class LogHub(object):
+    """
+    Fans out container logs to any number of subscribers.
+
+    Only one follow stream per container is open to docker, recent lines are
+    kept in memory, so new subscriber gets tail of the log without another
+    request. Stream is closed when last subscriber leaves.
+
+    Follow stream itself starts with new lines only, last `history` lines
+    are loaded by separate request when stream is opened, so tail is there
+    for every subscriber, whatever first one has asked for. Subscriber, that
+    wants tail, gets lines once history is loaded. Both are requested with
+    timestamps, lines that come in both are recognized by them.
+    """
+
+    def __init__(self, client, history=100):
+        """
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        self.client = client
+        self.history = history
+
+        self.feeds = {}
+        """ container name or id -> LogFeed """
+
+    def subscribe(self, ref, on_log, tail=0):
+        """
+        Follow container log.
+
+        on_log(line, stream) is called with last `tail` recorded lines first
+        and then with every new line. Returned deferred fires when container
+        log is over, cancel it to unsubscribe.
+
+        :param ref: Container name or id
+        """
+        ref = str(ref)
+
+        feed = self.feeds.get(ref)
+        is_new = feed is None
+
+        if is_new:
+            feed = self.feeds[ref] = LogFeed(self.history)
+
+        entry = [on_log, None]
+        d = entry[1] = defer.Deferred(lambda d: self._unsubscribe(ref, feed, entry))
+
+        feed.add(entry, min(tail, self.history))
+
+        if is_new:
+            self._open(ref, feed)
+
+        return d
+
+    def _open(self, ref, feed):
+        logger.debug('Opening log stream of %s', ref)
+
+        feed.upstream = self.client.logs(ref, feed.on_line, tail=0, timestamps=True)
+
+        # history is asked after stream is open, so no line is lost in between
+        history = []
+        feed.backlog = self.client.logs(ref, lambda line, stream: history.append(split_timestamp(line) + (stream,)),
+                                        tail=self.history, follow=False, timestamps=True)
+
+        def on_history(result):
+            feed.backlog = None
+
+            if isinstance(result, Failure):
+                if not result.check(defer.CancelledError):
+                    logger.error('Can not load log history of %s: %s', ref, result.getErrorMessage())
+                del history[:]
+
+            feed.on_history(history)
+
+        feed.backlog.addBoth(on_history)
+
+        def on_done(result):
+            if self.feeds.get(ref) is feed:
+                del self.feeds[ref]
+
+            if feed.backlog:
+                feed.backlog.cancel()
+
+            entries = feed.entries()
+            feed.subscribers = []
+            feed.waiting = []
+
+            for on_log, d in entries:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(None)
+
+        feed.upstream.addBoth(on_done)
+
+    def _unsubscribe(self, ref, feed, entry):
+        feed.remove(entry)
+
+        if not feed.entries() and feed.upstream:
+            logger.debug('Closing log stream of %s', ref)
+
+            if self.feeds.get(ref) is feed:
+                del self.feeds[ref]
+
+            feed.upstream.cancel()
+
+    def stop(self):
+        for ref, feed in self.feeds.items():
+            for entry in feed.entries():
+                entry[1].cancel()
+
+    def stats(self):
+        return dict((ref, len(feed.entries())) for ref, feed in self.feeds.items())
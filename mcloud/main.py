@@ -7,7 +7,7 @@ import traceback
 from bashutils.colors import color_text
 import inject
 from mcloud.interrupt import InterruptManager
-from mcloud.remote import TaskFailure
+from mcloud.remote import TaskFailure, Session
 
 from mcloud.rpc_client import arg_parser, subparsers, ApiRpcClient, ClientProcessInterruptHandler
 from mcloud.shell import mcloud_shell
@@ -89,7 +89,7 @@ def main(argv):
 
             @inlineCallbacks
             def call_command():
-                client = ApiRpcClient(host=args.host, settings=settings)
+                client = ApiRpcClient(host=args.host, settings=settings, detach=args.detach)
                 interrupt_manager.append(ClientProcessInterruptHandler(client))
 
                 try:
@@ -106,6 +106,8 @@ def main(argv):
                         color_text(str(e), color='yellow'),
                     )
 
+                yield Session.close_all()
+
                 interrupt_manager.manual_interrupt()
 
             call_command()
@@ -0,0 +1,265 @@
+from collections import deque
+import logging
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+logger = logging.getLogger('mcloud.outbox')
+
+
+MESSAGE = 'message'
+FRAME = 'frame'
+SKIPPED = 'skipped'
+
+
+@implementer(IPushProducer)
+class Outbox(object):
+    """
+    Outbound queue of websocket client.
+
+    Messages are queued and sent once per reactor tick. Clients, that
+    understand batches, get all messages queued during the tick in one
+    frame. Outbox is registered as producer on client transport, so while
+    transport buffer is full nothing is written and messages wait here.
+
+    When queue grows over the limit, progress messages are dropped
+    (policy "drop" discards new ones, "compact" discards oldest ones), client
+    gets a note with number of skipped messages instead. Responses, task
+    results and terminal output are never dropped.
+
+    Terminal output is held back instead: upstream producers (transports of
+    docker attach streams) are paused while outbox is paused or it's queue
+    is over the limit, and resumed when it's drained. Client, that gets more
+    than `hard_limit` messages, that can't be dropped, queued anyway (output
+    of task running in other process), is disconnected.
+    """
+    POLICIES = ('drop', 'compact')
+
+    def __init__(self, protocol, limit=1000, policy='compact', batching=False, batch_size=200, hard_limit=10000,
+                 clock=None):
+        """
+        @type protocol: mcloud.remote.MdcloudWebsocketServerProtocol
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % policy)
+
+        self.protocol = protocol
+        self.limit = limit
+        self.policy = policy
+        self.batching = batching
+        self.batch_size = batch_size
+        self.hard_limit = hard_limit
+        self.clock = clock or reactor
+
+        self.queue = deque()
+        """ [kind, payload, ticket id or None] entries """
+
+        self.droppable = 0
+        self.markers = {}
+        """ ticket id -> SKIPPED entry, that is still in the queue """
+
+        self.producers = []
+        """ upstream producers, that are paused while outbox can't keep up """
+        self.upstream_paused = False
+
+        self.paused = False
+        self.stopped = False
+        self.sent = 0
+        self.dropped = 0
+
+        self._call = None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push_message(self, message, ticket_id=None):
+        """
+        Queue message. Message with ticket id may be dropped on overflow.
+        """
+        if self.stopped:
+            return
+
+        if ticket_id is None and not self._has_room():
+            return
+
+        if ticket_id is not None and self.droppable >= self.limit:
+            if self.policy == 'drop':
+                self._skip(ticket_id, 1)
+                self._schedule()
+                return
+
+            self._compact()
+
+        self.queue.append([MESSAGE, message, ticket_id])
+        if ticket_id is not None:
+            self.droppable += 1
+
+        self._schedule()
+        self._throttle()
+
+    def push_frame(self, frame):
+        """
+        Queue raw binary frame.
+        """
+        if self.stopped or not self._has_room():
+            return
+
+        self.queue.append([FRAME, frame, None])
+        self._schedule()
+        self._throttle()
+
+    def _has_room(self):
+        """
+        Disconnect client, if there are too many messages, that can't be dropped.
+        """
+        if len(self.queue) - self.droppable < self.hard_limit:
+            return True
+
+        logger.error('Client does not keep up, %s messages queued, disconnecting', len(self.queue))
+
+        self.stopProducing()
+        self.protocol.dropConnection(abort=True)
+        return False
+
+    def add_producer(self, producer):
+        """
+        Register upstream producer (IPushProducer), that outbox pauses while it can't keep up.
+        """
+        self.producers.append(producer)
+
+        if self.upstream_paused:
+            producer.pauseProducing()
+
+    def remove_producer(self, producer):
+        if producer in self.producers:
+            self.producers.remove(producer)
+
+            if self.upstream_paused:
+                producer.resumeProducing()
+
+    def _throttle(self):
+        if not self.upstream_paused and (self.paused or len(self.queue) >= self.limit):
+            self.upstream_paused = True
+            for producer in list(self.producers):
+                producer.pauseProducing()
+
+        elif self.upstream_paused and not self.paused and len(self.queue) <= self.limit / 2:
+            self.upstream_paused = False
+            for producer in list(self.producers):
+                producer.resumeProducing()
+
+    def _skip(self, ticket_id, count):
+        self.dropped += count
+
+        marker = self.markers.get(ticket_id)
+        if marker:
+            marker[1] += count
+        else:
+            marker = self.markers[ticket_id] = [SKIPPED, count, ticket_id]
+            self.queue.append(marker)
+
+    def _compact(self):
+        """
+        Drop older half of queued droppable messages.
+        """
+        to_drop = self.droppable - self.limit / 2
+
+        queue = deque()
+        for entry in self.queue:
+            kind, payload, ticket_id = entry
+
+            if to_drop and kind == MESSAGE and ticket_id is not None:
+                to_drop -= 1
+                self.droppable -= 1
+                self.dropped += 1
+
+                marker = self.markers.get(ticket_id)
+                if marker:
+                    marker[1] += 1
+                else:
+                    marker = self.markers[ticket_id] = [SKIPPED, 1, ticket_id]
+                    queue.append(marker)
+                continue
+
+            queue.append(entry)
+
+        self.queue = queue
+
+        logger.debug('Outbox is compacted, %s messages left', len(queue))
+
+    def _schedule(self):
+        if not self._call and not self.paused and not self.stopped:
+            self._call = self.clock.callLater(0, self.flush)
+
+    def _pop_message(self):
+        kind, payload, ticket_id = self.queue.popleft()
+
+        if kind == SKIPPED:
+            del self.markers[ticket_id]
+            return {'type': 'event', 'name': 'task.progress.%s' % ticket_id,
+                    'data': '[%s messages skipped, connection is too slow]' % payload}
+
+        if ticket_id is not None:
+            self.droppable -= 1
+
+        return payload
+
+    def flush(self):
+        """
+        Write out queued messages, until transport asks us to pause.
+        """
+        self._call = None
+
+        while self.queue and not self.paused and not self.stopped:
+            if self.queue[0][0] == FRAME:
+                self.protocol.sendMessage(self.queue.popleft()[1], isBinary=True)
+                self.sent += 1
+                continue
+
+            if not self.batching:
+                self.protocol.write_message(self._pop_message())
+                self.sent += 1
+                continue
+
+            messages = []
+            while self.queue and self.queue[0][0] != FRAME and len(messages) < self.batch_size:
+                messages.append(self._pop_message())
+
+            self.protocol.write_message({'type': 'batch', 'messages': messages})
+            self.sent += len(messages)
+
+        self._throttle()
+
+    def pauseProducing(self):
+        self.paused = True
+        self._throttle()
+
+    def resumeProducing(self):
+        self.paused = False
+        self._schedule()
+        self._throttle()
+
+    def stopProducing(self):
+        self.stopped = True
+        self.queue.clear()
+        self.markers = {}
+        self.droppable = 0
+
+        # nobody reads it anymore, tasks go on
+        self.paused = False
+        self._throttle()
+        self.producers = []
+
+        if self._call and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def stats(self):
+        return {
+            'queued': len(self.queue),
+            'paused': self.paused,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'upstream_paused': self.upstream_paused,
+        }
@@ -1,6 +1,11 @@
+import traceback
+
 import inject
+import pkg_resources
+from twisted.internet.defer import inlineCallbacks
+from twisted.python import log
 from zope.interface import Interface
-from zope.interface.verify import verifyObject
+from zope.interface.verify import verifyObject, verifyClass
 
 
 class IMcloudPlugin(Interface):
@@ -13,6 +18,52 @@ class IMcloudPlugin(Interface):
         """
 
 
+@inlineCallbacks
+def load_plugins(plugins_loaded, worker=False):
+    """
+    Load plugins registered as "mcloud_plugins" entry points.
+
+    Worker process loads them too, so hooks run for tasks wherever task
+    runs, but plugin setup (start-up work of the server, like rebuilding
+    haproxy) is left to server process, and plugins with `server_only = True`
+    are not loaded in worker at all.
+    """
+    for ep in pkg_resources.iter_entry_points(group='mcloud_plugins'):
+        try:
+
+            plugin_class = ep.load()
+
+            if worker and getattr(plugin_class, 'server_only', False):
+                continue
+
+            log.msg('=' * 80)
+            log.msg('Loading plugin %s' % plugin_class)
+            log.msg('-' * 80)
+
+            yield verifyClass(IMcloudPlugin, plugin_class)
+
+            plugin = plugin_class()
+
+            if not worker:
+                yield plugin.setup()
+            plugins_loaded.append(plugin)
+
+            print "Loaded %s - OK" % plugin_class
+
+        except Exception as e:
+            print '!-' * 40
+            print e.__class__.__name__
+            print e
+            print(traceback.format_exc())
+            print '!-' * 40
+
+            log.msg('=' * 80)
+
+    log.msg('-' * 80)
+    log.msg('All plugins loaded.')
+    log.msg('=' * 80)
+
+
 def enumerate_plugins(interface):
     try:
         plugins = inject.instance('plugins')
@@ -16,6 +16,9 @@ class DockerMonitorPlugin(Plugin):
     """
     implements(IMcloudPlugin)
 
+    # events are watched by server process only
+    server_only = True
+
     client = inject.attr(IDockerClient)
     event_bus = inject.attr(EventBus)
     app_controller = inject.attr(ApplicationController)
@@ -31,4 +34,6 @@ class DockerMonitorPlugin(Plugin):
 
     def attach_to_events(self, *args):
         log.msg('Start monitoring docker events')
-        return self.client.events(self.on_event)
+
+        # share events stream with container state cache
+        self.client.enable_state_cache().listeners.append(self.on_event)
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+
+class ProgressAggregator(object):
+    """
+    Thins out progress records of image pull or build.
+
+    Records with progress bar are coalesced: only latest one per layer is
+    kept and pending records are passed out at most once per interval.
+    Other records (status changes, errors, completion) are passed out
+    immediately, after pending progress they supersede.
+    """
+
+    def __init__(self, emit, interval=0.5, clock=None):
+        self.emit = emit
+        self.interval = interval
+        self.clock = clock or reactor
+
+        self.pending = OrderedDict()
+        """ layer id -> latest progress record """
+
+        self.timer = None
+
+        self.received = 0
+        self.emitted = 0
+
+    def feed(self, record):
+        self.received += 1
+
+        layer = record.get('id')
+
+        if layer and 'progress' in record and not 'error' in record:
+            # keep position of the layer, so output order stays stable
+            self.pending[layer] = record
+
+            if not self.timer:
+                self.timer = self.clock.callLater(self.interval, self.flush)
+            return
+
+        # status change supersedes progress of the same layer
+        if layer:
+            self.pending.pop(layer, None)
+
+        if 'error' in record or not layer:
+            self.flush()
+
+        self._emit(record)
+
+    def flush(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        pending, self.pending = self.pending, OrderedDict()
+
+        for record in pending.values():
+            self._emit(record)
+
+    def close(self):
+        self.flush()
+
+    def _emit(self, record):
+        self.emitted += 1
+        self.emit(record)
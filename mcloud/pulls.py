@@ -0,0 +1,84 @@
+import json
+import logging
+
+from twisted.internet import defer
+
+logger = logging.getLogger('mcloud.pulls')
+
+
+class ActivePull(object):
+
+    def __init__(self, image):
+        self.image = image
+
+        self.tickets = []
+        self.waiters = []
+
+
+class PullCoordinator(object):
+    """
+    Runs image pulls of a deployment.
+
+    Request for image, that is being pulled already, joins in-flight pull and
+    receives it's progress. Pulls of different images run in parallel up to
+    the limit, others wait in queue.
+    """
+
+    def __init__(self, client, limit=3):
+        """
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        self.client = client
+        self.semaphore = defer.DeferredSemaphore(limit)
+
+        self.pulls = {}
+        """ repo:tag -> ActivePull """
+
+        self.joined = 0
+
+    def pull(self, name, ticket_id, tag=None):
+        image = '%s:%s' % (name, tag or 'latest')
+
+        pull = self.pulls.get(image)
+
+        if pull:
+            self.joined += 1
+            logger.debug('[%s] Joining pull of %s', ticket_id, image)
+            self.client.task_log(ticket_id, 'Image %s is being pulled by another task, waiting for it' % image)
+        else:
+            pull = self.pulls[image] = ActivePull(image)
+
+            d = self.semaphore.run(self._pull, pull, name, tag, ticket_id)
+            d.addBoth(self._done, pull)
+
+        pull.tickets.append(ticket_id)
+
+        d = defer.Deferred()
+        pull.waiters.append(d)
+        return d
+
+    def _pull(self, pull, name, tag, ticket_id):
+        def on_record(record):
+            data = json.dumps(record)
+
+            for ticket_id_ in pull.tickets:
+                self.client.task_log(ticket_id_, data)
+
+        def on_text(line):
+            for ticket_id_ in pull.tickets:
+                self.client.task_log(ticket_id_, line)
+
+        return self.client.pull_image(name, tag, on_record, on_text, ticket_id=ticket_id)
+
+    def _done(self, result, pull):
+        del self.pulls[pull.image]
+
+        for d in pull.waiters:
+            d.callback(result)
+
+    def stats(self):
+        return {
+            'active': self.semaphore.limit - self.semaphore.tokens,
+            'queued': len(self.semaphore.waiting),
+            'joined': self.joined,
+        }
@@ -1,17 +1,27 @@
+from base64 import b64encode, b64decode
+from collections import deque, OrderedDict
 import json
+import socket
+import struct
 from autobahn.twisted.resource import WSGIRootResource, WebSocketResource
 
+from mcloud import codec
+from mcloud.outbox import Outbox
 from mcloud.ssl import listen_ssl
+from mcloud.ticketlog import TicketLog
 import os
 import sys
 import inject
 from mcloud.events import EventBus
+from mcloud.util import txtimeout
 
 from twisted.internet import reactor, defer
 from twisted.internet.defer import inlineCallbacks, AlreadyCalledError, CancelledError
+from twisted.internet.error import ConnectionRefusedError
 
 from autobahn.twisted.websocket import WebSocketServerFactory
 from autobahn.twisted.websocket import WebSocketClientFactory
+from autobahn.twisted.util import sleep
 from twisted.python.failure import Failure
 from twisted.web.server import Site
 import txredisapi
@@ -28,54 +38,611 @@ class ApiError(Exception):
     pass
 
 
+class ConnectionClosed(ApiError):
+    pass
+
+
+# Binary websocket frames carry raw bytes of interactive sessions:
+# 1 byte frame type, 4 bytes ticket id, payload.
+STREAM_STDOUT = 1
+STREAM_STDIN = 2
+
+STREAM_HEADER = struct.Struct('>BI')
+
+
+def pack_stream_frame(kind, ticket_id, data):
+    return STREAM_HEADER.pack(kind, int(ticket_id)) + data
+
+
+def unpack_stream_frame(payload):
+    """
+    :return: (frame type, ticket id, data)
+    """
+    kind, ticket_id = STREAM_HEADER.unpack_from(payload)
+    return kind, ticket_id, payload[STREAM_HEADER.size:]
+
+
+def is_stream_frame(payload):
+    """
+    Tell stream frame from message encoded by binary codec.
+    """
+    return len(payload) >= STREAM_HEADER.size and ord(payload[0]) in (STREAM_STDOUT, STREAM_STDIN)
+
+
+def server_settings():
+    """
+    Return server settings, or None if they are not configured.
+    """
+    try:
+        return inject.instance('settings')
+    except inject.InjectorException:
+        return None
+
+
+class TaskScheduler(object):
+    """
+    Decides when started tasks run.
+
+    Interactive tasks (anything not listed in PRIORITIES) run right away.
+    Other tasks wait for a free slot: at most LIMITS[name] tasks of the same
+    name run at once. Waiting tasks of higher priority go first, clients
+    with the same priority take turns, and tasks of one client run in the
+    order they were started. Waiting clients get their queue position as
+    task progress.
+
+    Waiting tasks are kept in redis too. Tasks that were still waiting when
+    the server went down are queued again on start. They run without a client
+    to report to.
+
+    Running tasks are listed in redis under RUNNING_KEY, so tasks of all
+    server processes can be listed and killed from any of them. Limits are
+    per server process.
+    """
+    redis = inject.attr(txredisapi.Connection)
+
+    KEY = 'mcloud-task-queue'
+    RUNNING_KEY = 'mcloud-task-running'
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+    PRIORITIES = {
+        'start': NORMAL,
+        'create': NORMAL,
+        'stop': NORMAL,
+        'restart': NORMAL,
+        'destroy': NORMAL,
+        'remove': NORMAL,
+        'rebuild': BULK,
+        'backup': BULK,
+        'sync': BULK,
+    }
+
+    LIMITS = {
+        'start': 4,
+        'create': 4,
+        'stop': 4,
+        'restart': 4,
+        'destroy': 4,
+        'remove': 4,
+        'rebuild': 2,
+        'backup': 1,
+        'sync': 2,
+    }
+
+    def __init__(self, server, limits=None):
+        """
+        @type server: ApiRpcServer
+        """
+        self.server = server
+
+        self.limits = dict(self.LIMITS)
+        self.limits.update(limits or {})
+
+        self.queues = dict((priority, OrderedDict()) for priority in (self.NORMAL, self.BULK))
+        """ priority -> client key -> deque of waiting entries """
+
+        self.waiting = {}
+        """ ticket id -> entry """
+
+        self.running = {}
+        """ task name -> number of running tasks """
+
+        self.positions = {}
+
+    def priority(self, task_name):
+        return self.PRIORITIES.get(task_name, self.INTERACTIVE)
+
+    def submit(self, ticket_id, client, task_name, args, kwargs):
+        """
+        Run the task now or put it into queue.
+        """
+        entry = {
+            'ticket_id': ticket_id,
+            'name': task_name,
+            'args': list(args),
+            'kwargs': kwargs,
+            'priority': self.priority(task_name),
+            'client': id(client) if client else None,
+            'node': self.server.node,
+        }
+
+        if entry['priority'] == self.INTERACTIVE:
+            reactor.callLater(0, self._start, entry)
+            return
+
+        self._enqueue(entry)
+        self.redis.hset(self.KEY, ticket_id, json.dumps(entry))
+
+        reactor.callLater(0, self.dispatch)
+
+    def _enqueue(self, entry):
+        clients = self.queues[entry['priority']]
+        clients.setdefault(entry['client'], deque()).append(entry)
+        self.waiting[entry['ticket_id']] = entry
+
+    @inlineCallbacks
+    def restore(self):
+        """
+        Queue tasks, that were waiting when server stopped.
+        """
+        # tasks, that were running here, are not anymore
+        running = yield self.redis.hgetall(self.RUNNING_KEY)
+        for ticket_id, raw in running.items():
+            if json.loads(raw).get('node') == self.server.node:
+                self.redis.hdel(self.RUNNING_KEY, ticket_id)
+
+        entries = yield self.redis.hgetall(self.KEY)
+        entries = [json.loads(raw) for raw in entries.values()]
+
+        # waiting tasks of other server processes are theirs
+        entries = [entry for entry in entries if entry.get('node') in (None, self.server.node)]
+
+        for entry in sorted(entries, key=lambda entry: entry['ticket_id']):
+            if entry['ticket_id'] not in self.waiting:
+                entry['client'] = None
+                entry['node'] = self.server.node
+                self._enqueue(entry)
+
+        if entries:
+            log.msg('Restored %s waiting tasks' % len(entries))
+
+        self.dispatch()
+
+    def remove(self, ticket_id):
+        """
+        Drop waiting task.
+
+        :return: True if task was waiting
+        """
+        entry = self.waiting.pop(ticket_id, None)
+        if not entry:
+            return False
+
+        clients = self.queues[entry['priority']]
+        clients[entry['client']].remove(entry)
+        if not clients[entry['client']]:
+            del clients[entry['client']]
+
+        self.positions.pop(ticket_id, None)
+        self.redis.hdel(self.KEY, ticket_id)
+
+        return True
+
+    def _has_slot(self, task_name):
+        return self.running.get(task_name, 0) < self.limits.get(task_name, 1)
+
+    def _next(self):
+        for priority in sorted(self.queues):
+            clients = self.queues[priority]
+
+            for key, entries in clients.items():
+                # tasks of one client never overtake each other, client,
+                # whose first task is blocked, waits
+                entry = entries[0]
+
+                if self._has_slot(entry['name']):
+                    # client goes to the end of the line
+                    del clients[key]
+                    entries.popleft()
+                    if entries:
+                        clients[key] = entries
+
+                    return entry
+
+        return None
+
+    def dispatch(self):
+        """
+        Start waiting tasks, while there are free slots.
+        """
+        while True:
+            entry = self._next()
+            if not entry:
+                break
+
+            del self.waiting[entry['ticket_id']]
+            self.positions.pop(entry['ticket_id'], None)
+            self.redis.hdel(self.KEY, entry['ticket_id'])
+
+            self._start(entry)
+
+        self.report_positions()
+
+    def order(self):
+        """
+        Ticket ids of waiting tasks in order they are expected to start.
+        """
+        order = []
+
+        for priority in sorted(self.queues):
+            entries = [list(queue) for queue in self.queues[priority].values()]
+
+            # clients take turns
+            while entries:
+                for queue in list(entries):
+                    order.append(queue.pop(0)['ticket_id'])
+                    if not queue:
+                        entries.remove(queue)
+
+        return order
+
+    def report_positions(self):
+        for position, ticket_id in enumerate(self.order(), 1):
+            if self.positions.get(ticket_id) != position:
+                self.positions[ticket_id] = position
+                self.server.task_progress('Waiting in queue, position %s\n' % position, ticket_id, logged=False)
+
+    def _start(self, entry):
+        name = entry['name']
+
+        self.running[name] = self.running.get(name, 0) + 1
+
+        self.redis.hset(self.RUNNING_KEY, entry['ticket_id'], json.dumps({
+            'ticket_id': entry['ticket_id'],
+            'name': name,
+            'args': entry['args'],
+            'kwargs': entry['kwargs'],
+            'node': self.server.node,
+        }))
+
+        d = self.server.run_task(entry['ticket_id'], name, entry['args'], entry['kwargs'])
+        d.addBoth(self._finished, entry)
+
+    def _finished(self, result, entry):
+        self.running[entry['name']] -= 1
+        self.redis.hdel(self.RUNNING_KEY, entry['ticket_id'])
+
+        self.dispatch()
+
+        return result
+
+    def stats(self):
+        return {
+            'waiting': len(self.waiting),
+            'running': dict((name, count) for name, count in self.running.items() if count),
+        }
+
+
+class ReplayBuffer(object):
+    """
+    Takes place of client, that re-attaches to a ticket, while ticket log
+    is sent to it. Live events are held and passed after the log, those
+    that were in the log already are skipped.
+    """
+    binary_streams = False
+    outbox = None
+
+    def __init__(self, client):
+        self.client = client
+        self.events = []
+
+    def send_event(self, event_name, data=None, ticket_id=None, seq=None):
+        self.events.append((event_name, data, seq))
+
+    def send_entry(self, ticket_id, entry):
+        self.client.send_event('task.%s.%s' % (entry['type'], ticket_id), entry['data'], seq=entry['seq'])
+
+    def release(self, last_seq):
+        events, self.events = self.events, []
+
+        for event_name, data, seq in events:
+            if seq is None or seq > last_seq:
+                self.client.send_event(event_name, data, seq=seq)
+
+
+def node_name(settings=None):
+    """
+    Name of this server process, unique among processes sharing redis.
+    """
+    return getattr(settings, 'node_name', None) or '%s:%s' % (
+        socket.gethostname(), getattr(settings, 'websocket_port', 7080))
+
+
+class RemoteTaskError(ApiError):
+    """
+    Task failed in worker process.
+    """
+
+
 class ApiRpcServer(object):
+    """
+    Starts tasks and passes their progress and results to clients.
+
+    Several server processes may share one redis. Process, that runs the
+    task, sends events straight to the task's client when client is
+    connected to it, otherwise publishes them on event bus channels with
+    ticket id in the name:
+
+        task.progress.<ticket id>  {'data': ..., 'droppable': bool}
+        task.stdout.<ticket id>    base64 encoded output
+        task.result.<ticket id>    {'success': bool, 'result'|'error': ..., 'cancelled': bool}
+
+    Every server process passes those to it's own clients of the ticket.
+    Task is killed with task.kill.<ticket id> by the process, that has it.
+
+    Process, that runs the task, also writes it's events to TicketLog.
+    Events carry number of the log entry as 'seq', client, that lost
+    connection, re-attaches to the ticket with the last number it has seen.
+
+    With workers enabled, tasks are not executed here: task is pushed to
+    JOBS_KEY redis list, worker process runs it (see mcloud.worker).
+    LOCAL_TASKS still run here, they need the client's connection.
+    """
     redis = inject.attr(txredisapi.Connection)
     eb = inject.attr(EventBus)
 
+    JOBS_KEY = 'mcloud-task-jobs'
+
+    LOCAL_TASKS = ('list_follow',)
+    """ tasks, that run in the process client is connected to, even with workers enabled """
+
     def __init__(self):
         self.tasks = {}
         self.ticket_map = {}
         self.tasks_running = {}
 
+        settings = server_settings()
+        self.node = node_name(settings)
+        self.scheduler = TaskScheduler(self, limits=getattr(settings, 'task_limits', None))
+
+        self.workers = getattr(settings, 'workers', 0) or 0
+
+        self.ticket_log = TicketLog(limit=getattr(settings, 'task_log_limit', 1000),
+                                    ttl=getattr(settings, 'task_log_ttl', 86400))
+
+        self.remote_tasks = {}
+        """ ticket id -> {'defered': ..., 'worker': id of worker, that took the task} """
+
+        self.stdin_handlers = {}
+        """ ticket id -> callable, that writes stdin of session attached in this process """
+
+        self.attach_handlers = {}
+        """ ticket id -> callable, called when client re-attaches to the task running in this process """
+
+        self.producers = {}
+        """ ticket id -> (outbox, producer) of output stream, that client's outbox throttles """
+
+        self.subscribe()
+
+    def subscribe(self):
         self.eb.on('log-*', self.on_log)
 
+        self.eb.on('task.accepted.*', self.on_task_accepted)
+        self.eb.on('task.progress.*', self.on_task_progress)
+        self.eb.on('task.stdout.*', self.on_task_stdout)
+        self.eb.on('task.result.*', self.on_task_result)
+        self.eb.on('task.kill.*', self.on_task_kill)
+        self.eb.on('task.attached.*', self.on_task_attached)
+        self.eb.on('worker.lost', self.on_worker_lost)
+
     def on_log(self, channel, message):
-        ticket_id = channel[4:]
-        self.task_progress(message, ticket_id)
+        ticket_id = int(channel[4:])
+        self.send_progress(message, ticket_id)
+
+    def on_task_accepted(self, channel, message):
+        ticket_id = int(channel.split('.')[-1])
+
+        if ticket_id in self.remote_tasks:
+            self.remote_tasks[ticket_id]['worker'] = message['worker']
+
+    def on_task_progress(self, channel, message):
+        ticket_id = int(channel.split('.')[-1])
+        self.send_progress(message['data'], ticket_id, droppable=message['droppable'], seq=message.get('seq'))
+
+    def on_task_stdout(self, channel, message):
+        ticket_id = int(channel.split('.')[-1])
+        self.send_stdout(b64decode(message['data']), ticket_id, seq=message.get('seq'))
+
+    def on_task_result(self, channel, message):
+        ticket_id = int(channel.split('.')[-1])
+
+        task = self.remote_tasks.pop(ticket_id, None)
+
+        if task:
+            if task['defered'].called:
+                return
+
+            if message['success']:
+                task['defered'].callback(message['result'])
+            elif message.get('cancelled'):
+                task['defered'].errback(CancelledError())
+            else:
+                task['defered'].errback(RemoteTaskError(message['error']))
 
-    def task_completed(self, result, ticket_id):
+        elif message['success']:
+            self.send_result(ticket_id, 'success', message['result'], seq=message.get('seq'))
+        else:
+            self.send_result(ticket_id, 'failure', message['error'], seq=message.get('seq'))
+
+    def on_task_kill(self, channel, message):
+        self.kill_local(int(channel.split('.')[-1]))
+
+    def on_task_attached(self, channel, message):
+        ticket_id = int(channel.split('.')[-1])
+
+        if ticket_id in self.attach_handlers:
+            self.attach_handlers[ticket_id]()
+
+    def on_worker_lost(self, channel, message):
+        self.worker_lost(message)
+
+    def worker_lost(self, worker):
+        """
+        Fail tasks, that were running in worker process, that has exited.
+        """
+        for ticket_id, task in self.remote_tasks.items():
+            if task['worker'] == worker:
+                del self.remote_tasks[ticket_id]
+                task['defered'].errback(RemoteTaskError('Worker process has exited'))
+
+    def send_result(self, ticket_id, outcome, data, seq=None):
+        """
+        Send task result to client in this process and forget the ticket.
+        """
         if ticket_id in self.ticket_map:
-            self.ticket_map[ticket_id].send_event('task.success.%s' % ticket_id, result)
-            del self.tasks_running[ticket_id]
-            del self.ticket_map[ticket_id]
+            self.ticket_map[ticket_id].send_event('task.%s.%s' % (outcome, ticket_id), data, seq=seq)
+
+        self.ticket_map.pop(ticket_id, None)
 
-    def task_failed(self, error, ticket_id):
+    def task_completed(self, result, ticket_id, publish=True):
+        """
+        :param publish: log and publish result. Result of task executed by
+                        worker is logged and published by worker itself.
+        """
+        seq = None
+
+        if publish:
+            seq = self.ticket_log.finish(ticket_id, True, result)
+
+            if ticket_id not in self.ticket_map:
+                self.eb.fire_event('task.result.%s' % ticket_id, {'success': True, 'result': result, 'seq': seq})
+
+        self.send_result(ticket_id, 'success', result, seq=seq)
+        self.tasks_running.pop(ticket_id, None)
+
+    def task_failed(self, error, ticket_id, publish=True):
         print error
-        if ticket_id in self.ticket_map:
-            if isinstance(error, CancelledError):
-                s = 'Terminated.'
-            else:
-                if isinstance(error, Failure):
-                    s = str(error.value)
-                else:
-                    s = str(error)
+        if isinstance(error, Failure):
+            error = error.value
+
+        if isinstance(error, CancelledError):
+            s = 'Terminated.'
+        else:
+            s = str(error)
+
+        seq = None
+
+        if publish:
+            seq = self.ticket_log.finish(ticket_id, False, s)
+
+            if ticket_id not in self.ticket_map:
+                self.eb.fire_event('task.result.%s' % ticket_id, {
+                    'success': False,
+                    'cancelled': isinstance(error, CancelledError),
+                    'error': s,
+                    'seq': seq,
+                })
 
-            self.ticket_map[ticket_id].send_event('task.failure.%s' % ticket_id, s)
+        self.send_result(ticket_id, 'failure', s, seq=seq)
+        self.tasks_running.pop(ticket_id, None)
 
-            del self.tasks_running[ticket_id]
-            del self.ticket_map[ticket_id]
+    def task_progress(self, data, ticket_id, droppable=True, logged=True):
+        """
+        :param logged: write to ticket log, transient messages are not
+        """
+        seq = self.ticket_log.append(ticket_id, 'progress', data) if logged else None
 
-    def task_progress(self, data, ticket_id):
+        if ticket_id in self.ticket_map:
+            self.send_progress(data, ticket_id, droppable, seq=seq)
+        else:
+            self.eb.fire_event('task.progress.%s' % ticket_id, {'data': data, 'droppable': droppable, 'seq': seq})
+
+    def send_progress(self, data, ticket_id, droppable=True, seq=None):
         if ticket_id in self.ticket_map:
             # log.msg('Progress: %s' % data)
-            self.ticket_map[ticket_id].send_event('task.progress.%s' % ticket_id, data)
+            self.ticket_map[ticket_id].send_event('task.progress.%s' % ticket_id, data,
+                                                  ticket_id=ticket_id if droppable else None, seq=seq)
+
+    def task_backlog(self, ticket_id):
+        """
+        Number of messages waiting in outbound queue of the task's client.
+        """
+        outbox = getattr(self.ticket_map.get(ticket_id), 'outbox', None)
+
+        return len(outbox) if outbox is not None else 0
 
     def task_stdout(self, data, ticket_id):
+        """
+        Send raw output of interactive session to the client.
+        """
+        seq = self.ticket_log.append(ticket_id, 'stdout', b64encode(data))
+
         if ticket_id in self.ticket_map:
-            # log.msg('Progress: %s' % data)
-            self.ticket_map[ticket_id].send_event('task.stdout.%s' % ticket_id, data)
+            self.send_stdout(data, ticket_id, seq=seq)
+        else:
+            self.eb.fire_event('task.stdout.%s' % ticket_id, {'data': b64encode(data), 'seq': seq})
+
+    def register_producer(self, ticket_id, producer):
+        """
+        Let outbox of the task's client pause output stream of the task,
+        when client does not keep up. Works for client connected to this process only.
+        """
+        outbox = getattr(self.ticket_map.get(ticket_id), 'outbox', None)
+
+        if outbox is not None:
+            outbox.add_producer(producer)
+            self.producers[ticket_id] = (outbox, producer)
+
+    def unregister_producer(self, ticket_id):
+        outbox, producer = self.producers.pop(ticket_id, (None, None))
+
+        if outbox is not None:
+            outbox.remove_producer(producer)
+
+    def send_stdout(self, data, ticket_id, seq=None):
+        """
+        Clients, that asked for binary streams, get output as binary frame,
+        others as base64 encoded event.
+        """
+        if ticket_id in self.ticket_map:
+            client = self.ticket_map[ticket_id]
+
+            if getattr(client, 'binary_streams', False):
+                client.send_stream(STREAM_STDOUT, ticket_id, data)
+            else:
+                client.send_event('task.stdout.%s' % ticket_id, b64encode(data), seq=seq)
+
+    def task_stdin(self, ticket_id, data):
+        """
+        Pass raw input to interactive session.
+
+        Session attached in this process gets data directly, otherwise it's
+        published on event bus.
+        """
+        if ticket_id in self.stdin_handlers:
+            self.stdin_handlers[ticket_id](data)
+        else:
+            return self.eb.fire_event('task.stdin.%s' % ticket_id, b64encode(data))
 
     def task_kill(self, ticket_id):
+        """
+        Kill the task, wherever it runs.
+
+        :return: True, or deferred if task is not in this process
+        """
+        if self.kill_local(ticket_id):
+            return True
+
+        return self.kill_remote(ticket_id)
+
+    def kill_local(self, ticket_id):
+
+        if self.scheduler.remove(ticket_id):
+            log.msg('Task is waiting - removed from queue')
+            self.task_failed(CancelledError(), ticket_id)
+            return True
 
         if ticket_id in self.tasks_running:
             log.msg('Taks is running - killing')
@@ -85,18 +652,146 @@ class ApiRpcServer(object):
             log.msg('Taks not running - not killing')
             return False
 
+    @inlineCallbacks
+    def kill_remote(self, ticket_id):
+        """
+        Ask other server processes to kill the task.
+        """
+        running = yield self.redis.hexists(TaskScheduler.RUNNING_KEY, ticket_id)
+        waiting = yield self.redis.hexists(TaskScheduler.KEY, ticket_id)
+
+        if not running and not waiting:
+            log.msg('Task is not running anywhere - not killing')
+            defer.returnValue(False)
+
+        yield self.eb.fire_event('task.kill.%s' % ticket_id, ticket_id)
+        defer.returnValue(True)
+
     def task_list(self):
         return [{
                     'id': task_id,
                     'name': task['name'],
                     'args': task['args'],
                     'kwargs': task['kwargs'],
-                } for task_id, task in self.tasks_running.items()]
+                } for task_id, task in self.tasks_running.items()] + [{
+                    'id': task_id,
+                    'name': entry['name'],
+                    'args': entry['args'],
+                    'kwargs': entry['kwargs'],
+                    'position': self.scheduler.positions.get(task_id),
+                } for task_id, entry in self.scheduler.waiting.items()]
+
+    @inlineCallbacks
+    def cluster_task_list(self):
+        """
+        Tasks of all server processes, sharing this redis.
+        """
+        running = yield self.redis.hgetall(TaskScheduler.RUNNING_KEY)
+        waiting = yield self.redis.hgetall(TaskScheduler.KEY)
+
+        tasks = []
+
+        for raw in running.values():
+            entry = json.loads(raw)
+            tasks.append({
+                'id': entry['ticket_id'],
+                'name': entry['name'],
+                'args': entry['args'],
+                'kwargs': entry['kwargs'],
+                'node': entry.get('node'),
+            })
+
+        for raw in waiting.values():
+            entry = json.loads(raw)
+            tasks.append({
+                'id': entry['ticket_id'],
+                'name': entry['name'],
+                'args': entry['args'],
+                'kwargs': entry['kwargs'],
+                'node': entry.get('node'),
+                'position': self.scheduler.positions.get(entry['ticket_id']),
+            })
+
+        defer.returnValue(sorted(tasks, key=lambda task: task['id']))
 
     def kill_client_tasks(self, client):
+        """
+        Kill tasks of disconnected client, or just forget the client, if it
+        asked to detach on disconnect. Detached tasks run on and may be
+        re-attached to later.
+        """
+        detach = getattr(client, 'detach_on_disconnect', False)
+
         for ticket_id, task_client in self.ticket_map.items():
-            if task_client == client:
-                self.task_kill(ticket_id)
+            if task_client is client or getattr(task_client, 'client', None) is client:
+                if detach:
+                    log.msg('Client is gone, task %s continues' % ticket_id)
+                    del self.ticket_map[ticket_id]
+                else:
+                    self.task_kill(ticket_id)
+
+    @inlineCallbacks
+    def task_attach(self, client, ticket_id, offset=0):
+        """
+        Send log entries of the ticket after offset to the client, then pass
+        it events of the task as they come. Client is told how many entries
+        it has missed, if log is already trimmed past the offset.
+
+        :return: {'id': ticket id, 'running': False if task is over}
+        """
+        running = ticket_id in self.tasks_running or ticket_id in self.scheduler.waiting
+        if not running:
+            running = yield self.redis.hexists(TaskScheduler.RUNNING_KEY, ticket_id)
+        if not running:
+            running = yield self.redis.hexists(TaskScheduler.KEY, ticket_id)
+
+        # live events wait until log is sent
+        replay = ReplayBuffer(client)
+        self.ticket_map[ticket_id] = replay
+
+        try:
+            entries = yield self.ticket_log.read(ticket_id, offset)
+        except Exception:
+            self.ticket_map.pop(ticket_id, None)
+            raise
+
+        if not entries and not running:
+            self.ticket_map.pop(ticket_id, None)
+            raise ApiError('Task %s is not running and has no output after %s' % (ticket_id, offset))
+
+        if entries and entries[0]['seq'] > offset + 1:
+            # log was trimmed past the offset, client is told what is missing
+            client.send_event('task.progress.%s' % ticket_id,
+                              '[%s entries were trimmed]' % (entries[0]['seq'] - offset - 1))
+
+        last = offset
+        for entry in entries:
+            replay.send_entry(ticket_id, entry)
+            last = entry['seq']
+
+            if entry['type'] in ('success', 'failure'):
+                running = False
+
+        replay.release(last)
+
+        if running:
+            self.ticket_map[ticket_id] = client
+            self.task_attached(ticket_id)
+        else:
+            self.ticket_map.pop(ticket_id, None)
+
+        defer.returnValue({'id': ticket_id, 'running': bool(running)})
+
+    def task_attached(self, ticket_id):
+        """
+        Let the task know, that client has re-attached, wherever task runs.
+
+        Task, that does not log it's messages, may need to send it's state again.
+        """
+        if ticket_id in self.attach_handlers:
+            self.attach_handlers[ticket_id]()
+        else:
+            self.eb.fire_event('task.attached.%s' % ticket_id, ticket_id)
 
 
     @inlineCallbacks
@@ -106,59 +801,104 @@ class ApiRpcServer(object):
         """
         ticket_id = yield self.redis.incr('mcloud-ticket-id')
 
-        def _do_start():
+        self.ticket_map[ticket_id] = client
+        self.scheduler.submit(ticket_id, client, task_name, args, kwargs)
 
-            self.eb.fire_event('task.start', data={
-                'name': task_name,
-                'args': args,
-                'kwargs': kwargs
-            })
+        defer.returnValue({'success': True, 'id': ticket_id})
 
+    def run_task(self, ticket_id, task_name, args, kwargs):
+        """
+        Execute the task, returned deferred fires when task is over.
+        """
+        if self.workers and task_name not in self.LOCAL_TASKS:
+            return self.run_remote(ticket_id, task_name, args, kwargs)
+
+        self.eb.fire_event('task.start', data={
+            'name': task_name,
+            'args': args,
+            'kwargs': kwargs
+        })
+
+        try:
             if not task_name in self.tasks:
                 raise ValueError('No such task: %s' % task_name)
 
-            try:
-                task_defered = self.tasks[task_name](ticket_id, *args, **kwargs)
+            task_defered = self.tasks[task_name](ticket_id, *args, **kwargs)
 
-                task_defered.addCallback(self.task_completed, ticket_id)
-                task_defered.addErrback(self.task_failed, ticket_id)
+            self.tasks_running[ticket_id] = {
+                'defered': task_defered,
+                'name': task_name,
+                'args': args,
+                'kwargs': kwargs,
+            }
 
-                self.tasks_running[ticket_id] = {
-                    'defered': task_defered,
-                    'name': task_name,
-                    'args': args,
-                    'kwargs': kwargs,
-                }
+            task_defered.addCallback(self.task_completed, ticket_id)
+            task_defered.addErrback(self.task_failed, ticket_id)
 
-            except Exception as e:
-                self.task_failed(e.message, ticket_id)
+            return task_defered
 
-        reactor.callLater(0, _do_start)
+        except Exception as e:
+            self.task_failed(e.message, ticket_id)
+            return defer.succeed(None)
 
-        self.ticket_map[ticket_id] = client
-        defer.returnValue({'success': True, 'id': ticket_id})
+    def run_remote(self, ticket_id, task_name, args, kwargs):
+        """
+        Pass the task to worker processes.
+        """
+        def cancel(d):
+            self.remote_tasks.pop(ticket_id, None)
+            self.eb.fire_event('task.kill.%s' % ticket_id, ticket_id)
 
-    def xmlrpc_is_completed(self, ticket_id):
-        d = self.redis.get('mcloud-ticket-%s-completed' % ticket_id)
+        task_defered = defer.Deferred(cancel)
 
-        def on_result(result):
-            return result == 1
+        self.remote_tasks[ticket_id] = {'defered': task_defered, 'worker': None}
+        self.tasks_running[ticket_id] = {
+            'defered': task_defered,
+            'name': task_name,
+            'args': args,
+            'kwargs': kwargs,
+        }
 
-        d.addCallback(on_result)
-        return d
+        task_defered.addCallback(self.task_completed, ticket_id, False)
+        task_defered.addErrback(self.task_failed, ticket_id, False)
+
+        def on_push_failed(failure):
+            self.remote_tasks.pop(ticket_id, None)
+            if not task_defered.called:
+                task_defered.errback(failure)
+
+        d = self.redis.lpush(self.JOBS_KEY, json.dumps({
+            'ticket_id': ticket_id,
+            'name': task_name,
+            'args': list(args),
+            'kwargs': kwargs,
+        }))
+        d.addErrback(on_push_failed)
+
+        return task_defered
+
+    def xmlrpc_is_completed(self, ticket_id):
+        return self.ticket_log.is_completed(ticket_id)
 
     def xmlrpc_get_result(self, ticket_id):
-        d = self.redis.get('mcloud-ticket-%s-result' % ticket_id)
-        d.addCallback(lambda result: json.loads(result))
-        return d
+        return self.ticket_log.get_result(ticket_id)
 
 
 class MdcloudWebsocketServerProtocol(WebSocketServerProtocol):
     def __init__(self):
         pass
 
+    codec = codec.JSON
+    batching = False
+    outbox = None
+
     def onConnect(self, request):
-        pass
+        self.codec, protocol = codec.negotiate(request.protocols)
+
+        # clients, that negotiate codec, understand batches as well
+        self.batching = protocol is not None
+
+        return protocol
 
     def onOpen(self):
         self.factory.server.on_client_connect(self)
@@ -172,15 +912,40 @@ class MdcloudWebsocketServerProtocol(WebSocketServerProtocol):
 
         reactor.callLater(0, self.factory.server.on_message, self, payload, isBinary)
 
-    def send_event(self, event_name, data=None):
+    binary_streams = False
+    detach_on_disconnect = False
+
+    def write_message(self, message):
+        return self.sendMessage(self.codec.encode(message), isBinary=self.codec.binary)
+
+    def send_message(self, message, ticket_id=None):
+        """
+        Queue message to outbox, message with ticket id may be dropped if client is too slow.
+        """
+        if self.outbox is not None:
+            return self.outbox.push_message(message, ticket_id)
+
+        return self.write_message(message)
+
+    def send_event(self, event_name, data=None, ticket_id=None, seq=None):
         data_ = {'type': 'event', 'name': event_name, 'data': data}
+        if seq is not None:
+            data_['seq'] = seq
         # log.msg('Sent out event: %s' % event_name)
-        return self.sendMessage(json.dumps(data_))
+        return self.send_message(data_, ticket_id)
+
+    def send_stream(self, kind, ticket_id, data):
+        frame = pack_stream_frame(kind, ticket_id, data)
+
+        if self.outbox is not None:
+            return self.outbox.push_frame(frame)
+
+        return self.sendMessage(frame, isBinary=True)
 
     def send_response(self, request_id, response, success=True):
         data_ = {'type': 'response', 'id': request_id, 'success': success, 'response': response}
         # log.msg('Sent out response: %s' % request_id)
-        return self.sendMessage(json.dumps(data_))
+        return self.send_message(data_)
 
 
 class Server(object):
@@ -206,20 +971,55 @@ class Server(object):
         # log.msg('Incomming message: %s' % payload)
 
         try:
-            data = json.loads(payload)
+            if is_binary and is_stream_frame(payload):
+                kind, ticket_id, data = unpack_stream_frame(payload)
+
+                if kind == STREAM_STDIN:
+                    yield self.rpc_server.task_stdin(ticket_id, data)
+                return
+
+            data = client.codec.decode(payload)
 
             if data['task'] == 'ping':
                 yield client.send_response(data['id'], 'pong')
 
             elif data['task'] == 'kill':
-                success = self.rpc_server.task_kill(int(data['kwargs']['ticket_id']))
+                success = yield defer.maybeDeferred(self.rpc_server.task_kill, int(data['kwargs']['ticket_id']))
                 yield client.send_response(data['id'], success)
 
             elif data['task'] == 'stdin':
-                yield self.eb.fire_event('task.stdin.%s' % int(data['kwargs']['ticket_id']), data['kwargs']['data'])
+                yield self.rpc_server.task_stdin(int(data['kwargs']['ticket_id']), b64decode(data['kwargs']['data']))
+
+            elif data['task'] == 'capabilities':
+                if 'binary_streams' in data['kwargs']:
+                    client.binary_streams = bool(data['kwargs']['binary_streams'])
+                if 'detach_on_disconnect' in data['kwargs']:
+                    client.detach_on_disconnect = bool(data['kwargs']['detach_on_disconnect'])
+
+                yield client.send_response(data['id'], {
+                    'binary_streams': client.binary_streams,
+                    'detach_on_disconnect': client.detach_on_disconnect,
+                })
+
+            elif data['task'] == 'attach':
+                try:
+                    result = yield self.rpc_server.task_attach(client, int(data['kwargs']['ticket_id']),
+                                                               int(data['kwargs'].get('offset') or 0))
+                except ApiError as e:
+                    yield client.send_response(data['id'], str(e), success=False)
+                else:
+                    yield client.send_response(data['id'], result)
+
+            elif data['task'] == 'result':
+                result = yield self.rpc_server.xmlrpc_get_result(int(data['kwargs']['ticket_id']))
+                yield client.send_response(data['id'], result)
 
             elif data['task'] == 'list':
-                yield client.send_response(data['id'], self.rpc_server.task_list())
+                tasks = yield self.rpc_server.cluster_task_list()
+                yield client.send_response(data['id'], tasks)
+
+            elif data['task'] == 'clients':
+                yield client.send_response(data['id'], self.clients_stats())
 
             elif data['task'] == 'task_start':
                 ticket_id = yield self.rpc_server.task_start(client, *data['args'], **data['kwargs'])
@@ -236,6 +1036,23 @@ class Server(object):
         Method is called when new client is here
         """
         self.clients.append(client)
+
+        client.detach_on_disconnect = bool(getattr(self.settings, 'detach_on_disconnect', False))
+
+        client.outbox = Outbox(
+            client,
+            limit=getattr(self.settings, 'websocket_queue_limit', 1000),
+            policy=getattr(self.settings, 'websocket_overflow', 'compact'),
+            hard_limit=getattr(self.settings, 'websocket_hard_limit', 10000),
+            batching=client.batching
+        )
+
+        try:
+            # transport pauses outbox, when it's buffer is full
+            client.registerProducer(client.outbox, True)
+        except RuntimeError:
+            log.msg('Transport of client has producer already, no back-pressure')
+
         log.msg('Client connected')
 
     def on_client_disconnect(self, client, wasClean, code, reason):
@@ -245,10 +1062,26 @@ class Server(object):
         if client in self.clients:
             self.clients.remove(client)
 
+        if client.outbox is not None:
+            client.outbox.stopProducing()
+
         self.rpc_server.kill_client_tasks(client)
 
         log.msg('Client disconnected')
 
+    def clients_stats(self):
+        """
+        Outbound queue state of connected clients
+        """
+        stats = []
+        for client in self.clients:
+            info = {'peer': client.peer, 'codec': client.codec.name}
+            if client.outbox is not None:
+                info.update(client.outbox.stats())
+            stats.append(info)
+
+        return stats
+
     def shutdown(self):
         """
         Terminate all client sessions
@@ -308,10 +1141,12 @@ class MdcloudWebsocketClientProtocol(WebSocketClientProtocol):
     def __init__(self):
         pass
 
-    client = None
+    @property
+    def client(self):
+        return self.factory.client
 
     def onConnect(self, response):
-        pass
+        self.client.codec = codec.get_codec(response.protocol)
 
     def onOpen(self):
         self.client.protocol = self
@@ -327,18 +1162,28 @@ class MdcloudWebsocketClientProtocol(WebSocketClientProtocol):
             print("Text message received: {0}".format(payload.decode('utf8')))
         """
 
-        log.msg('Websocket client in: %s' % payload)
+        if not is_binary:
+            log.msg('Websocket client in: %s' % payload)
         reactor.callLater(0, self.client.on_message, payload, is_binary)
 
     def onClose(self, wasClean, code, reason):
         self.client.onClose(wasClean, code, reason)
 
 
+class MdcloudWebsocketClientFactory(WebSocketClientFactory):
+    client = None
+
+    def clientConnectionFailed(self, connector, reason):
+        if not self.client.onc.called:
+            self.client.onc.errback(reason)
+
+
 class Client(object):
     def __init__(self, host='127.0.0.1', port=7080, settings=None, no_ssl=False):
         self.port = port
         self.host = host
         self.onc = None
+        self.closed = None
         self.protocol = None
         self.request_id = 0
         self.request_map = {}
@@ -347,22 +1192,46 @@ class Client(object):
 
         self.task_map = {}
 
+        self.binary_streams = False
+        self.codec = codec.JSON
+
     def send(self, data):
         log.msg('Send message: %s' % data)
         return self.protocol.sendMessage(data)
 
+    def send_message(self, message):
+        return self.protocol.sendMessage(self.codec.encode(message), isBinary=self.codec.binary)
+
     def shutdown(self):
         if self.protocol:
             self.protocol.sendClose()
 
     def on_message(self, data, is_binary=False):
 
-        log.msg('Client in: %s' % data)
+        if is_binary and is_stream_frame(data):
+            kind, task_id, payload = unpack_stream_frame(data)
+
+            if kind == STREAM_STDOUT and task_id in self.task_map:
+                self.task_map[task_id].on_stdout(payload)
+            return
 
         try:
-            data = json.loads(data)
+            data = self.codec.decode(data)
         except ValueError:
-            raise Exception('Invalid json: %s' % data)
+            raise Exception('Invalid message: %r' % data)
+
+        log.msg('Client in: %s' % data)
+
+        self.dispatch(data)
+
+    def dispatch(self, data):
+        if data['type'] == 'batch':
+            for message in data['messages']:
+                try:
+                    self.dispatch(message)
+                except Exception:
+                    log.err()
+            return
 
         if data['type'] == 'response':
             if data['id'] in self.request_map:
@@ -387,22 +1256,36 @@ class Client(object):
                     raise Exception('Unknown task event: %s' % etype)
 
                 if task_id in self.task_map:
+                    task = self.task_map[task_id]
                     method = 'on_%s' % etype
+
+                    seq = data.get('seq')
+                    if seq is not None:
+                        # replayed after re-attach and received already
+                        if seq <= task.offset:
+                            return
+                        task.offset = seq
+
+                    if etype == 'stdout':
+                        data['data'] = b64decode(data['data'])
+
                     try:
-                        # call one of on_progress, on_failure, on_success, on_stdin
-                        getattr(self.task_map[task_id], method)(data['data'])
+                        # call one of on_progress, on_failure, on_success, on_stdout
+                        getattr(task, method)(data['data'])
                     except AlreadyCalledError:
                         log.msg('Callback alredy called: %s. Skipping' % method)
                 else:
                     raise Exception('Unknown task id: %s' % task_id)
 
     def connect(self):
-        factory = WebSocketClientFactory("ws://%s:%s/ws/" % (self.host, self.port), debug=False)
+        factory = MdcloudWebsocketClientFactory("ws://%s:%s/ws/" % (self.host, self.port),
+                                                protocols=codec.codec_names(), debug=False)
         factory.noisy = True
         factory.protocol = MdcloudWebsocketClientProtocol
-        factory.protocol.client = self
+        factory.client = self
 
         self.onc = defer.Deferred()
+        self.closed = defer.Deferred()
 
         key_path = os.path.expanduser('~/.mcloud/%s.key' % self.host)
         crt_path = os.path.expanduser('~/.mcloud/%s.crt' % self.host)
@@ -446,17 +1329,37 @@ class Client(object):
             'kwargs': kwargs,
         }
 
-        self.send(json.dumps(msg))
+        self.send_message(msg)
 
         return d
 
     def onClose(self, wasClean, code, reason):
+        self.protocol = None
 
         if not wasClean:
             print('Connection closed: %s (code: %s)' % (reason, code))
 
             # reactor.stop()
 
+        message = 'Connection closed: %s' % reason
+
+        if self.onc and not self.onc.called:
+            self.onc.errback(ConnectionClosed(message))
+
+        # nobody is going to answer requests or finish tasks sent over this connection
+        requests, self.request_map = self.request_map, {}
+        for d in requests.values():
+            d.errback(ConnectionClosed(message))
+
+        tasks, self.task_map = self.task_map, {}
+        for task in tasks.values():
+            if task.is_running:
+                task.lost = True
+                task.on_failure(message)
+
+        if self.closed and not self.closed.called:
+            self.closed.callback(None)
+
     @inlineCallbacks
     def terminate_task(self, task_id):
         result = yield self.call_sync('kill', ticket_id=task_id)
@@ -467,9 +1370,66 @@ class Client(object):
         defer.returnValue(result)
 
     @inlineCallbacks
+    def attach(self, task, ticket_id, offset=0):
+        """
+        Follow task started earlier. Output after offset is replayed first.
+
+        @type task: Task
+        """
+        task.id = ticket_id
+        task.offset = offset
+        task.client = self
+
+        task.is_running = True
+        task.lost = False
+        task.failure = False
+        task.response = None
+        task.wait = None
+
+        self.task_map[ticket_id] = task
+
+        try:
+            result = yield self.call_sync('attach', ticket_id=ticket_id, offset=offset)
+        except Exception:
+            self.task_map.pop(ticket_id, None)
+            task.is_running = False
+            raise
+
+        # log is replayed before response, so result is here if task is over
+        if not result['running'] and task.is_running:
+            task.on_failure('Task is not running anymore')
+
+        defer.returnValue(task)
+
+    @inlineCallbacks
+    def detach_on_disconnect(self):
+        """
+        Ask server to keep tasks running, when connection is lost.
+        """
+        result = yield self.call_sync('capabilities', detach_on_disconnect=True)
+        defer.returnValue(bool(result and result.get('detach_on_disconnect')))
+
+    @inlineCallbacks
+    def enable_binary_streams(self):
+        """
+        Ask server to send output of interactive sessions as binary frames.
+        """
+        result = yield self.call_sync('capabilities', binary_streams=True)
+        self.binary_streams = bool(result and result.get('binary_streams'))
+
+        defer.returnValue(self.binary_streams)
+
     def task_stdin(self, task_id, data):
-        result = yield self.call_sync('stdin', ticket_id=task_id, data=data)
-        defer.returnValue(result)
+        """
+        Send raw input to interactive session.
+        """
+        if self.binary_streams:
+            self.protocol.sendMessage(pack_stream_frame(STREAM_STDIN, task_id, data), isBinary=True)
+            return defer.succeed(None)
+
+        # server does not reply to stdin messages
+        self.send_message({'task': 'stdin', 'kwargs': {'ticket_id': task_id, 'data': b64encode(data)}})
+        return defer.succeed(None)
 
     def task_list(self):
         return self.call_sync('list')
@@ -512,9 +1472,20 @@ class Task(object):
         self.wait = None
         self.client = None
 
+        self.offset = 0
+        """ number of the last ticket log entry received """
+
+        self.lost = False
+        """ connection was lost while task was running """
+
     def on_progress(self, data):
         self.data.append(data)
 
+    def on_stdout(self, data):
+        """
+        Output of interactive session, replaced by those who show it.
+        """
+
     def on_stdin(self, data):
         return self.client.task_stdin(self.id, data)
 
@@ -532,10 +1503,202 @@ class Task(object):
             self.wait.errback(TaskFailure(result))
 
     def wait_result(self):
+        # result may arrive in the same batch with task id
+        if self.id is not None and not self.is_running:
+            if self.failure:
+                return defer.fail(TaskFailure(self.response))
+            return defer.succeed(self.response)
+
         self.wait = defer.Deferred()
         return self.wait
 
 
+class Session(object):
+    """
+    Long-lived connection to mcloud server shared by many tasks.
+
+    Connection is opened on first use and opened again after it's lost.
+    Requests don't wait for each other, any number of tasks may run over the
+    connection at once. Sessions are kept per server and detach mode, so
+    commands of the shell and iterations of follow modes reuse the same
+    connection.
+
+    With detach, server keeps tasks running when connection is lost, and
+    session re-attaches to them after it connects again.
+    """
+
+    sessions = {}
+    """ (host, port, detach) -> Session """
+
+    def __init__(self, host='127.0.0.1', port=7080, settings=None, no_ssl=False, timeout=20, retries=3,
+                 detach=False):
+        self.host = host
+        self.port = port
+        self.settings = settings
+        self.no_ssl = no_ssl
+        self.timeout = timeout
+        self.retries = retries
+        self.detach = detach
+
+        self.client = None
+        self._waiters = None
+
+    @classmethod
+    def get(cls, host='127.0.0.1', port=7080, settings=None, detach=False):
+        # detached and attached tasks do not share connection, it's lost differently
+        key = (host, int(port), bool(detach))
+
+        if key not in cls.sessions:
+            cls.sessions[key] = cls(host=host, port=int(port), settings=settings, detach=detach)
+
+        return cls.sessions[key]
+
+    @classmethod
+    def close_all(cls):
+        sessions, cls.sessions = cls.sessions.values(), {}
+        return defer.gatherResults([session.close() for session in sessions])
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.protocol is not None
+
+    def connect(self):
+        """
+        Return connected client, concurrent callers share one handshake.
+
+        @rtype: Client
+        """
+        if self.connected:
+            return defer.succeed(self.client)
+
+        d = defer.Deferred()
+
+        if self._waiters is not None:
+            self._waiters.append(d)
+            return d
+
+        self._waiters = [d]
+
+        def done(result):
+            waiters, self._waiters = self._waiters, None
+
+            for waiter in waiters:
+                if isinstance(result, Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+
+        self._open().addBoth(done)
+
+        return d
+
+    @inlineCallbacks
+    def _open(self):
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            client = Client(host=self.host, port=self.port, settings=self.settings, no_ssl=self.no_ssl)
+
+            try:
+                yield txtimeout(client.connect(), self.timeout,
+                                'Can\'t connect to the server on host %s' % self.host)
+                break
+
+            except (ConnectionRefusedError, ConnectionClosed):
+                if attempt >= self.retries:
+                    raise
+
+                log.msg('Connection to %s failed, retrying' % self.host)
+                yield sleep(0.5 * attempt)
+
+        if self.detach:
+            yield client.detach_on_disconnect()
+
+        self.client = client
+        defer.returnValue(client)
+
+    @inlineCallbacks
+    def call(self, task, *args, **kwargs):
+        """
+        Start the task and wait for it's result.
+
+        @type task: Task
+        """
+        client = yield self.connect()
+        yield client.call(task, *args, **kwargs)
+
+        result = yield self._wait(client, task)
+        defer.returnValue(result)
+
+    @inlineCallbacks
+    def attach(self, task, ticket_id, offset=0):
+        """
+        Follow task started earlier and wait for it's result.
+
+        @type task: Task
+        """
+        client = yield self.connect()
+        yield client.attach(task, ticket_id, offset)
+
+        result = yield self._wait(client, task)
+        defer.returnValue(result)
+
+    @inlineCallbacks
+    def _wait(self, client, task):
+        try:
+            while True:
+                try:
+                    result = yield task.wait_result()
+                    break
+
+                except TaskFailure:
+                    if not (self.detach and task.lost):
+                        raise
+
+                log.msg('Connection lost, re-attaching to task %s' % task.id)
+
+                client = yield self.connect()
+                yield client.attach(task, task.id, task.offset)
+        finally:
+            client.task_map.pop(task.id, None)
+
+        defer.returnValue(result)
+
+    @inlineCallbacks
+    def request(self, name, *args, **kwargs):
+        """
+        Send request, that is answered by server itself (ping, list, kill).
+        """
+        client = yield self.connect()
+        result = yield client.call_sync(name, *args, **kwargs)
+
+        defer.returnValue(result)
+
+    @inlineCallbacks
+    def terminate_task(self, task):
+        """
+        Kill running task, connection stays open.
+        """
+        if not self.connected or task.id is None:
+            defer.returnValue(False)
+
+        result = yield self.client.terminate_task(task.id)
+        defer.returnValue(result)
+
+    def close(self):
+        if not self.connected:
+            return defer.succeed(None)
+
+        client, self.client = self.client, None
+
+        client.shutdown()
+
+        # don't hang if server does not complete closing handshake
+        return txtimeout(client.closed, 1, 'Closing handshake timed out').addErrback(lambda failure: None)
+
+
 if __name__ == '__main__':
     from twisted.python import log
 
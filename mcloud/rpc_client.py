@@ -13,7 +13,6 @@ from mcloud.application import Application
 from mcloud.attach import AttachStdinProtocol
 from mcloud.config import YamlConfig
 from mcloud.sync import get_storage, rsync_folder
-from mcloud.util import txtimeout
 
 import re
 import os
@@ -60,6 +59,8 @@ arg_parser = argparse.ArgumentParser(
 )
 arg_parser.add_argument('-v', '--verbose', help='Show more logs', action='store_true', default=False)
 arg_parser.add_argument('--host', help='Host to use', default=None)
+arg_parser.add_argument('--detach', help='Keep tasks running if connection is lost and re-attach to them',
+                        action='store_true', default=False)
 arg_parser.add_argument(
     '-V', '--version',
     action='version',
@@ -175,17 +176,18 @@ class ClientProcessInterruptHandler(object):
 
     @inlineCallbacks
     def interrupt(self, last=None):
-        if self.client.current_client:
-            yield self.client.current_client.shutdown()
-            yield sleep(0.05)
+        task = self.client.current_task
 
-            if self.client.current_task and self.client.current_task.wait:
-                self.client.current_task.wait.cancel()
-                yield sleep(0.05)
+        # session stays open for next commands, only the task is killed
+        if task and task.is_running:
+            yield self.client.session.terminate_task(task)
+
+        if task and task.wait:
+            task.wait.cancel()
 
 
 class ApiRpcClient(object):
-    def __init__(self, host=None, port=None, settings=None):
+    def __init__(self, host=None, port=None, settings=None, detach=False):
 
         if not host:
             # manual variable
@@ -208,10 +210,16 @@ class ApiRpcClient(object):
         self.host = host
         self.port = int(port)
         self.settings = settings
+        self.detach = detach
 
-        self.current_client = None
         self.current_task = None
 
+    @property
+    def session(self):
+        from mcloud.remote import Session
+
+        return Session.get(self.host, self.port, self.settings, detach=self.detach)
+
     @contextmanager
     def override_host(self, host):
         back = self.host
@@ -221,26 +229,49 @@ class ApiRpcClient(object):
 
     @inlineCallbacks
     def _remote_exec(self, task_name, *args, **kwargs):
-        from mcloud.remote import Client, Task
-
-        client = Client(host=self.host, port=self.port, settings=self.settings)
-        self.current_client = client
-
-        yield txtimeout(client.connect(), 20, 'Can\'t connect to the server on host %s' % self.host)
+        from mcloud.remote import Task
 
         task = Task(task_name)
         task.on_progress = self.print_progress
 
         self.current_task = task
 
-        yield client.call(task, *args, **kwargs)
-
-        res = yield task.wait_result()
-        yield client.shutdown()
-        yield sleep(0.1)
+        res = yield self.session.call(task, *args, **kwargs)
 
         defer.returnValue(res)
 
+    def _follow_list(self, on_list, history=False):
+        """
+        Call on_list with application list every time it changes on server.
+        """
+        from mcloud.applist import apply_patch
+        from mcloud.remote import Task
+
+        state = {'apps': {}, 'rev': None}
+
+        def on_progress(data):
+            if not isinstance(data, dict) or not 'list' in data:
+                return self.print_progress(data)
+
+            if data['list'] == 'snapshot':
+                state['apps'] = data['apps']
+            elif state['rev'] is not None and data['rev'] == state['rev'] + 1:
+                state['apps'] = apply_patch(state['apps'], data['ops'])
+            else:
+                # deltas missed (after reconnect), snapshot is on it's way
+                return
+
+            state['rev'] = data['rev']
+
+            on_list(sorted(state['apps'].values(), key=lambda app: app['name']))
+
+        task = Task('list_follow')
+        task.on_progress = on_progress
+
+        self.current_task = task
+
+        return self.session.call(task, history=history)
+
     def print_progress(self, message):
 
         try:
@@ -272,11 +303,14 @@ class ApiRpcClient(object):
         stream_proto = AttachStdinProtocol()
         stdio.StandardIO(stream_proto)
 
-        from mcloud.remote import Client, Task
+        from mcloud.remote import Task
 
-        client = Client(host=self.host, port=self.port, settings=self.settings)
         try:
-            yield txtimeout(client.connect(), 20, 'Can\'t connect to the server on host %s' % self.host)
+            client = yield self.session.connect()
+
+            # terminal traffic goes as raw bytes in binary frames
+            if not client.binary_streams:
+                yield client.enable_binary_streams()
 
             task = Task(task_name)
             task.on_progress = self.print_progress
@@ -284,12 +318,10 @@ class ApiRpcClient(object):
 
             stream_proto.listener = task.on_stdin
 
-            try:
-                yield client.call(task, *args, size=stream_proto.term.get_size())
+            self.current_task = task
 
-                res = yield task.wait_result()
-                yield client.shutdown()
-                yield sleep(0.1)
+            try:
+                res = yield self.session.call(task, *args, size=stream_proto.term.get_size())
 
                 defer.returnValue(res)
 
@@ -303,6 +335,20 @@ class ApiRpcClient(object):
         finally:
             stream_proto.stop()
 
+    def format_trend(self, history):
+        """
+        Show whether latest value is above or below recent average.
+        """
+        if not history or len(history) < 2:
+            return ''
+
+        average = sum(history) / len(history)
+        if history[-1] > average * 1.1:
+            return ' ^'
+        elif history[-1] < average * 0.9:
+            return ' v'
+        return ' ='
+
     def print_app_details(self, app):
 
         out = '\n'
@@ -354,7 +400,8 @@ class ApiRpcClient(object):
 
             if service['running']:
                 cpu = (("%.2f" % float(service['stats'].get('cpu_usage', 0.0))) + '%')
-                memory = (str(service['stats'].get('memory_usage', 0) / (1024 * 1024)) + 'M')
+                cpu += self.format_trend(service.get('cpu_history'))
+                memory = '%dM' % (service['stats'].get('memory_usage', 0) / (1024 * 1024))
                 net_tx = ("%.4f" % (service['stats'].get('net_tx', 0.0) / (1024.0 * 1024.0)) + 'M')
                 net_rx = ("%.4f" % (service['stats'].get('net_rx', 0.0) / (1024.0 * 1024.0)) + 'M')
                 net = '%s / %s' % (net_rx, net_tx)
@@ -401,7 +448,7 @@ class ApiRpcClient(object):
             app_status = service_status
 
             cpu = ('%.2f' % app['stats'].get('cpu_usage', 0.0)) + '%'
-            memory = str(app['stats'].get('memory_usage', 0) / (1024 * 1024)) + 'M'
+            memory = '%dM' % (app['stats'].get('memory_usage', 0) / (1024 * 1024))
 
             net_tx = ("%.4f" % (app['stats'].get('net_tx', 0.0) / (1024.0 * 1024.0)) + 'M')
             net_rx = ("%.4f" % (app['stats'].get('net_rx', 0.0) / (1024.0 * 1024.0)) + 'M')
@@ -575,10 +622,7 @@ class ApiRpcClient(object):
             self.last_lines = ret.count('\n') + 2
 
         if follow:
-            while follow:
-                ret = yield self._remote_exec('list')
-                _print(ret)
-                yield sleep(1)
+            yield self._follow_list(_print)
         else:
             ret = yield self._remote_exec('list')
             _print(ret)
@@ -839,12 +883,9 @@ class ApiRpcClient(object):
             print ret
 
         if follow:
-            while follow:
-                ret = yield self._remote_exec('list')
-                _print(ret)
-                yield sleep(1)
+            yield self._follow_list(_print, history=True)
         else:
-            ret = yield self._remote_exec('list')
+            ret = yield self._remote_exec('list', history=True)
             _print(ret)
 
     ############################################################
@@ -1175,21 +1216,14 @@ class ApiRpcClient(object):
     @cli('List running tasks')
     @inlineCallbacks
     def ps(self, **kwargs):
-        from mcloud.remote import Client
-
-        client = Client(host=self.host, settings=self.settings)
         try:
-            yield client.connect()
-            tasks = yield client.task_list()
+            tasks = yield self.session.request('list')
 
             print tasks
 
         except ConnectionRefusedError:
             print 'Can\'t connect to mcloud server'
 
-        yield client.shutdown()
-        yield sleep(0.01)
-
     ############################################################
 
     @cli('Kills task', arguments=(
@@ -1197,12 +1231,8 @@ class ApiRpcClient(object):
     ))
     @inlineCallbacks
     def kill(self, task_id=None, **kwargs):
-        from mcloud.remote import Client
-
-        client = Client(host=self.host, settings=self.settings)
         try:
-            yield client.connect()
-            success = yield client.terminate_task(task_id)
+            success = yield self.session.request('kill', ticket_id=task_id)
 
             if not success:
                 print 'Task not found by id'
@@ -1213,8 +1243,31 @@ class ApiRpcClient(object):
         except ConnectionRefusedError:
             print 'Can\'t connect to mcloud server'
 
-        client.shutdown()
-        yield sleep(0.01)
+    ############################################################
+
+    @cli('Shows output of the task started earlier and waits for it\'s result', arguments=(
+            arg('task_id', type=int, help='Id of the task'),
+            arg('--offset', type=int, default=0, help='Skip output entries up to this number'),
+    ))
+    @inlineCallbacks
+    def attach(self, task_id=None, offset=0, **kwargs):
+        from mcloud.remote import Task
+
+        task = Task('attach')
+        task.on_progress = self.print_progress
+        task.on_stdout = sys.stdout.write
+
+        self.current_task = task
+
+        try:
+            result = yield self.session.attach(task, task_id, offset)
+
+            if result is not None:
+                print '\n'
+                pprintpp.pprint(result)
+
+        except ConnectionRefusedError:
+            print 'Can\'t connect to mcloud server'
 
 
         ############################################################
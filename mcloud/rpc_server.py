@@ -6,12 +6,10 @@ import os
 import sys
 import netifaces
 from traceback import print_tb
-import traceback
 
 import inject
 from mcloud.deployment import DeploymentController
-from mcloud.plugin import IMcloudPlugin
-import pkg_resources
+from mcloud.plugin import load_plugins
 from twisted.internet import reactor
 from twisted.internet._sslverify import KeyPair
 from twisted.internet.defer import inlineCallbacks
@@ -19,7 +17,6 @@ from twisted.internet.protocol import Factory
 import txredisapi
 from twisted.python import log
 from mcloud.util import txtimeout
-from zope.interface.verify import verifyClass
 
 
 log.startLogging(sys.stdout)
@@ -33,6 +30,8 @@ def get_argparser():
     parser = argparse.ArgumentParser(description='Mcloud rpc server')
     parser.add_argument('--config', default='/etc/mcloud/mcloud-server.yml', help='Config file path')
     parser.add_argument('--no-ssl', default=False, action='store_true', help='Disable ssl')
+    parser.add_argument('--workers', type=int, default=None, help='Number of task worker processes')
+    parser.add_argument('--worker', default=False, action='store_true', help='Run as task worker process')
 
     return parser
 
@@ -52,6 +51,25 @@ class RedisConfiguration(Configuration):
     dbid = 1
     timeout = 3
 
+class DockerConfiguration(Configuration):
+    pool_max_per_host = 10
+    pool_idle_timeout = 240
+    pool_retry = True
+    state_cache = True
+    stats_stream = True
+    stats_history = 60
+    coalesce_requests = False
+    # for all processes, server and each of task workers get equal part of it
+    max_concurrent_requests = 20
+    interactive_reserve = 5
+    log_hub = True
+    log_history = 100
+    build_context_gzip = False
+    build_cache = True
+    image_index = True
+    image_index_reconcile = 300
+    max_concurrent_pulls = 3
+
 class McloudConfiguration(Configuration):
     haproxy = False
     web = True
@@ -61,6 +79,26 @@ class McloudConfiguration(Configuration):
 
     websocket_ip = '0.0.0.0'
     websocket_port = 7080
+    websocket_queue_limit = 1000
+    websocket_overflow = 'compact'
+    websocket_hard_limit = 10000
+
+    # task name -> how many tasks with this name may run at once
+    task_limits = {}
+
+    # name of this server among servers sharing redis, host:port if not set
+    node_name = None
+
+    # output of every task is kept in redis: entries per task, seconds
+    task_log_limit = 1000
+    task_log_ttl = 86400
+
+    # keep tasks of disconnected clients running, clients may ask for it themselves
+    detach_on_disconnect = False
+
+    # tasks run in worker processes, when there are any
+    workers = 0
+    worker_concurrency = 20
 
     dns_search_suffix = 'mcloud.lh'
 
@@ -68,6 +106,8 @@ class McloudConfiguration(Configuration):
 
     redis = RedisConfiguration()
 
+    docker = DockerConfiguration()
+
     home_dir = '/root/.mcloud'
     btrfs = False
     demo_mode = False
@@ -96,6 +136,9 @@ def entry_point():
     if args.no_ssl:
         settings.ssl.enabled = False
 
+    if args.workers is not None:
+        settings.workers = args.workers
+
     def resolve_host_ip():
 
         if 'docker0' in netifaces.interfaces():
@@ -148,49 +191,79 @@ def entry_point():
         tasks = inject.instance(TaskService)
         api.tasks = tasks.collect_tasks()
 
+        yield api.scheduler.restore()
+
+        if settings.workers:
+            from mcloud.worker import WorkerPool
+
+            log.msg('Starting %d task workers' % settings.workers)
+            pool = WorkerPool(settings.workers, ['--worker', '--config', args.config])
+            pool.start()
+            reactor.addSystemEventTrigger('before', 'shutdown', pool.stop)
+
         log.msg('Starting rpc listener on port %d' % settings.websocket_port)
         server = Server(port=settings.websocket_port)
         server.bind()
 
-        # load plugins
-        for ep in pkg_resources.iter_entry_points(group='mcloud_plugins'):
-            try:
+        yield load_plugins(plugins_loaded)
 
-                plugin_class = ep.load()
+        deployment_controller = inject.instance(DeploymentController)
+        yield deployment_controller.configure_docker_machine()
 
-                log.msg('=' * 80)
-                log.msg('Loading plugin %s' % plugin_class)
-                log.msg('-' * 80)
+        log.msg('Started.')
 
-                yield verifyClass(IMcloudPlugin, plugin_class)
 
-                plugin = plugin_class()
+    @inlineCallbacks
+    def run_worker(redis):
 
-                yield plugin.setup()
-                plugins_loaded.append(plugin)
+        from mcloud.events import EventBus
+        from mcloud.remote import ApiRpcServer
+        from mcloud.tasks import TaskService
+        from mcloud.worker import TaskWorker, WorkerRpcServer, ParentWatcher
+        from twisted.internet import stdio
 
-                print "Loaded %s - OK" % plugin_class
+        log.msg('Running worker')
 
-            except Exception as e:
-                print '!-' * 40
-                print e.__class__.__name__
-                print e
-                print(traceback.format_exc())
-                print '!-' * 40
+        eb = EventBus(redis)
+        yield eb.connect()
 
-                # reactor.stop()
+        plugins_loaded = []
 
-                log.msg('=' * 80)
+        def my_config(binder):
+            binder.bind(txredisapi.Connection, redis)
+            binder.bind(EventBus, eb)
+            binder.bind_to_constructor(ApiRpcServer, WorkerRpcServer)
 
-        log.msg('-' * 80)
-        log.msg('All plugins loaded.')
-        log.msg('=' * 80)
+            binder.bind('settings', settings)
 
-        deployment_controller = inject.instance(DeploymentController)
-        yield deployment_controller.configure_docker_machine()
+            binder.bind('host-ip', resolve_host_ip())
+            binder.bind('dns-search-suffix', settings.dns_search_suffix)
+            binder.bind('plugins', plugins_loaded)
 
-        log.msg('Started.')
+        inject.configure(my_config)
+
+        api = inject.instance(ApiRpcServer)
+        tasks = inject.instance(TaskService)
+        api.tasks = tasks.collect_tasks()
+
+        # services started by tasks here need the same hooks as in server
+        yield load_plugins(plugins_loaded, worker=True)
+
+        # blocking pop holds connection, so queue is read over separate one
+        queue = yield txredisapi.Connection(
+            dbid=settings.redis.dbid,
+            host=settings.redis.host,
+            port=settings.redis.port,
+            password=settings.redis.password
+        )
+
+        worker = TaskWorker(queue, concurrency=settings.worker_concurrency)
+        worker.start()
+
+        # stdout is shared with server process, keep it out of reactor
+        stdio.StandardIO(ParentWatcher(), stdout=os.open(os.devnull, os.O_WRONLY))
 
+        log.msg('Worker started.')
 
     def timeout():
         print('Can not connect to redis!')
@@ -206,7 +279,7 @@ def entry_point():
         host=settings.redis.host,
         port=settings.redis.port,
         password=settings.redis.password
-    ), settings.redis.timeout, timeout).addCallback(run_server)
+    ), settings.redis.timeout, timeout).addCallback(run_worker if args.worker else run_server)
 
     reactor.run()
 
@@ -5,6 +5,7 @@ from pprintpp import pprint
 import re
 import inject
 from mcloud.remote import ApiRpcServer
+from mcloud.stats import sample_stats
 from mcloud.txdocker import IDockerClient, DockerConnectionFailed, DockerTwistedClient
 from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks, returnValue
@@ -86,6 +87,7 @@ class Service(object):
         self.wait = False
 
         self._stats = None
+        self._stats_history = []
 
         self.__dict__.update(kwargs)
         super(Service, self).__init__()
@@ -107,12 +109,22 @@ class Service(object):
         self._inspected = True
 
         try:
-            data = yield self.client.inspect(self.name)
+            state_cache = getattr(self.client, 'state_cache', None)
+            if state_cache:
+                data = yield state_cache.inspect(self.name)
+            else:
+                data = yield self.client.inspect(self.name)
             self._inspect_data = data
 
             if self.is_running():
-                data = yield self.client.stats(self.id)
-                self._stats = data
+                stats_collector = getattr(self.client, 'stats_collector', None)
+                if stats_collector:
+                    stats_collector.watch(self.id)
+                    self._stats = stats_collector.stats(self.id)
+                    self._stats_history = stats_collector.history(self.id)
+                else:
+                    data = yield self.client.stats(self.id)
+                    self._stats = sample_stats(data) if data else None
 
         except DockerConnectionFailed as e:
             self.error = 'Can not connect to docker: %s. %s' % (self.client.url, e)
@@ -125,18 +137,14 @@ class Service(object):
         if not self.is_inspected():
             raise self.NotInspectedYet()
 
-        data = self._stats
-
-        if not data:
-            return None
+        return self._stats
 
-        return {
-            'cpu_usage': 100.0 * float(data['cpu_stats']['cpu_usage']['total_usage']) / (data['cpu_stats']['system_cpu_usage']),
-            'memory_usage': data['memory_stats']['usage'],
-            'memory_limit': data['memory_stats']['limit'],
-            'net_rx': data['network']['rx_bytes'],
-            'net_tx': data['network']['tx_bytes'],
-        }
+    @property
+    def stats_history(self):
+        """
+        Cpu usage percentages recorded recently, oldest first.
+        """
+        return self._stats_history
 
     @property
     def id(self):
@@ -442,7 +450,7 @@ echo -e "\n@mcloud $@\n"
     def last_logs(self, on_log):
         id = yield self.client.find_container_by_name(self.name)
 
-        yield self.client.logs(self, id, on_log, tail=100, follow=False)
+        yield self.client.logs(id, on_log, tail=100, follow=False)
 
     @inlineCallbacks
     def _generate_config(self, image_name, for_run=False):
@@ -5,6 +5,7 @@ from autobahn.twisted.util import sleep
 from bashutils.colors import color_text
 import inject
 from mcloud.interrupt import InterruptCancel
+from mcloud.remote import Session
 from mcloud.rpc_client import subparsers, arg_parser, ApiRpcClient, ClientProcessInterruptHandler
 import os
 from twisted.internet import reactor
@@ -157,5 +158,7 @@ def mcloud_shell(host_ref=None):
         except Exception as e:
             print '\n  %s\n' % color_text(e.message, color='yellow')
 
+    yield Session.close_all()
+
     reactor.callFromThread(reactor.stop)
 
@@ -0,0 +1,240 @@
+import logging
+
+from twisted.internet import defer, reactor
+
+logger = logging.getLogger('mcloud.state')
+
+
+class ContainerStateCache(object):
+    """
+    Keeps inspect data of deployment containers.
+
+    Cache is seeded once from container list and then kept current by docker
+    events stream: container is re-inspected only if some event arrived for it
+    since last inspect.
+
+    Cache is not used until it's ready (events stream is attached and container
+    list is loaded), inspect calls go directly to docker in meantime. Events,
+    that arrive while list is loading, are applied after it's loaded, as list
+    may be older than they are.
+    """
+
+    # events that are emitted for images and never for containers
+    IMAGE_EVENTS = ('untag', 'delete', 'pull', 'import', 'tag')
+
+    def __init__(self, client, reconnect_delay=5):
+        """
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+
+        self.names = {}
+        """ container name -> container id """
+
+        self.data = {}
+        """ container id -> inspect data """
+
+        self.dirty = set()
+        """ ids of containers that changed after they were inspected """
+
+        self.event_count = 0
+        self.changed = {}
+        """ container id -> event count at it's last change, inspect started before it is outdated """
+
+        self.lookups = set()
+        """ names and ids that are not known yet, but are expected to appear """
+
+        self.listeners = []
+
+        self.pending = []
+        """ events, that arrived while container list was loading """
+
+        self.ready = False
+        self.running = False
+
+        self._events = None
+        self._restart = None
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self._attach()
+
+    def stop(self):
+        self.running = False
+        self.ready = False
+
+        if self._restart and self._restart.active():
+            self._restart.cancel()
+        self._restart = None
+
+        if self._events:
+            self._events.cancel()
+            self._events = None
+
+    def _attach(self):
+        self._restart = None
+        self.pending = []
+
+        logger.debug('Attaching to docker events: %s', self.client.url)
+
+        # subscribe before listing, so no event is lost in between
+        self._events = self.client.events(self.on_event)
+        self._events.addBoth(self._on_stream_lost)
+
+        d = self.client.list(all=True)
+        d.addCallback(self._seed)
+        d.addErrback(self._on_seed_failed)
+
+    def _seed(self, containers):
+        self.names = {}
+        self.data = {}
+        self.dirty = set()
+        self.changed = {}
+        self.lookups = set()
+
+        for ct in containers or []:
+            for name in ct['Names']:
+                self.names[name.lstrip('/')] = ct['Id']
+
+        pending, self.pending = self.pending, []
+        for event in pending:
+            self.apply_event(event)
+
+        self.ready = True
+        logger.debug('Container state cache is ready: %s containers', len(self.names))
+
+    def _on_seed_failed(self, failure):
+        logger.error('Can not load container list: %s', failure.getErrorMessage())
+        if self._events:
+            self._events.cancel()
+
+    def _on_stream_lost(self, result):
+        self._events = None
+        self.ready = False
+
+        if self.running:
+            logger.error('Docker events stream lost, reconnecting in %ss', self.reconnect_delay)
+            self._restart = reactor.callLater(self.reconnect_delay, self._attach)
+
+    def on_event(self, event):
+        if self.ready:
+            self.apply_event(event)
+        else:
+            self.pending.append(event)
+
+        # listeners get image events as well
+        for listener in self.listeners:
+            listener(event)
+
+    def apply_event(self, event):
+        id_ = event.get('id')
+        status = event.get('status')
+
+        if not id_:
+            return
+
+        if status in self.IMAGE_EVENTS:
+            pass
+
+        elif status == 'destroy':
+            self.forget(id_)
+
+        elif id_ in self.data or id_ in self.names.values():
+            self.mark_changed(id_)
+
+        else:
+            # new container, we do not know it's name yet
+            self.mark_changed(id_)
+            self.lookups.add(id_)
+            self.fetch(id_)
+
+    def mark_changed(self, id_):
+        self.event_count += 1
+        self.changed[id_] = self.event_count
+        self.dirty.add(id_)
+
+    def forget(self, id_):
+        for name, ct_id in self.names.items():
+            if ct_id == id_:
+                del self.names[name]
+
+        self.data.pop(id_, None)
+        self.dirty.discard(id_)
+        self.changed.pop(id_, None)
+
+    def invalidate(self, ref):
+        """
+        Mark container as changed.
+
+        Called after every state-changing request, so result of next inspect
+        does not depend on how fast docker event arrives.
+
+        :param ref: Container name or id
+        """
+        ref = str(ref)
+
+        if ref in self.names:
+            self.mark_changed(self.names[ref])
+        elif ref in self.data:
+            self.mark_changed(ref)
+        else:
+            self.lookups.add(ref)
+
+    def fetch(self, ref):
+        """
+        Inspect container and store result.
+
+        Container, that changed while request was in flight, stays dirty, so
+        older result is not taken for current one.
+
+        :param ref: Container name or id
+        """
+        id_ = self.names.get(ref, ref)
+        started = self.event_count
+
+        d = self.client.inspect(ref)
+
+        def on_result(data):
+            self.lookups.discard(ref)
+
+            if data is None:
+                if self.changed.get(id_, 0) <= started:
+                    self.forget(id_)
+            else:
+                self.names[data['Name'].lstrip('/')] = data['Id']
+                self.data[data['Id']] = data
+
+                if self.changed.get(data['Id'], 0) > started:
+                    self.dirty.add(data['Id'])
+                else:
+                    self.dirty.discard(data['Id'])
+
+            return data
+
+        d.addCallback(on_result)
+        return d
+
+    def inspect(self, name):
+        """
+        Return inspect data of container, from cache if possible.
+
+        :param name: Container name
+        """
+        if not self.ready:
+            return self.client.inspect(name)
+
+        if name in self.names:
+            id_ = self.names[name]
+
+            if id_ in self.data and not id_ in self.dirty:
+                return defer.succeed(self.data[id_])
+
+        elif not name in self.lookups:
+            # every existing container is known after seeding
+            return defer.succeed(None)
+
+        return self.fetch(name)
@@ -0,0 +1,195 @@
+from array import array
+import logging
+
+from twisted.internet import reactor
+
+logger = logging.getLogger('mcloud.stats')
+
+
+class StatsRing(object):
+    """
+    Fixed-size ring buffer of container stats samples.
+
+    Samples are stored as flat array of doubles, FIELDS values per sample.
+    """
+
+    FIELDS = ('time', 'cpu_total', 'cpu_system', 'cpu_count', 'memory_usage', 'memory_limit', 'net_rx', 'net_tx')
+
+    def __init__(self, size=60):
+        self.size = size
+        self.width = len(self.FIELDS)
+        self.head = 0
+        self.count = 0
+        self.buffer = array('d', [0.0] * (size * self.width))
+
+    def __len__(self):
+        return self.count
+
+    def append(self, values):
+        offset = self.head * self.width
+        self.buffer[offset:offset + self.width] = array('d', values)
+
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def get(self, index):
+        """
+        Return sample by age: 0 is the newest one, 1 is previous and so on.
+        """
+        if index >= self.count:
+            raise IndexError('Stats sample %s is not recorded' % index)
+
+        offset = ((self.head - 1 - index) % self.size) * self.width
+        return self.buffer[offset:offset + self.width]
+
+
+def parse_sample(data, time=None):
+    """
+    Convert docker stats record into ring buffer sample.
+    """
+    cpu = data['cpu_stats']
+
+    if 'networks' in data:
+        networks = data['networks'].values()
+    else:
+        networks = [data.get('network') or {}]
+
+    return (
+        time if time is not None else reactor.seconds(),
+        float(cpu['cpu_usage']['total_usage']),
+        float(cpu.get('system_cpu_usage') or 0),
+        float(len(cpu['cpu_usage'].get('percpu_usage') or []) or 1),
+        float(data['memory_stats'].get('usage') or 0),
+        float(data['memory_stats'].get('limit') or 0),
+        float(sum([x.get('rx_bytes', 0) for x in networks])),
+        float(sum([x.get('tx_bytes', 0) for x in networks])),
+    )
+
+
+def cpu_percent(newest, previous):
+    system_delta = newest[2] - previous[2]
+    if system_delta <= 0:
+        return 0.0
+
+    return 100.0 * (newest[1] - previous[1]) / system_delta * newest[3]
+
+
+def derive_stats(newest, previous=None):
+    """
+    Calculate stats of container from two consecutive samples.
+
+    With single sample only absolute values are known and all rates are zero.
+    """
+    stats = {
+        'cpu_usage': 0.0,
+        'memory_usage': newest[4],
+        'memory_limit': newest[5],
+        'memory_rate': 0.0,
+        'net_rx': newest[6],
+        'net_tx': newest[7],
+        'net_rx_rate': 0.0,
+        'net_tx_rate': 0.0,
+    }
+
+    if previous is None:
+        return stats
+
+    stats['cpu_usage'] = cpu_percent(newest, previous)
+
+    elapsed = newest[0] - previous[0]
+    if elapsed > 0:
+        stats['memory_rate'] = (newest[4] - previous[4]) / elapsed
+        stats['net_rx_rate'] = (newest[6] - previous[6]) / elapsed
+        stats['net_tx_rate'] = (newest[7] - previous[7]) / elapsed
+
+    return stats
+
+
+def sample_stats(data):
+    """
+    Calculate stats from single docker stats record (stream=false).
+
+    Newer docker versions report previous cpu counters, which gives a proper delta.
+    """
+    newest = parse_sample(data, time=0)
+
+    if data.get('precpu_stats') and data['precpu_stats'].get('system_cpu_usage'):
+        previous = parse_sample(dict(data, cpu_stats=data['precpu_stats']), time=0)
+        return derive_stats(newest, previous)
+
+    return derive_stats(newest)
+
+
+class StatsCollector(object):
+    """
+    Keeps one streaming stats connection per running container and records
+    samples into ring buffers.
+    """
+
+    def __init__(self, client, history=60):
+        """
+        @type client: mcloud.txdocker.DockerTwistedClient
+        """
+        self.client = client
+        self.history_size = history
+
+        self.rings = {}
+        self.streams = {}
+
+    def watch(self, id_):
+        """
+        Start collecting stats of running container, if not collecting yet.
+        """
+        if id_ in self.streams:
+            return
+
+        self.rings[id_] = StatsRing(self.history_size)
+
+        def on_done(result):
+            self.streams.pop(id_, None)
+            self.rings.pop(id_, None)
+
+        d = self.client.stats_stream(id_, lambda data: self.on_sample(id_, data))
+        d.addErrback(lambda failure: logger.debug('Stats stream of %s ended: %s', id_, failure.getErrorMessage()))
+        d.addBoth(on_done)
+
+        if id_ in self.rings:
+            self.streams[id_] = d
+
+    def unwatch(self, id_):
+        if id_ in self.streams:
+            self.streams[id_].cancel()
+
+    def stop(self):
+        for id_ in self.streams.keys():
+            self.unwatch(id_)
+
+    def on_event(self, event):
+        if event.get('status') in ('die', 'destroy'):
+            self.unwatch(event.get('id'))
+
+    def on_sample(self, id_, data):
+        if id_ in self.rings:
+            self.rings[id_].append(parse_sample(data))
+
+    def stats(self, id_):
+        """
+        Return current stats of container, or None if no samples are recorded yet.
+        """
+        ring = self.rings.get(id_)
+
+        if not ring:
+            return None
+
+        return derive_stats(ring.get(0), ring.get(1) if len(ring) > 1 else None)
+
+    def history(self, id_):
+        """
+        Return cpu usage percentages recorded for container, oldest first.
+        """
+        ring = self.rings.get(id_)
+
+        if not ring:
+            return []
+
+        return [cpu_percent(ring.get(i), ring.get(i + 1)) for i in reversed(range(len(ring) - 1))]
@@ -0,0 +1,175 @@
+import json
+import re
+import struct
+
+
+class JsonStreamDecoder(object):
+    """
+    Incremental decoder of newline separated or concatenated JSON records.
+
+    Chunks are buffered as a list and joined only when chunk can complete
+    a record, so records spanning many chunks are not re-scanned on every
+    chunk. Complete records are passed to on_record, non-JSON lines
+    (plain-text error responses) to on_text.
+    """
+
+    # "}" can end a record only if it's followed by next record or by end of chunk
+    RECORD_END = re.compile(r'\}\s*(?:\{|\Z)')
+    WHITESPACE = re.compile(r'\s*')
+
+    def __init__(self, on_record, on_text=None):
+        self.on_record = on_record
+        self.on_text = on_text
+
+        self.pending = []
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        self.pending.append(chunk)
+
+        if self.RECORD_END.search(chunk) or '\n' in chunk:
+            self._decode()
+
+    def flush(self):
+        """
+        Pass out whatever is left in the buffer when stream is over.
+        """
+        self._decode()
+
+        rest = ''.join(self.pending).strip()
+        self.pending = []
+
+        if rest and self.on_text:
+            self.on_text(rest)
+
+    def _decode(self):
+        buffer = ''.join(self.pending)
+        self.pending = []
+
+        pos = 0
+        end = len(buffer)
+
+        while True:
+            pos = self.WHITESPACE.match(buffer, pos).end()
+            if pos == end:
+                break
+
+            if buffer[pos] not in '{[':
+                eol = buffer.find('\n', pos)
+                if eol == -1:
+                    break
+
+                if self.on_text:
+                    self.on_text(buffer[pos:eol].rstrip('\r'))
+                pos = eol + 1
+                continue
+
+            try:
+                record, pos_ = self.decoder.raw_decode(buffer, pos)
+            except ValueError:
+                eol = buffer.find('\n', pos)
+
+                # incomplete record, wait for more data
+                if eol == -1:
+                    break
+
+                # docker never breaks records into lines, so this one is broken
+                if self.on_text:
+                    self.on_text(buffer[pos:eol].rstrip('\r'))
+                pos = eol + 1
+                continue
+
+            pos = pos_
+            self.on_record(record)
+
+        if pos < end:
+            self.pending.append(buffer[pos:])
+
+
+class LogStreamDemultiplexer(object):
+    """
+    Incremental parser of docker log stream.
+
+    Containers without tty send log as frames: 8 byte header (stream type,
+    3 zero bytes, big-endian payload length) followed by payload. Payload is
+    passed to line assembler as it arrives, so large frames are never buffered
+    as a whole. Streams of tty containers have no framing and are reported as
+    stdout.
+
+    Complete lines are passed to on_line(line, stream) without trailing newline.
+    """
+
+    HEADER_SIZE = 8
+    STREAMS = {0: 'stdin', 1: 'stdout', 2: 'stderr'}
+
+    def __init__(self, on_line):
+        self.on_line = on_line
+
+        self.framed = None
+        self.header = ''
+        self.stream = None
+        self.remaining = 0
+
+        self.partial = {}
+
+    def feed(self, chunk):
+        if self.framed is False:
+            self._payload('stdout', chunk)
+            return
+
+        pos = 0
+        end = len(chunk)
+
+        while pos < end:
+            if self.remaining:
+                take = min(self.remaining, end - pos)
+                self._payload(self.stream, chunk[pos:pos + take])
+                self.remaining -= take
+                pos += take
+                continue
+
+            need = self.HEADER_SIZE - len(self.header)
+            self.header += chunk[pos:pos + need]
+            pos += need
+
+            if len(self.header) < self.HEADER_SIZE:
+                break
+
+            if self.framed is None:
+                self.framed = ord(self.header[0]) in self.STREAMS and self.header[1:4] == '\x00\x00\x00'
+
+                if not self.framed:
+                    self._payload('stdout', self.header + chunk[pos:])
+                    self.header = ''
+                    return
+
+            stream_type, self.remaining = struct.unpack('>BxxxL', self.header)
+            self.stream = self.STREAMS.get(stream_type, 'stdout')
+            self.header = ''
+
+    def flush(self):
+        """
+        Pass out unterminated lines when stream is over.
+        """
+        for stream, partial in self.partial.items():
+            if partial:
+                self.on_line(''.join(partial), stream)
+
+        self.partial = {}
+
+    def _payload(self, stream, data):
+        partial = self.partial.setdefault(stream, [])
+
+        if not '\n' in data:
+            partial.append(data)
+            return
+
+        lines = data.split('\n')
+
+        partial.append(lines[0])
+        self.on_line(''.join(partial), stream)
+
+        for line in lines[1:-1]:
+            self.on_line(line, stream)
+
+        self.partial[stream] = [lines[-1]] if lines[-1] else []
@@ -17,14 +17,16 @@ import re
 from autobahn.twisted.util import sleep
 import inject
 from twisted.internet import defer, reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, CancelledError
 from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
 import txredisapi
 from mcloud.txdocker import IDockerClient, NotFound
 
 
 from mcloud.application import ApplicationController, AppDoesNotExist
-from mcloud.deployment import DeploymentController
+from mcloud.applist import AppListFeed, HistoryAppListFeed
+from mcloud.deployment import DeploymentController, Deployment
 from mcloud.events import EventBus
 from mcloud.remote import ApiRpcServer
 
@@ -76,6 +78,11 @@ class TaskService(object):
     rpc_server = inject.attr(ApiRpcServer)
     event_bus = inject.attr(EventBus)
     """ @type: EventBus """
+    app_list_feed = inject.attr(AppListFeed)
+    """ @type: AppListFeed """
+
+    app_list_history_feed = inject.attr(HistoryAppListFeed)
+    """ @type: HistoryAppListFeed """
 
     settings = inject.attr('settings')
 
@@ -136,16 +143,31 @@ class TaskService(object):
         defer.returnValue(ret)
 
     @inlineCallbacks
-    def task_list(self, ticket_id):
+    def task_list(self, ticket_id, history=False):
         """
         List all application and data related
 
         :param ticket_id:
+        :param history: include recent cpu usage of services
         :return:
         """
-        alist = yield self.app_controller.list()
+        alist = yield self.app_controller.list(history=history)
         defer.returnValue(alist)
 
+    def task_list_follow(self, ticket_id, history=False):
+        """
+        Follow application list.
+
+        Full list is sent as task progress once, then only changes. Killing
+        the task stops following.
+
+        :param ticket_id:
+        :param history: include recent cpu usage of services
+        :return:
+        """
+        feed = self.app_list_history_feed if history else self.app_list_feed
+        return feed.subscribe(ticket_id)
+
     @inlineCallbacks
     def task_list_volumes(self, ticket_id):
         """
@@ -224,12 +246,12 @@ class TaskService(object):
         defer.returnValue(ret)
 
 
-    @inlineCallbacks
     def task_logs(self, ticket_id, ref):
         """
         Read logs.
 
-        Logs are streamed as task output.
+        Logs are streamed as task output. Killing the task stops following,
+        so shared log stream is released.
 
         :param ticket_id:
         :param name:
@@ -238,24 +260,44 @@ class TaskService(object):
 
         service, app = ref.split('.')
 
-        # todo: fix to remote client
+        following = []
 
-        def on_log(log):
+        def on_log(line, stream):
+            self.task_log(ticket_id, line)
 
-            if len(log) == 8 and log[7] != 0x0a:
-                return
+        @inlineCallbacks
+        def follow():
+            try:
+                app_ = yield self.app_controller.get(app)
 
-            self.task_log(ticket_id, log)
+                config = yield app_.load()
 
-        try:
-            app = yield self.app_controller.get(app)
+                service_ = config.get_service(ref)
 
-            config = yield app.load()
+                d = service_.client.follow_logs(service_.name, on_log, tail=100)
+                following.append(d)
 
-            service = config.get_service(ref)
-            yield service.client.logs(service.name, on_log, tail=100)
-        except NotFound:
-            self.task_log(ticket_id, 'Container not found by name.')
+                if task.called:
+                    d.cancel()
+
+                yield d
+            except NotFound:
+                self.task_log(ticket_id, 'Container not found by name.')
+
+        def cancel(task):
+            for d in following:
+                d.cancel()
+
+        task = defer.Deferred(cancel)
+
+        def done(result):
+            if not task.called:
+                task.callback(result)
+            elif isinstance(result, Failure):
+                result.trap(CancelledError)
+
+        follow().addBoth(done)
+        return task
 
 
     @inlineCallbacks
@@ -381,17 +423,14 @@ class TaskService(object):
 
     def follow_logs(self, service, ticket_id):
 
-        def on_log(log):
+        def on_log(line, stream):
 
-            if log.startswith('@mcloud ready in '):
-                parts = log.split(' ')
+            if line.startswith('@mcloud ready in '):
+                parts = line.rstrip('\r').split(' ')
                 self.event_bus.fire_event('api.%s.%s' % (service.name, 'ready'), my_args=parts[2:])
                 return
 
-            if len(log) == 8 and log[7] != 0x0a:
-                return
-
-            self.task_log(ticket_id, log)
+            self.task_log(ticket_id, line)
 
         def done(result):
             pass
@@ -399,7 +438,7 @@ class TaskService(object):
         def on_err(failure):
             print failure
 
-        d = service.client.logs(service.name, on_log)
+        d = service.client.follow_logs(service.name, on_log)
         d.addCallback(done)
         d.addErrback(on_err)
 
@@ -907,6 +946,15 @@ class TaskService(object):
         defer.returnValue(ret)
 
 
+    def task_docker_stats(self, ticket_id):
+        """
+        Show docker request queues and coalescing counters of deployments
+
+        :param ticket_id:
+        :return:
+        """
+        return defer.succeed(dict([(name, client.metrics()) for name, (params, client) in Deployment.clients.items()]))
+
     @inlineCallbacks
     def task_machine(self, ticket_id, command):
         """
@@ -0,0 +1,96 @@
+import json
+
+import inject
+from twisted.internet import defer
+import txredisapi
+
+
+class TicketLog(object):
+    """
+    Durable log of task output.
+
+    Progress, terminal output and result of a ticket are appended to redis
+    list, that keeps last `limit` entries and expires `ttl` seconds after
+    the last write. Entries are numbered, so client, that lost connection,
+    re-attaches and gets entries after the last number it has seen:
+
+        {'seq': 1, 'type': 'progress'|'stdout'|'success'|'failure', 'data': ...}
+
+    Stdout data is base64 encoded. Entry is written before the event is
+    published, so entry of any event client could receive is already
+    readable.
+
+    Result is also kept under separate keys for the same time, it survives
+    the log being trimmed.
+    """
+    redis = inject.attr(txredisapi.Connection)
+
+    LOG_KEY = 'mcloud-ticket-%s-log'
+    COMPLETED_KEY = 'mcloud-ticket-%s-completed'
+    RESULT_KEY = 'mcloud-ticket-%s-result'
+
+    TRIM_EVERY = 50
+    """ log is trimmed (and expiration renewed) once per this number of entries """
+
+    def __init__(self, limit=1000, ttl=86400):
+        self.limit = limit
+        self.ttl = ttl
+
+        self.seqs = {}
+        """ ticket id -> number of the last entry written by this process """
+
+    def append(self, ticket_id, kind, data):
+        """
+        :return: number of the entry
+        """
+        seq = self.seqs[ticket_id] = self.seqs.get(ticket_id, 0) + 1
+
+        key = self.LOG_KEY % ticket_id
+        self.redis.rpush(key, json.dumps({'seq': seq, 'type': kind, 'data': data}))
+
+        if (seq - 1) % self.TRIM_EVERY == 0:
+            self._trim(key)
+
+        return seq
+
+    def finish(self, ticket_id, success, result):
+        """
+        Append result and store it for later.
+        """
+        seq = self.append(ticket_id, 'success' if success else 'failure', result)
+        del self.seqs[ticket_id]
+
+        self._trim(self.LOG_KEY % ticket_id)
+
+        self.redis.setex(self.RESULT_KEY % ticket_id, self.ttl, json.dumps({'success': success, 'result': result}))
+        self.redis.setex(self.COMPLETED_KEY % ticket_id, self.ttl, 1)
+
+        return seq
+
+    def _trim(self, key):
+        self.redis.ltrim(key, -self.limit, -1)
+        self.redis.expire(key, self.ttl)
+
+    @defer.inlineCallbacks
+    def read(self, ticket_id, offset=0):
+        """
+        Entries with number greater than offset.
+        """
+        items = yield self.redis.lrange(self.LOG_KEY % ticket_id, 0, -1)
+
+        entries = [json.loads(item) for item in items or []]
+
+        defer.returnValue([entry for entry in entries if entry['seq'] > offset])
+
+    @defer.inlineCallbacks
+    def is_completed(self, ticket_id):
+        completed = yield self.redis.get(self.COMPLETED_KEY % ticket_id)
+        defer.returnValue(completed == 1)
+
+    @defer.inlineCallbacks
+    def get_result(self, ticket_id):
+        """
+        :return: {'success': bool, 'result': result or error message}, None if task is not completed
+        """
+        result = yield self.redis.get(self.RESULT_KEY % ticket_id)
+        defer.returnValue(json.loads(result) if result is not None else None)
@@ -1,7 +1,11 @@
-from base64 import b64decode
-import base64
+from base64 import b64decode, b64encode
+from collections import deque
+from StringIO import StringIO
 import json
 import logging
+import pipes
+import tarfile
+import time
 from urllib import urlencode
 import sys
 from OpenSSL.crypto import PKey, FILETYPE_PEM, load_certificate, load_privatekey
@@ -9,7 +13,14 @@ from mcloud import txhttp
 from mcloud.attach import Attach, AttachFactory, Terminal, AttachStdinProtocol
 
 from mcloud.events import EventBus
+from mcloud.images import ImageIndex
+from mcloud.loghub import LogHub
+from mcloud.progress import ProgressAggregator
+from mcloud.pulls import PullCoordinator
 from mcloud.remote import ApiRpcServer
+from mcloud.state import ContainerStateCache
+from mcloud.stats import StatsCollector
+from mcloud.streams import JsonStreamDecoder, LogStreamDemultiplexer
 import os
 import inject
 from mcloud.util import Interface
@@ -23,6 +34,7 @@ from twisted.protocols import basic
 from twisted.web._newclient import ResponseDone, ResponseFailed
 from twisted.web.error import PageRedirect
 from twisted.web.http import PotentialDataLoss
+from twisted.python.failure import Failure
 
 logger = logging.getLogger('mcloud.docker')
 
@@ -40,20 +52,168 @@ class CommandFailed(Exception):
 class NotFound(Exception):
     pass
 
+class ApiVersionNotSupported(CommandFailed):
+    pass
+
 
 class DockerConnectionFailed(Exception):
     pass
 
 
+class RequestCoalescer(object):
+    """
+    Shares one request between identical idempotent calls that are in flight
+    at the same time.
+
+    All callers receive the same decoded result object, so they should not
+    modify it.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.hits = {}
+        self.misses = {}
+
+    def call(self, endpoint, key, func, *args, **kwargs):
+        if key in self.in_flight:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+
+            d = defer.Deferred()
+            self.in_flight[key].append(d)
+            return d
+
+        self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+
+        waiters = []
+        self.in_flight[key] = waiters
+
+        def on_result(result):
+            del self.in_flight[key]
+
+            for waiter in waiters:
+                if isinstance(result, Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+
+            return result
+
+        d = defer.maybeDeferred(func, *args, **kwargs)
+        d.addBoth(on_result)
+        return d
+
+    def stats(self):
+        return dict([(endpoint, {
+            'hits': self.hits.get(endpoint, 0),
+            'misses': self.misses.get(endpoint, 0),
+        }) for endpoint in set(self.hits.keys() + self.misses.keys())])
+
+
+class RequestLimiter(object):
+    """
+    Bounds number of concurrent requests to docker daemon.
+
+    Requests wait in two lanes: interactive requests are always served first and
+    have some slots reserved, so they are not queued behind bulk lookups.
+    Slot is held until response headers arrive, so streaming requests do not
+    hold it for the whole stream.
+    """
+
+    INTERACTIVE = 'interactive'
+    BULK = 'bulk'
+
+    LANES = (INTERACTIVE, BULK)
+
+    def __init__(self, limit=20, interactive_reserve=5):
+        self.limit = limit
+        self.interactive_reserve = min(interactive_reserve, limit - 1)
+
+        self.active = 0
+        self.queues = dict([(lane, deque()) for lane in self.LANES])
+
+        self.waited = dict([(lane, 0.0) for lane in self.LANES])
+        self.waited_max = dict([(lane, 0.0) for lane in self.LANES])
+        self.served = dict([(lane, 0) for lane in self.LANES])
+
+    def _has_slot(self, lane):
+        if lane == self.INTERACTIVE:
+            return self.active < self.limit
+
+        return self.active < self.limit - self.interactive_reserve
+
+    def acquire(self, lane):
+        # never overtake requests waiting in the same or more important lane
+        waiting = self.queues[self.INTERACTIVE] or (lane == self.BULK and self.queues[self.BULK])
+
+        if self._has_slot(lane) and not waiting:
+            self.active += 1
+            return defer.succeed(None)
+
+        queue = self.queues[lane]
+
+        def cancel(d):
+            if d in queue:
+                queue.remove(d)
+
+        d = defer.Deferred(canceller=cancel)
+        queue.append(d)
+        return d
+
+    def release(self):
+        self.active -= 1
+
+        for lane in self.LANES:
+            while self.queues[lane] and self._has_slot(lane):
+                self.active += 1
+                self.queues[lane].popleft().callback(None)
+
+    def run(self, lane, func, *args, **kwargs):
+        queued_at = reactor.seconds()
+
+        def on_slot(_):
+            waited = reactor.seconds() - queued_at
+            self.waited[lane] += waited
+            self.waited_max[lane] = max(self.waited_max[lane], waited)
+            self.served[lane] += 1
+
+            d = defer.maybeDeferred(func, *args, **kwargs)
+
+            def on_response(result):
+                self.release()
+                return result
+
+            d.addBoth(on_response)
+            return d
+
+        d = self.acquire(lane)
+        d.addCallback(on_slot)
+        return d
+
+    def stats(self):
+        return dict([(lane, {
+            'queued': len(self.queues[lane]),
+            'served': self.served[lane],
+            'wait_avg': self.waited[lane] / self.served[lane] if self.served[lane] else 0.0,
+            'wait_max': self.waited_max[lane],
+        }) for lane in self.LANES] + [('active', self.active), ('limit', self.limit)])
+
+
 class DockerTwistedClient(object):
 
     DOCKER_API_VERSION = 'v1.19'
 
+    # containers/{id}/archive endpoint appeared in this version
+    ARCHIVE_API_VERSION = 'v1.20'
+
+    # answers of daemon, that does not know requested api version or endpoint
+    UNSUPPORTED_API_RE = re.compile('client is newer than server|client and server don.t have same version|page not found',
+                                    re.IGNORECASE)
+
     rpc_server = inject.attr(ApiRpcServer)
     eb = inject.attr(EventBus)
 
-    def versionize(self, url):
-        return url + self.DOCKER_API_VERSION + '/'
+    def versionize(self, url, api_version=None):
+        return url + (api_version or self.DOCKER_API_VERSION) + '/'
 
     def task_log(self, ticket_id, message):
         self.rpc_server.task_progress(message, ticket_id)
@@ -61,7 +221,8 @@ class DockerTwistedClient(object):
     def task_stdout(self, ticket_id, data):
         self.rpc_server.task_stdout(data, ticket_id)
 
-    def __init__(self, url=None, key=None, crt=None, ca=None):
+    def __init__(self, url=None, key=None, crt=None, ca=None, pool_max_per_host=10, pool_idle_timeout=240,
+                 pool_retry=True):
         super(DockerTwistedClient, self).__init__()
 
         self.crt = crt
@@ -73,16 +234,173 @@ class DockerTwistedClient(object):
 
         self.url = url + '/'
 
+        # one keep-alive pool per client, client itself lives as long as deployment
+        self.pool = txhttp.persistent_pool(reactor, max_per_host=pool_max_per_host,
+                                           idle_timeout=pool_idle_timeout, retry=pool_retry)
+        self.agent = txhttp.UNIXAwareHttpAgent(reactor, pool=self.pool, key=key, crt=crt, ca=ca)
+
+        self.state_cache = None
+        """
+        @type state_cache: ContainerStateCache
+        """
+
+        self.stats_collector = None
+        """
+        @type stats_collector: StatsCollector
+        """
+
+        self.coalescer = None
+        """
+        @type coalescer: RequestCoalescer
+        """
+
+        self.limiter = None
+        """
+        @type limiter: RequestLimiter
+        """
+
+        self.log_hub = None
+        """
+        @type log_hub: LogHub
+        """
+
+        self.image_index = None
+        """
+        @type image_index: ImageIndex
+        """
+
+        self.pull_coordinator = None
+        """
+        @type pull_coordinator: PullCoordinator
+        """
+
+        self.archive_supported = True
+        """ False once daemon has refused archive endpoint (docker < 1.8) """
+
         logger.info('Connecting docker: %s' % self.url)
 
-    def _request(self, url, method=txhttp.get, follow_redirects=1, **kwargs):
+    def enable_state_cache(self):
+        """
+        Start serving container inspects from cache kept current by docker events.
+        """
+        if self.state_cache is None:
+            self.state_cache = ContainerStateCache(self)
+            self.state_cache.start()
+
+        return self.state_cache
+
+    def enable_stats_collector(self, history=60):
+        """
+        Start collecting stats of running containers through streaming connections.
+        """
+        if self.stats_collector is None:
+            self.stats_collector = StatsCollector(self, history=history)
+
+            if self.state_cache:
+                self.state_cache.listeners.append(self.stats_collector.on_event)
+
+        return self.stats_collector
+
+    def enable_coalescing(self):
+        """
+        Share identical inspect and image lookup requests that run concurrently.
+        """
+        if self.coalescer is None:
+            self.coalescer = RequestCoalescer()
+
+        return self.coalescer
+
+    def enable_limiter(self, limit=20, interactive_reserve=5):
+        """
+        Bound number of concurrent requests to the daemon.
+        """
+        if self.limiter is None:
+            self.limiter = RequestLimiter(limit=limit, interactive_reserve=interactive_reserve)
+
+        return self.limiter
+
+    def enable_log_hub(self, history=100):
+        """
+        Share one follow stream per container between all log followers.
+        """
+        if self.log_hub is None:
+            self.log_hub = LogHub(self, history=history)
+
+        return self.log_hub
+
+    def enable_image_index(self, reconcile_interval=300):
+        """
+        Answer image existence checks from index instead of image listings.
+        """
+        if self.image_index is None:
+            self.image_index = ImageIndex(self, reconcile_interval=reconcile_interval)
+            self.image_index.start()
+
+            if self.state_cache:
+                self.state_cache.listeners.append(self.image_index.on_event)
+
+        return self.image_index
+
+    def enable_pull_coordinator(self, limit=3):
+        """
+        Join concurrent pulls of the same image and bound number of parallel pulls.
+        """
+        if self.pull_coordinator is None:
+            self.pull_coordinator = PullCoordinator(self, limit=limit)
+
+        return self.pull_coordinator
+
+    def metrics(self):
+        return {
+            'url': self.url,
+            'requests': self.limiter.stats() if self.limiter else None,
+            'coalescing': self.coalescer.stats() if self.coalescer else None,
+            'log_followers': self.log_hub.stats() if self.log_hub else None,
+            'pulls': self.pull_coordinator.stats() if self.pull_coordinator else None,
+        }
+
+    def _coalesce(self, endpoint, func, *args):
+        if self.coalescer is None:
+            return func(*args)
+
+        return self.coalescer.call(endpoint, (endpoint,) + args, func, *args)
+
+    def _invalidate(self, ref):
+        if self.state_cache:
+            self.state_cache.invalidate(ref)
+
+    def close(self):
+        """
+        Stop event listeners and drop all idle connections of the pool.
+        """
+        if self.state_cache:
+            self.state_cache.stop()
+
+        if self.stats_collector:
+            self.stats_collector.stop()
+
+        if self.log_hub:
+            self.log_hub.stop()
+
+        if self.image_index:
+            self.image_index.stop()
+
+        return self.pool.closeCachedConnections()
+
+    def _request(self, url, method=txhttp.get, follow_redirects=1, lane=RequestLimiter.INTERACTIVE, api_version=None,
+                 **kwargs):
 
         if not '://' in url:
-            url_ = '%s%s' % (self.versionize(self.url), url)
+            url_ = '%s%s' % (self.versionize(self.url, api_version), url)
         else:
             url_ = url
 
-        d = method(url_, timeout=30, key=self.key, crt=self.crt, ca=self.ca, **kwargs)
+        kwargs.setdefault('timeout', 30)
+
+        if self.limiter:
+            d = self.limiter.run(lane, method, url_, agent=self.agent, **kwargs)
+        else:
+            d = method(url_, agent=self.agent, **kwargs)
 
         def error(failure):
             if hasattr(failure.value, 'reasons'):
@@ -92,7 +410,8 @@ class DockerTwistedClient(object):
                 if redirect:
                     if follow_redirects:
                         logger.error('Http redirect: %s' % reason.value.location)
-                        return self._request(reason.value.location, method=method, follow_redirects=follow_redirects - 1, **kwargs)
+                        return self._request(reason.value.location, method=method, follow_redirects=follow_redirects - 1,
+                                             lane=lane, **kwargs)
                     else:
                         raise DockerConnectionFailed('Redirect from %s -> %s requested, but redirect limit exceed.' % (url_, reason.value.location))
 
@@ -118,80 +437,198 @@ class DockerTwistedClient(object):
     #######################################
 
     def images(self, name=None):
+        return self._coalesce('images', self._images, name)
+
+    def _images(self, name=None):
         if name:
             q = {'all': 0, 'filter': name}
         else:
             q = None
-        r = self._get('images/json', data=q)
+        r = self._get('images/json', data=q, lane=RequestLimiter.BULK)
         r.addCallback(json_response)
         return r
 
     @inlineCallbacks
     def build_image(self, dockerfile, ticket_id=None):
+        """
+        Build image from context, which is tar archive either as a string or as
+        body producer (see mcloud.container.ArchiveProducer).
+        """
         headers = {'Content-Type': 'application/tar'}
 
         result = {}
 
-        def on_content(chunk):
-            self.task_log(ticket_id, chunk)
+        # base image may be pulled during build
+        progress = ProgressAggregator(lambda record: self.task_log(ticket_id, json.dumps(record)))
+
+        def on_record(record):
+            progress.feed(record)
+
+            if 'error' in record:
+                result['error'] = record['error']
+
+            elif 'stream' in record and record['stream'].startswith('Successfully built '):
+                result['image_id'] = record['stream'][len('Successfully built '):].strip()
+
+        def on_text(line):
+            self.task_log(ticket_id, line)
+
+        # upload of big context may take longer than usual request timeout
+        response = yield self._post('build', data=dockerfile, headers=headers, response_handler=None, timeout=None,
+                                    unbuffered=True)
+        try:
+            yield self.collect_json_stream(response, on_record, on_text)
+        finally:
+            progress.close()
 
-            if not 'image_id' in result:
-                match = re.search(r'Successfully built ([0-9a-f]+)', chunk)
-                if match:
-                    result['image_id'] = match.group(1)
+        if 'error' in result:
+            raise CommandFailed('Failed to build image: %s' % result['error'])
+
+        if not 'image_id' in result:
+            raise CommandFailed('Build finished without image id')
 
-        response = yield self._post('build', data=dockerfile, headers=headers, response_handler=None)
-        yield txhttp.collect(response, on_content)
         defer.returnValue(result['image_id'])
 
     @inlineCallbacks
-    def put_file(self, container_id, path, file_data, ticket_id=None):
+    def put_archive(self, container_id, path, archive, ticket_id=None):
+        """
+        Extract tar archive into directory of container in single request.
+
+        :param archive: Tar archive as a string or as body producer
+        """
+        logger.debug('[%s] Uploading archive to %s:%s', ticket_id, container_id, path)
+
+        response = yield self._request('containers/%s/archive?%s' % (bytes(container_id), urlencode({'path': path})),
+                                       method=txhttp.put, data=archive, headers={'Content-Type': 'application/x-tar'},
+                                       response_handler=None, api_version=self.ARCHIVE_API_VERSION, timeout=None)
+
+        content = yield txhttp.content(response)
+
+        if response.code in (400, 404) and self.UNSUPPORTED_API_RE.search(content):
+            raise ApiVersionNotSupported(content)
+        elif response.code == 404:
+            raise NotFound(content)
+        elif response.code != 200:
+            raise CommandFailed(content)
+
+    @inlineCallbacks
+    def put_files(self, container_id, files, mode=0644, ticket_id=None):
+        """
+        Put several files into container at once.
+
+        Daemon without archive endpoint gets files one by one through exec.
+
+        :param files: Absolute path -> file content
+        """
+        if self.archive_supported:
+            try:
+                yield self.put_archive(container_id, '/', self._tar(files, mode), ticket_id=ticket_id)
+                return
+            except ApiVersionNotSupported as e:
+                logger.info('Docker daemon does not support archive upload, using exec: %s', e)
+                self.archive_supported = False
+
+        for path, file_data in sorted(files.items()):
+            yield self._exec_put_file(container_id, path, file_data, mode, ticket_id=ticket_id)
+
+    def _tar(self, files, mode):
+        memfile = StringIO()
+
+        t = tarfile.open(mode='w', fileobj=memfile)
+        for path, file_data in sorted(files.items()):
+            info = tarfile.TarInfo(path.lstrip('/'))
+            info.size = len(file_data)
+            info.mode = mode
+            info.mtime = time.time()
+            t.addfile(info, StringIO(file_data))
+        t.close()
+
+        return memfile.getvalue()
+
+    @inlineCallbacks
+    def _exec_put_file(self, container_id, path, file_data, mode, ticket_id=None):
+        """
+        Write file with shell command run in container, file size is limited by argv.
+        """
+        logger.debug('[%s] Writing %s:%s through exec', ticket_id, container_id, path)
 
         config = {
             'AttachStdin': False,
-            'Cmd': ['bash', '-c', 'echo %(data)s | base64 -d | tee %(path)s && chmod +x %(path)s' % {
-                'data': base64.encodestring(file_data).strip(),
-                'path': path
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Cmd': ['sh', '-c', 'echo %(data)s | base64 -d > %(path)s && chmod %(mode)o %(path)s' % {
+                'data': b64encode(file_data),
+                'path': pipes.quote(path),
+                'mode': mode,
             }]
         }
 
         response = yield self._post('containers/%s/exec' % bytes(container_id),
-                                    headers={'Content-Type': 'application/json'}, data=json.dumps(config), response_handler=None)
+                                    headers={'Content-Type': 'application/json'}, data=json.dumps(config),
+                                    response_handler=None)
 
-        data = yield self.collect_json_or_none(response)
+        if response.code == 404:
+            yield self.collect_to_exception(NotFound, response)
+        elif response.code != 201:
+            yield self.collect_to_exception(CommandFailed, response)
 
-        print data
-        print config
+        data = yield txhttp.json_content(response)
 
         response = yield self._post('exec/%s/start' % bytes(data['Id']),
-                                    headers={'Content-Type': 'application/json'}, data=json.dumps({
-                 "Detach": False,
-                 "Tty": False,
-                }), response_handler=None)
+                                    headers={'Content-Type': 'application/json'},
+                                    data=json.dumps({'Detach': False, 'Tty': False}), response_handler=None)
 
-        resp = yield txhttp.content(response)
-        print resp
+        yield txhttp.content(response)
 
+    def put_file(self, container_id, path, file_data, mode=0755, ticket_id=None):
+        return self.put_files(container_id, {path: file_data}, mode=mode, ticket_id=ticket_id)
 
     def pull(self, name, ticket_id, tag=None):
+        """
+        Pull image, progress is reported to the ticket.
+
+        Goes through pull coordinator if it's enabled, so concurrent pulls of
+        the same image are joined.
+        """
+        if self.pull_coordinator:
+            return self.pull_coordinator.pull(name, ticket_id, tag)
+
+        def on_record(record):
+            self.task_log(ticket_id, json.dumps(record))
 
+        def on_text(line):
+            self.task_log(ticket_id, line)
+
+        return self.pull_image(name, tag, on_record, on_text, ticket_id=ticket_id)
+
+    def pull_image(self, name, tag, on_record, on_text=None, ticket_id=None):
+        """
+        Pull image, progress records are passed to on_record as they arrive.
+        """
         logger.debug('[%s] Pulling image "%s"', ticket_id, name)
 
-        def on_content(chunk):
-            logger.debug('[%s] Content chunk <%s>', ticket_id, chunk)
-            self.task_log(ticket_id, chunk)
+        errors = []
+        progress = ProgressAggregator(on_record)
 
-            try:
-                data = json.loads(chunk)
-                if 'error' in data:
-                    raise CommandFailed('Failed to pull image "%s": %s' % (name, data['error']))
+        def on_record_(record):
+            logger.debug('[%s] Progress record <%s>', ticket_id, record)
+            progress.feed(record)
 
-                return data
+            if 'error' in record:
+                errors.append(record['error'])
 
-            except ValueError:
-                pass
+        def finish(result):
+            # pass out pending progress whatever the result is
+            progress.close()
+            return result
 
         def done(*args):
+            if self.image_index:
+                self.image_index.invalidate()
+
+            if errors:
+                raise CommandFailed('Failed to pull image "%s": %s' % (name, errors[0]))
+
             logger.debug('[%s] Done pulling image.', ticket_id)
             return True
 
@@ -199,12 +636,36 @@ class DockerTwistedClient(object):
         if tag:
             create_params['tag'] = tag
 
-        r = self._post('images/create', params=create_params, response_handler=None)
-        r.addCallback(txhttp.collect, on_content)
+        r = self._post('images/create', params=create_params, response_handler=None, unbuffered=True)
+        r.addCallback(self.collect_json_stream, on_record_, on_text)
+        r.addBoth(finish)
         r.addCallback(done)
 
         return r
 
+    def collect_json_stream(self, response, on_record, on_text=None):
+        """
+        Decode streamed JSON records of response body as they arrive.
+
+        Response should be requested with unbuffered=True, otherwise treq
+        keeps whole body in memory for as long as stream goes on.
+        """
+        decoder = JsonStreamDecoder(on_record, on_text)
+
+        d = txhttp.collect(response, decoder.feed)
+        d.addCallback(lambda _: decoder.flush())
+        return d
+
+    def collect_log_stream(self, response, on_line):
+        """
+        Split multiplexed log stream of response body into lines as they arrive.
+        """
+        demux = LogStreamDemultiplexer(on_line)
+
+        d = txhttp.collect(response, demux.feed)
+        d.addCallback(lambda _: demux.flush())
+        return d
+
     def collect_to_exception(self, e, response):
         def on_collected(content):
             raise e(content)
@@ -213,18 +674,25 @@ class DockerTwistedClient(object):
         return d
 
 
-    def logs(self, container_id, on_log, tail=0, follow=True):
-        r = self._get('containers/%s/logs' % bytes(container_id), response_handler=None, data={
+    def logs(self, container_id, on_log, tail=0, follow=True, timestamps=False):
+        """
+        Read container log.
+
+        on_log(line, stream) is called for every complete line, stream is 'stdout' or 'stderr'.
+        With timestamps, every line starts with the time it was written and a space.
+        """
+        # followed log never ends, it must not be buffered
+        r = self._get('containers/%s/logs' % bytes(container_id), response_handler=None, unbuffered=True, data={
             'follow': follow,
             'tail': tail,
-            # 'timestamps': 0,
+            'timestamps': timestamps,
             'stdout': True,
             'stderr': True
         })
 
         def on_result(result):
             if result.code == 200:
-                return txhttp.collect(result, on_log)
+                return self.collect_log_stream(result, on_log)
             elif result.code == 404:
                 return self.collect_to_exception(NotFound, result)
             else:
@@ -233,6 +701,17 @@ class DockerTwistedClient(object):
         r.addBoth(on_result)
         return r
 
+    def follow_logs(self, container_id, on_log, tail=0):
+        """
+        Follow container log, through shared stream if log hub is enabled.
+
+        Cancel returned deferred to stop following.
+        """
+        if self.log_hub:
+            return self.log_hub.subscribe(container_id, on_log, tail=tail)
+
+        return self.logs(container_id, on_log, tail=tail)
+
     @inlineCallbacks
     def attach(self, container_id, ticket_id, skip_terminal=False):
 
@@ -240,13 +719,14 @@ class DockerTwistedClient(object):
         protocol = Attach(d, container_id)
 
         def stdin_on_input(channel, data):
-            protocol.stdin_on_input(data)
+            # input, that arrived to other process, comes through event bus
+            protocol.stdin_on_input(b64decode(data))
 
         def stdout_write(data):
             self.task_stdout(ticket_id, data)
 
         def log_write(data):
-            self.task_log(ticket_id, b64decode(data))
+            self.task_log(ticket_id, data)
 
         try:
             if skip_terminal:
@@ -254,8 +734,12 @@ class DockerTwistedClient(object):
             else:
                 protocol.stdout_write = stdout_write
 
+                self.rpc_server.stdin_handlers[int(ticket_id)] = protocol.stdin_on_input
                 self.eb.on('task.stdin.%s' % int(ticket_id), stdin_on_input)
 
+                # container output waits, while client can't take it
+                protocol.on_connected = lambda transport: self.rpc_server.register_producer(int(ticket_id), transport)
+
             f = AttachFactory(protocol)
 
             proto, url = self.url.split('://')
@@ -285,16 +769,14 @@ class DockerTwistedClient(object):
 
         finally:
             if not skip_terminal:
+                self.rpc_server.stdin_handlers.pop(int(ticket_id), None)
+                self.rpc_server.unregister_producer(int(ticket_id))
                 self.eb.cancel('task.stdin.%s' % int(ticket_id), stdin_on_input)
 
 
     def events(self, on_event):
-        r = self._get('events', response_handler=None)
-
-        def event_parser(event):
-            on_event(json.loads(event))
-
-        r.addCallback(txhttp.collect, event_parser)
+        r = self._get('events', response_handler=None, unbuffered=True)
+        r.addCallback(self.collect_json_stream, on_event)
         return r
 
     @inlineCallbacks
@@ -303,6 +785,7 @@ class DockerTwistedClient(object):
         logger.debug('[%s] Create container "%s"', ticket_id, name)
 
         result = yield self._post('containers/create', params={'name': name}, headers={'Content-Type': 'application/json'}, data=json.dumps(config))
+        self._invalidate(name)
 
         if result.code == 201:
             defer.returnValue(True)
@@ -330,21 +813,33 @@ class DockerTwistedClient(object):
     @inlineCallbacks
     def stats(self, id):
         assert not id is None
-        r = yield self._get('containers/%s/stats?stream=false' % bytes(id))
+        r = yield self._get('containers/%s/stats?stream=false' % bytes(id), lane=RequestLimiter.BULK)
         r = yield self.collect_json_or_none(r)
         defer.returnValue(r)
 
-    @inlineCallbacks
+    def stats_stream(self, id, on_stats):
+        assert not id is None
+        r = self._get('containers/%s/stats' % bytes(id), response_handler=None, unbuffered=True)
+        r.addCallback(self.collect_json_stream, on_stats)
+        return r
+
     def inspect(self, id):
+        return self._coalesce('inspect', self._inspect, id)
+
+    @inlineCallbacks
+    def _inspect(self, id):
         assert not id is None
-        r = yield self._get('containers/%s/json' % bytes(id))
+        r = yield self._get('containers/%s/json' % bytes(id), lane=RequestLimiter.BULK)
         r = yield self.collect_json_or_none(r)
         defer.returnValue(r)
 
-    @inlineCallbacks
     def inspect_image(self, id):
+        return self._coalesce('inspect_image', self._inspect_image, id)
+
+    @inlineCallbacks
+    def _inspect_image(self, id):
         assert not id is None
-        r = yield self._get('images/%s/json' % bytes(id))
+        r = yield self._get('images/%s/json' % bytes(id), lane=RequestLimiter.BULK)
         r = yield self.collect_json_or_none(r)
         defer.returnValue(r)
 
@@ -356,8 +851,8 @@ class DockerTwistedClient(object):
         r = yield txhttp.content(r)
         defer.returnValue(r)
 
-    def list(self):
-        r = self._get('containers/json')
+    def list(self, all=False):
+        r = self._get('containers/json?all=1' if all else 'containers/json', lane=RequestLimiter.BULK)
         r.addCallback(self.collect_json_or_none)
         return r
 
@@ -369,6 +864,7 @@ class DockerTwistedClient(object):
     @inlineCallbacks
     def remove_container(self, id, ticket_id):
         result = yield self._delete('containers/%s' % bytes(id))
+        self._invalidate(id)
         defer.returnValue(result.code == 204)
 
     @inlineCallbacks
@@ -380,25 +876,32 @@ class DockerTwistedClient(object):
             config = {}
 
         result = yield self._post('containers/%s/start' % bytes(id), headers={'Content-Type': 'application/json'}, data=json.dumps(config))
+        self._invalidate(id)
         defer.returnValue(result.code == 204)
 
     @inlineCallbacks
     def stop_container(self, id, ticket_id):
         result = yield self._post('containers/%s/stop' % bytes(id))
+        self._invalidate(id)
         defer.returnValue(result.code == 204)
 
     @inlineCallbacks
     def pause_container(self, id, ticket_id):
         result = yield self._post('containers/%s/pause' % bytes(id))
+        self._invalidate(id)
         defer.returnValue(result.code == 204)
 
     @inlineCallbacks
-    def pause_container(self, id, ticket_id):
+    def unpause_container(self, id, ticket_id):
         result = yield self._post('containers/%s/unpause' % bytes(id))
+        self._invalidate(id)
         defer.returnValue(result.code == 204)
 
-    @inlineCallbacks
     def find_container_by_name(self, name):
+        return self._coalesce('find_container_by_name', self._find_container_by_name, name)
+
+    @inlineCallbacks
+    def _find_container_by_name(self, name):
         result = yield self._get('containers/%s/json' % str(name))
 
         if result.code != 200:
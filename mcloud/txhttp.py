@@ -1,19 +1,50 @@
+from OpenSSL import SSL
 from OpenSSL.crypto import FILETYPE_PEM
 import re
 from twisted.internet import ssl
 from twisted.internet._sslverify import optionsForClientTLS, PrivateCertificate, KeyPair, Certificate, _tolerateErrors
 from twisted.internet.endpoints import UNIXClientEndpoint
-from twisted.web.client import Agent, _URI, BrowserLikePolicyForHTTPS, _requireSSL
+from twisted.web.client import Agent, _URI, BrowserLikePolicyForHTTPS, _requireSSL, HTTPConnectionPool
 
 from treq.client import HTTPClient
 from treq._utils import default_pool, default_reactor
 
-from treq.content import collect, content, text_content, json_content
+from treq.content import content, text_content, json_content, _BodyCollector
+from twisted.internet.defer import Deferred, succeed
 from twisted.web.error import PageRedirect
 from twisted.web.iweb import IPolicyForHTTPS
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from zope.interface import implementer
 
 
+class _StreamCollector(_BodyCollector):
+
+    def connectionLost(self, reason):
+        # deferred is already errbacked if stream was cancelled
+        if not self.finished.called:
+            _BodyCollector.connectionLost(self, reason)
+
+
+def collect(response, collector):
+    """
+    Incrementally collect the body of the response, same as treq.content.collect.
+
+    Cancelling returned deferred closes connection, so endless streams
+    (logs, events, stats) can be stopped.
+    """
+    if response.length == 0:
+        return succeed(None)
+
+    def cancel(d):
+        if protocol.transport:
+            protocol.transport.stopProducing()
+
+    d = Deferred(cancel)
+    protocol = _StreamCollector(d, collector)
+    response.deliverBody(protocol)
+    return d
+
+
 class UNIXAwareHttpClient(HTTPClient):
     def request(self, method, url, **kwargs):
         return super(UNIXAwareHttpClient, self).request(method, url, **kwargs)
@@ -36,19 +67,64 @@ class CtxFactory(ssl.ClientContextFactory):
         return ctx
 
 
+@implementer(IOpenSSLClientConnectionCreator)
+class ResumingClientConnectionCreator(object):
+    """
+    Client connection creator that resumes last TLS session negotiated with the daemon.
+
+    Wraps options created by optionsForClientTLS, so SSL context is built once and
+    repeated connections skip full handshake.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.session = None
+
+        options._ctx.set_session_cache_mode(SSL.SESS_CACHE_CLIENT)
+
+        # bypass hostname verification
+        options._ctx.set_info_callback(
+            _tolerateErrors(self._identityVerifyingInfoCallback)
+        )
+
+    def _identityVerifyingInfoCallback(self, connection, where, ret):
+        if where & SSL.SSL_CB_HANDSHAKE_DONE:
+            self.session = connection.get_session()
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = self.options.clientConnectionForTLS(tlsProtocol)
+
+        if self.session is not None:
+            connection.set_session(self.session)
+
+        return connection
+
+
 @implementer(IPolicyForHTTPS)
 class BrowserLikeTLSPolicyForHTTPS(object):
     """
     SSL connection creator for web clients.
+
+    Parsed key material and connection creators are cached, policy is
+    expected to live as long as docker client of deployment.
     """
     def __init__(self, key, crt, ca):
         self._trustRoot = None
+        self._clientCertificate = None
+        self._creators = {}
+
         self.key = key
         self.crt = crt
         self.ca = ca
 
-    def _identityVerifyingInfoCallback(self, connection, where, ret):
-        pass
+    def _load_material(self):
+        if self._clientCertificate is None:
+            key_pair = KeyPair.load(self.key, format=FILETYPE_PEM)
+            self._clientCertificate = PrivateCertificate.fromCertificateAndKeyPair(
+                Certificate.loadPEM(self.crt), key_pair)
+
+            self._trustRoot = ssl.Certificate.loadPEM(self.ca)
+
+        return self._trustRoot, self._clientCertificate
 
     @_requireSSL
     def creatorForNetloc(self, hostname, port):
@@ -57,8 +133,7 @@ class BrowserLikeTLSPolicyForHTTPS(object):
         <twisted.internet.interfaces.IOpenSSLClientConnectionCreator>} for a
         given network location.
 
-        @param tls: The TLS protocol to create a connection for.
-        @type tls: L{twisted.protocols.tls.TLSMemoryBIOProtocol}
+        Creator is built once per network location and reused afterwards.
 
         @param hostname: The hostname part of the URI.
         @type hostname: L{bytes}
@@ -72,19 +147,13 @@ class BrowserLikeTLSPolicyForHTTPS(object):
             <twisted.internet.interfaces.IOpenSSLClientConnectionCreator>}
         """
 
-        key_pair = KeyPair.load(self.key, format=FILETYPE_PEM)
-        cert = PrivateCertificate.fromCertificateAndKeyPair(Certificate.loadPEM(self.crt), key_pair)
+        if (hostname, port) not in self._creators:
+            authority, cert = self._load_material()
 
-        authority = ssl.Certificate.loadPEM(self.ca)
+            options = optionsForClientTLS(hostname.decode("ascii"), authority, clientCertificate=cert)
+            self._creators[(hostname, port)] = ResumingClientConnectionCreator(options)
 
-        options = optionsForClientTLS(hostname.decode("ascii"), authority, clientCertificate=cert)
-
-        # bypass hostname verification
-        # options._identityVerifyingInfoCallback = self._identityVerifyingInfoCallback
-        options._ctx.set_info_callback(
-            _tolerateErrors(self._identityVerifyingInfoCallback)
-        )
-        return options
+        return self._creators[(hostname, port)]
 
 class UNIXAwareHttpAgent(Agent):
 
@@ -228,11 +297,34 @@ def request(method, url, **kwargs):
     return _client(**kwargs).request(method, url, **kwargs)
 
 
+def persistent_pool(reactor=None, max_per_host=10, idle_timeout=240, retry=True):
+    """
+    Create keep-alive connection pool.
+
+    Pool is meant to be long-lived and shared by all the requests to the same
+    docker daemon, so connection setup (unix socket or tls handshake) is paid
+    only once per connection instead of once per request.
+
+    :param max_per_host: Maximum number of idle connections kept per host
+    :param idle_timeout: Seconds idle connection is kept open
+    :param retry: Retry idempotent requests once if cached connection turned out to be stale
+    """
+    pool = HTTPConnectionPool(default_reactor(reactor), persistent=True)
+    pool.maxPersistentPerHost = max_per_host
+    pool.cachedConnectionTimeout = idle_timeout
+    pool.retryAutomatically = retry
+    return pool
+
+
 def _client(*args, **kwargs):
-    reactor = default_reactor(kwargs.get('reactor'))
-    pool = default_pool(reactor,
-                        kwargs.get('pool'),
-                        persistent=False)
-                        #kwargs.get('persistent'))
-    agent = UNIXAwareHttpAgent(reactor, pool=pool, **kwargs)
+    agent = kwargs.get('agent')
+
+    if agent is None:
+        reactor = default_reactor(kwargs.get('reactor'))
+        pool = default_pool(reactor,
+                            kwargs.get('pool'),
+                            persistent=False)
+                            #kwargs.get('persistent'))
+        agent = UNIXAwareHttpAgent(reactor, pool=pool, **kwargs)
+
     return UNIXAwareHttpClient(agent)
\ No newline at end of file
@@ -0,0 +1,218 @@
+import json
+import os
+import socket
+import sys
+
+import inject
+from mcloud.events import EventBus
+from mcloud.remote import ApiRpcServer
+from twisted.internet import defer, reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.protocol import ProcessProtocol, Protocol
+from twisted.internet.task import deferLater
+from twisted.python import log
+import txredisapi
+
+
+def worker_id(pid):
+    return '%s:%s' % (socket.gethostname(), pid)
+
+
+class WorkerRpcServer(ApiRpcServer):
+    """
+    ApiRpcServer of worker process.
+
+    Tasks run here exactly as in server process, but clients are never
+    connected here, so progress, output and result always go to event bus
+    and server process passes them to the client (see ApiRpcServer).
+
+    Worker announces it has taken the task with
+
+        task.accepted.<ticket id>  {'worker': worker id}
+
+    so server fails the task, if worker exits before task is over.
+    """
+
+    def __init__(self):
+        super(WorkerRpcServer, self).__init__()
+
+        # tasks are never passed further
+        self.workers = 0
+
+    def subscribe(self):
+        self.eb.on('task.kill.*', self.on_task_kill)
+        self.eb.on('task.attached.*', self.on_task_attached)
+
+    def task_accepted(self, ticket_id):
+        return self.eb.fire_event('task.accepted.%s' % ticket_id, {'worker': worker_id(os.getpid())})
+
+
+class TaskWorker(object):
+    """
+    Takes tasks from the queue and runs them, up to `concurrency` at once.
+
+    Queue is read with blocking pop, so it needs connection of it's own.
+
+    Job is moved to worker's own PROCESSING_KEY list, and is removed from there
+    once task.accepted is published. If worker exits in between, WorkerPool
+    puts the job back to the queue (see requeue).
+    """
+    rpc_server = inject.attr(ApiRpcServer)
+
+    PROCESSING_KEY = 'mcloud-task-jobs-%s'
+
+    def __init__(self, queue, concurrency=20, poll_timeout=5):
+        """
+        @type queue: txredisapi.Connection
+        """
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_timeout = poll_timeout
+
+        self.active = set()
+        self.running = False
+
+        self._slot = None
+
+        self.processing_key = self.PROCESSING_KEY % worker_id(os.getpid())
+
+    def start(self):
+        self.running = True
+        return self._consume()
+
+    def stop(self):
+        self.running = False
+
+    @inlineCallbacks
+    def _consume(self):
+        while self.running:
+            if len(self.active) >= self.concurrency:
+                self._slot = defer.Deferred()
+                yield self._slot
+                continue
+
+            try:
+                item = yield self.queue.brpoplpush(ApiRpcServer.JOBS_KEY, self.processing_key, timeout=self.poll_timeout)
+            except txredisapi.ConnectionError:
+                log.err()
+                yield deferLater(reactor, self.poll_timeout, lambda: None)
+                continue
+
+            if item:
+                self.run(json.loads(item), item)
+
+    def run(self, job, item=None):
+        ticket_id = job['ticket_id']
+
+        self.active.add(ticket_id)
+
+        d = defer.maybeDeferred(self.rpc_server.task_accepted, ticket_id)
+        if item is not None:
+            d.addCallback(lambda _: self.queue.lrem(self.processing_key, 1, item))
+        d.addErrback(log.err)
+
+        d = self.rpc_server.run_task(ticket_id, job['name'], job['args'], job['kwargs'])
+        d.addBoth(self._done, ticket_id)
+        return d
+
+    def _done(self, result, ticket_id):
+        self.active.discard(ticket_id)
+
+        if self._slot and not self._slot.called:
+            slot, self._slot = self._slot, None
+            slot.callback(None)
+
+
+class ParentWatcher(Protocol):
+    """
+    Stops worker, when server process closes our stdin (that is, exits).
+    """
+
+    def connectionLost(self, reason):
+        log.msg('Server process has gone, stopping worker')
+
+        if reactor.running:
+            reactor.stop()
+
+
+class WorkerProcess(ProcessProtocol):
+    def __init__(self, pool):
+        self.pool = pool
+
+    def processEnded(self, reason):
+        self.pool.on_exit(self, reason)
+
+
+class WorkerPool(object):
+    """
+    Keeps worker processes running.
+
+    Worker, that exits, is started again. Tasks it was running are failed,
+    jobs it has taken, but not accepted yet, are put back to the queue.
+    """
+    eb = inject.attr(EventBus)
+    redis = inject.attr(txredisapi.Connection)
+
+    def __init__(self, count, args, restart_delay=1.0):
+        """
+        :param args: command line arguments of worker process
+        """
+        self.count = count
+        self.args = args
+        self.restart_delay = restart_delay
+
+        self.processes = {}
+        """ pid -> WorkerProcess """
+
+        self.stopping = False
+
+    def start(self):
+        for i in range(self.count):
+            self.spawn()
+
+    def spawn(self):
+        protocol = WorkerProcess(self)
+
+        process = reactor.spawnProcess(protocol, sys.executable,
+                                       [sys.executable, '-m', 'mcloud.rpc_server'] + list(self.args),
+                                       env=os.environ, childFDs={0: 'w', 1: 1, 2: 2})
+
+        protocol.pid = process.pid
+        self.processes[process.pid] = protocol
+
+        log.msg('Started worker process %s' % process.pid)
+
+    def on_exit(self, protocol, reason):
+        self.processes.pop(protocol.pid, None)
+
+        self.requeue(worker_id(protocol.pid)).addErrback(log.err)
+
+        # server processes, that passed tasks to the worker, fail them
+        self.eb.fire_event('worker.lost', worker_id(protocol.pid))
+
+        if not self.stopping:
+            log.msg('Worker process %s has exited: %s' % (protocol.pid, reason.getErrorMessage()))
+            reactor.callLater(self.restart_delay, self.spawn)
+
+    @inlineCallbacks
+    def requeue(self, worker):
+        """
+        Put jobs, that worker has taken, but not accepted, back to the queue.
+        """
+        key = TaskWorker.PROCESSING_KEY % worker
+
+        while True:
+            item = yield self.redis.rpoplpush(key, ApiRpcServer.JOBS_KEY)
+            if item is None:
+                break
+
+            log.msg('Job of lost worker %s is queued again: %s' % (worker, item))
+
+    def stop(self):
+        self.stopping = True
+
+        for protocol in self.processes.values():
+            try:
+                protocol.transport.signalProcess('TERM')
+            except Exception:
+                pass
@@ -102,6 +102,11 @@ setup(
         'flake8==2.1.0',
     ],
 
+    extras_require={
+        # binary websocket codec, JSON is used without it
+        'msgpack': ['msgpack>=0.5.2'],
+    },
+
     # extras_require = {
     #     'client': [
     #         'readline',
@@ -100,7 +100,7 @@ def test_app_controller():
 
         mockapp = flexmock()
         flexmock(Application).new_instances(mockapp)
-        mockapp.should_receive('load').with_args(need_details=True).and_return(defer.succeed({'foo': 'bar'}))
+        mockapp.should_receive('load').with_args(need_details=True, history=False).and_return(defer.succeed({'foo': 'bar'}))
 
         r = yield controller.list()
 
@@ -113,3 +113,22 @@ def test_app_controller():
 
         with pytest.raises(AppDoesNotExist):
             yield controller.get('foo')
+
+
+def test_details_history_only_when_asked():
+    import inject
+    inject.clear_and_configure(lambda binder: binder.bind('dns-search-suffix', 'mcloud.lh'))
+
+    service = flexmock(shortname='web', name='web.foo', error=None, stats={'cpu_usage': 1.0},
+                       stats_history=[1.0, 2.0], ip=lambda: None, public_ports=lambda: {}, hosts_path=lambda: None,
+                       attached_volumes=lambda: {}, started_at=lambda: None, is_web=lambda: False,
+                       is_running=lambda: False, is_created=lambda: True)
+    app_config = flexmock(hosts={}, get_volumes=lambda: {}, get_services=lambda: {'web.foo': service})
+
+    app = Application({'path': 'foo/bar'}, name='foo')
+
+    details = app._details(app_config, flexmock(name='local'))
+    assert not 'cpu_history' in details['services'][0]
+
+    details = app._details(app_config, flexmock(name='local'), history=True)
+    assert details['services'][0]['cpu_history'] == [1.0, 2.0]
@@ -0,0 +1,147 @@
+import copy
+from flexmock import flexmock
+import inject
+from mcloud.application import ApplicationController
+from mcloud.applist import diff, apply_patch, AppListFeed, HistoryAppListFeed
+from mcloud.events import EventBus
+from mcloud.remote import ApiRpcServer
+from twisted.internet import defer
+from twisted.internet.task import Clock
+
+
+def test_diff_and_patch():
+    old = {
+        'foo': {'name': 'foo', 'status': 'RUNNING', 'services': [{'name': 'web.foo', 'cpu': 1.0}]},
+        'bar/baz': {'name': 'bar/baz', 'status': 'STOPPED', 'services': []},
+    }
+    new = {
+        'foo': {'name': 'foo', 'status': 'RUNNING', 'services': [{'name': 'web.foo', 'cpu': 2.5}]},
+        'boo': {'name': 'boo', 'status': 'error', 'services': []},
+    }
+
+    ops = diff(old, new)
+
+    assert {'op': 'replace', 'path': '/foo/services/0/cpu', 'value': 2.5} in ops
+    assert {'op': 'remove', 'path': '/bar~1baz'} in ops
+    assert len(ops) == 3
+
+    assert apply_patch(copy.deepcopy(old), ops) == new
+    assert diff(new, copy.deepcopy(new)) == []
+
+
+def test_list_of_other_length_is_replaced():
+    ops = diff({'a': [1, 2]}, {'a': [1, 2, 3]})
+
+    assert ops == [{'op': 'replace', 'path': '/a', 'value': [1, 2, 3]}]
+
+
+def make_feed(lists, backlog=0, feed_class=AppListFeed):
+    inject.clear()
+
+    app_controller = flexmock(history=[])
+
+    def list(history=False):
+        app_controller.history.append(history)
+        return defer.succeed(lists.pop(0))
+    app_controller.should_receive('list').replace_with(list)
+
+    sent = []
+    def task_progress(data, ticket_id, droppable=True, logged=True):
+        # list messages are not written to ticket log
+        assert not logged
+        sent.append((ticket_id, data))
+
+    rpc_server = flexmock(attach_handlers={})
+    rpc_server.should_receive('task_progress').replace_with(task_progress)
+    rpc_server.should_receive('task_backlog').and_return(backlog)
+
+    eb = flexmock()
+    eb.should_receive('on')
+    eb.should_receive('cancel')
+
+    def my_config(binder):
+        binder.bind(ApplicationController, app_controller)
+        binder.bind(ApiRpcServer, rpc_server)
+        binder.bind(EventBus, eb)
+    inject.configure(my_config)
+
+    clock = Clock()
+    return feed_class(interval=1.0, clock=clock), clock, sent
+
+
+def test_feed_sends_snapshot_then_deltas():
+    foo = {'name': 'foo', 'status': 'RUNNING'}
+    feed, clock, sent = make_feed([
+        [foo],
+        [foo],
+        [{'name': 'foo', 'status': 'STOPPED'}],
+    ])
+
+    d1 = feed.subscribe(1)
+    assert sent == [(1, {'list': 'snapshot', 'rev': 1, 'apps': {'foo': foo}})]
+
+    # nothing changed
+    clock.advance(1)
+    assert len(sent) == 1
+
+    clock.advance(1)
+    assert sent[1] == (1, {'list': 'delta', 'rev': 2,
+                           'ops': [{'op': 'replace', 'path': '/foo/status', 'value': 'STOPPED'}]})
+
+    d1.addErrback(lambda failure: None)
+    d1.cancel()
+
+    assert feed.stats() == {'subscribers': 0, 'rev': 2}
+    assert not clock.getDelayedCalls()
+
+
+def test_feed_loads_list_once_for_all_subscribers():
+    lists = [[{'name': 'foo', 'cpu': n}] for n in range(3)]
+    feed, clock, sent = make_feed(lists)
+
+    feed.subscribe(1)
+    feed.subscribe(2)
+    clock.advance(1)
+
+    assert lists == []
+    assert [ticket_id for ticket_id, data in sent] == [1, 2, 1, 2, 1, 2]
+    assert sent[-1][1]['list'] == 'delta'
+
+
+def test_lagging_subscriber_is_skipped():
+    feed, clock, sent = make_feed([[{'name': 'foo'}]], backlog=1000)
+
+    feed.subscribe(1)
+
+    assert sent == []
+    assert feed.subscribers == {1: None}
+
+
+def test_reattached_subscriber_gets_snapshot():
+    foo = {'name': 'foo', 'status': 'RUNNING'}
+    feed, clock, sent = make_feed([[foo]])
+
+    d = feed.subscribe(1)
+    assert len(sent) == 1
+
+    feed.rpc_server.attach_handlers[1]()
+    assert sent[1] == (1, {'list': 'snapshot', 'rev': 1, 'apps': {'foo': foo}})
+
+    d.addErrback(lambda failure: None)
+    d.cancel()
+    assert feed.rpc_server.attach_handlers == {}
+
+
+def test_history_feed_loads_cpu_history():
+    foo = {'name': 'foo', 'services': [{'name': 'web.foo', 'cpu_history': [1.0, 2.0]}]}
+
+    feed, clock, sent = make_feed([[foo]], feed_class=HistoryAppListFeed)
+    feed.subscribe(1)
+
+    assert feed.app_controller.history == [True]
+    assert sent == [(1, {'list': 'snapshot', 'rev': 1, 'apps': {'foo': foo}})]
+
+    feed, clock, sent = make_feed([[foo]])
+    feed.subscribe(1)
+
+    assert feed.app_controller.history == [False]
@@ -0,0 +1,95 @@
+import os
+from flexmock import flexmock
+from mcloud.buildcache import BuildCache, directory_digest, files_digest
+from mcloud.container import DockerfileImageBuilder, InlineDockerfileImageBuilder
+from mcloud.util import inject_services
+import pytest
+from twisted.internet import defer
+import txredisapi
+
+
+def test_directory_digest(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM ubuntu')
+    tmpdir.mkdir('src').join('app.py').write('print 1')
+
+    digest = directory_digest(str(tmpdir))
+    assert digest == directory_digest(str(tmpdir))
+
+    os.utime(str(tmpdir.join('Dockerfile')), (0, 0))
+    assert digest == directory_digest(str(tmpdir))
+
+    tmpdir.join('src', 'app.py').write('print 2')
+    assert digest != directory_digest(str(tmpdir))
+
+
+def test_directory_digest_missing_dir():
+    with pytest.raises(OSError):
+        directory_digest('/no/such/dir')
+
+
+def test_files_digest():
+    assert files_digest({'Dockerfile': 'FROM ubuntu'}) == files_digest({'Dockerfile': u'FROM ubuntu'})
+    assert files_digest({'Dockerfile': 'FROM ubuntu'}) != files_digest({'Dockerfile': 'FROM debian'})
+
+
+def configure_cache(redis):
+    settings = flexmock(docker=flexmock(build_cache=True, build_context_gzip=False))
+
+    def configure(binder):
+        binder.bind('settings', settings)
+        binder.bind(txredisapi.Connection, redis)
+
+    return inject_services(configure)
+
+
+@pytest.inlineCallbacks
+def test_cache_verifies_image():
+    redis = flexmock()
+    client = flexmock(url='unix://var/run/docker.sock/')
+
+    redis.should_receive('hget').with_args('mcloud-build-cache', 'unix://var/run/docker.sock/ abc').and_return(defer.succeed('123'))
+    redis.should_receive('hdel').with_args('mcloud-build-cache', 'unix://var/run/docker.sock/ abc').once().and_return(defer.succeed(1))
+
+    client.should_receive('inspect_image').with_args('123').and_return(defer.succeed(None))
+
+    with configure_cache(redis):
+        image_id = yield BuildCache().get(client, 'abc')
+
+    assert image_id is None
+
+
+@pytest.inlineCallbacks
+def test_unchanged_context_is_not_built(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM ubuntu')
+
+    redis = flexmock()
+    client = flexmock(url='unix://var/run/docker.sock/')
+
+    redis.should_receive('hget').and_return(defer.succeed('123'))
+    client.should_receive('inspect_image').with_args('123').and_return(defer.succeed({'Id': '123'}))
+    client.should_receive('build_image').never()
+    client.should_receive('task_log').with_args(123123, 'Build context: 11 B. Largest entries: Dockerfile 11 B').once()
+
+    with configure_cache(redis):
+        builder = DockerfileImageBuilder(str(tmpdir))
+        image_id = yield builder.build_image(ticket_id=123123, service=flexmock(client=client))
+
+    assert image_id == '123'
+
+
+@pytest.inlineCallbacks
+def test_build_result_is_cached():
+    redis = flexmock()
+    client = flexmock(url='unix://var/run/docker.sock/')
+
+    builder = InlineDockerfileImageBuilder('FROM ubuntu')
+    field = 'unix://var/run/docker.sock/ %s' % files_digest({'Dockerfile': 'FROM ubuntu'})
+
+    redis.should_receive('hget').and_return(defer.succeed(None))
+    redis.should_receive('hset').with_args('mcloud-build-cache', field, '123').once().and_return(defer.succeed(1))
+    client.should_receive('build_image').once().and_return(defer.succeed('123'))
+
+    with configure_cache(redis):
+        image_id = yield builder.build_image(ticket_id=123123, service=flexmock(client=client))
+
+    assert image_id == '123'
@@ -0,0 +1,51 @@
+import pytest
+from mcloud import codec
+from mcloud.remote import pack_stream_frame, is_stream_frame, STREAM_STDOUT
+
+
+def test_negotiate():
+    assert codec.negotiate(None) == (codec.JSON, None)
+    assert codec.negotiate(['foo']) == (codec.JSON, None)
+    assert codec.negotiate(['foo', 'mcloud.json']) == (codec.JSON, 'mcloud.json')
+
+    # first offered codec wins
+    selected, protocol = codec.negotiate(codec.codec_names())
+    assert selected is codec.CODECS[0]
+    assert protocol == codec.CODECS[0].name
+
+
+def test_get_codec():
+    assert codec.get_codec('mcloud.json') is codec.JSON
+    assert codec.get_codec(None) is codec.JSON
+
+
+@pytest.mark.parametrize('name', codec.codec_names())
+def test_roundtrip(name):
+    c = codec.get_codec(name)
+
+    message = {'type': 'response', 'id': 1, 'success': True,
+               'response': [{'name': u'foo', 'running': False, 'stats': {'cpu': 1.5}, 'ip': None}]}
+
+    payload = c.encode(message)
+
+    assert c.decode(payload) == message
+    assert not is_stream_frame(payload)
+
+
+def test_msgpack_roundtrip():
+    pytest.importorskip('msgpack')
+
+    c = codec.MsgpackCodec()
+    message = {'type': 'event', 'name': u'task.progress.1', 'data': {'cpu': 1.5, 'ip': None}}
+
+    assert c.decode(c.encode(message)) == message
+    assert codec.negotiate(['mcloud.msgpack', 'mcloud.json']) == (codec.get_codec('mcloud.msgpack'), 'mcloud.msgpack')
+
+
+def test_msgpack_message_is_not_stream_frame():
+    pytest.importorskip('msgpack')
+
+    payload = codec.MsgpackCodec().encode({'type': 'event', 'name': 'task.stdout.1', 'data': None})
+
+    assert not is_stream_frame(payload)
+    assert is_stream_frame(pack_stream_frame(STREAM_STDOUT, 1, '{}'))
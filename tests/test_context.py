@@ -0,0 +1,71 @@
+from mcloud.context import IgnoreMatcher, walk_context, context_sizes, format_size
+
+
+def test_matcher_name_on_any_depth():
+    m = IgnoreMatcher(['*.pyc', 'node_modules', '# comment', ''])
+
+    assert m.match('foo.pyc')
+    assert m.match('src/foo.pyc')
+    assert m.match('node_modules', is_dir=True)
+    assert m.match('web/node_modules/foo/bar.js')
+    assert not m.match('src/foo.py')
+    assert not m.match('node_modules_x')
+
+
+def test_matcher_anchored_and_dir_only():
+    m = IgnoreMatcher(['/build/', 'docs/*.md', 'a/**/b'])
+
+    assert m.match('build', is_dir=True)
+    assert m.match('build/out.o')
+    assert not m.match('build')
+    assert not m.match('src/build', is_dir=True)
+
+    assert m.match('docs/readme.md')
+    assert not m.match('docs/sub/readme.md')
+
+    assert m.match('a/b')
+    assert m.match('a/x/y/b')
+
+
+def test_matcher_negation():
+    m = IgnoreMatcher(['*.md', '!README.md'])
+
+    assert m.match('CHANGES.md')
+    assert not m.match('README.md')
+
+
+def test_matcher_dockerignore_anchored():
+    m = IgnoreMatcher(['*.log'], ['vendor', '*.tmp', '!keep.tmp'])
+
+    assert m.match('vendor')
+    assert m.match('vendor/lib.py')
+    assert not m.match('lib/vendor/lib.py')
+    assert m.match('a.tmp')
+    assert not m.match('src/a.tmp')
+    assert not m.match('keep.tmp')
+    assert m.match('src/a.log')
+
+
+def test_walk_context(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM ubuntu')
+    tmpdir.join('.dockerignore').write('.git\n')
+    tmpdir.join('.mcignore').write('*.log\nDockerfile\n')
+    tmpdir.mkdir('.git').join('HEAD').write('ref')
+    src = tmpdir.mkdir('src')
+    src.join('app.py').write('print 1')
+    src.join('app.log').write('log')
+
+    matcher = IgnoreMatcher.from_directory(str(tmpdir))
+    entries = [rel_path for rel_path, full_path, st in walk_context(str(tmpdir), matcher)]
+
+    assert entries == ['.dockerignore', '.mcignore', 'Dockerfile', 'src', 'src/app.py']
+
+    total, sizes = context_sizes(str(tmpdir), matcher)
+    assert sizes['src'] == 7
+    assert total == 7 + 11 + 5 + 17
+
+
+def test_format_size():
+    assert format_size(10) == '10 B'
+    assert format_size(2048) == '2.0 KB'
+    assert format_size(3 * 1024 * 1024) == '3.0 MB'
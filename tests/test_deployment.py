@@ -1,4 +1,5 @@
 from flexmock import flexmock
+import inject
 from mcloud.application import ApplicationController, Application
 from mcloud.deployment import Deployment, DeploymentController, DeploymentDoesNotExist
 from mcloud.events import EventBus
@@ -186,3 +187,43 @@ def test_deployment_controller_publish_app():
         assert r.public_app is None
 
 
+
+
+def test_deployment_client_is_shared():
+    inject.clear()
+
+    Deployment.clients = {}
+
+    d1 = Deployment(name='foo', host='unix://var/run/docker.sock/')
+    d2 = Deployment(name='foo', host='unix://var/run/docker.sock/')
+
+    assert d1.get_client() is d2.get_client()
+    assert d1.get_client().pool.persistent is True
+
+
+def test_deployment_client_recreated_on_config_change():
+    inject.clear()
+
+    Deployment.clients = {}
+
+    client = Deployment(name='foo', host='unix://var/run/docker.sock/').get_client()
+    flexmock(client).should_receive('close').once()
+
+    d2 = Deployment(name='foo', host='unix://var/run/docker2.sock/')
+
+    assert d2.get_client() is not client
+    assert Deployment.clients['foo'][1] is d2.get_client()
+
+
+def test_deployment_client_limit_is_shared_with_workers():
+    from mcloud.rpc_server import DockerConfiguration
+
+    Deployment.clients = {}
+
+    def configure(binder):
+        binder.bind('settings', flexmock(workers=4, docker=DockerConfiguration()))
+
+    with inject_services(configure):
+        client = Deployment(name='foo', host='unix://var/run/docker.sock/').get_client()
+
+    assert client.limiter.limit == 4
@@ -1,8 +1,12 @@
+from StringIO import StringIO
+import tarfile
+from autobahn.twisted.util import sleep
 from flexmock import flexmock
 from mcloud.service import Service
 
 import os
-from mcloud.container import PrebuiltImageBuilder, DockerfileImageBuilder
+from mcloud.container import PrebuiltImageBuilder, DockerfileImageBuilder, ArchiveProducer, CanNotAccessPath, \
+    InlineDockerfileImageBuilder
 from mcloud.test_utils import mock_docker
 import pytest
 from twisted.internet import defer
@@ -57,15 +61,117 @@ def test_image_builder_prebuilt_already_built():
         assert result == 'foo/bar'
 
 
+class Consumer(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
 @pytest.inlineCallbacks
 def test_image_builder_create_archive():
 
     builder = DockerfileImageBuilder(os.path.join(os.path.dirname(__file__), '_files/ct_bash'))
 
-    file = yield builder.create_archive()
+    consumer = Consumer()
+    yield builder.create_archive().startProducing(consumer)
 
+    file = ''.join(consumer.chunks)
     assert len(file) > 30
 
+    t = tarfile.open(fileobj=StringIO(file))
+    assert './Dockerfile' in t.getnames()
+
+
+@pytest.inlineCallbacks
+def test_archive_honors_ignore_rules(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM ubuntu')
+    tmpdir.join('.mcignore').write('.git')
+    tmpdir.mkdir('.git').join('HEAD').write('ref')
+
+    consumer = Consumer()
+    yield ArchiveProducer(str(tmpdir)).startProducing(consumer)
+
+    t = tarfile.open(fileobj=StringIO(''.join(consumer.chunks)))
+    assert t.getnames() == ['.', './.mcignore', './Dockerfile']
+
+
+@pytest.inlineCallbacks
+def test_inline_builder_archive_in_memory():
+
+    builder = InlineDockerfileImageBuilder(u'FROM ubuntu')
+
+    consumer = Consumer()
+    yield builder.create_archive().startProducing(consumer)
+
+    t = tarfile.open(fileobj=StringIO(''.join(consumer.chunks)))
+    assert t.extractfile('./Dockerfile').read() == 'FROM ubuntu'
+
+
+@pytest.inlineCallbacks
+def test_archive_producer_chunks_and_compression():
+
+    producer = ArchiveProducer(os.path.join(os.path.dirname(__file__), '_files/ct_bash'), compress=True, chunk_size=10)
+
+    consumer = Consumer()
+    yield producer.startProducing(consumer)
+
+    assert len(consumer.chunks) > 1
+
+    t = tarfile.open(fileobj=StringIO(''.join(consumer.chunks)), mode='r:gz')
+    assert './Dockerfile' in t.getnames()
+
+
+def paused_producer():
+    producer = ArchiveProducer(os.path.join(os.path.dirname(__file__), '_files/ct_bash'), chunk_size=10)
+
+    consumer = Consumer()
+    consumer.write = lambda data: (consumer.chunks.append(data), producer.pauseProducing())
+
+    return producer, consumer
+
+
+@pytest.inlineCallbacks
+def test_archive_producer_waits_while_paused():
+
+    producer, consumer = paused_producer()
+    d = producer.startProducing(consumer)
+
+    while not consumer.chunks:
+        yield sleep(0.01)
+
+    yield sleep(0.05)
+    assert not d.called
+
+    producer.resumeProducing()
+    yield d
+
+
+@pytest.inlineCallbacks
+def test_archive_producer_stopped():
+
+    producer, consumer = paused_producer()
+    d = producer.startProducing(consumer)
+
+    while not consumer.chunks:
+        yield sleep(0.01)
+
+    producer.stopProducing()
+
+    yield sleep(0.05)
+    assert not d.called
+    assert len(consumer.chunks) == 1
+
+
+@pytest.inlineCallbacks
+def test_archive_producer_missing_path():
+
+    producer = ArchiveProducer('/no/such/path')
+
+    with pytest.raises(CanNotAccessPath):
+        yield producer.startProducing(Consumer())
+
 
 @pytest.inlineCallbacks
 def test_image_builder_build():
@@ -79,7 +185,8 @@ def test_image_builder_build():
         from mcloud.service import Service
         s = Service(client=client)
 
-        builder.should_receive('create_archive').once().and_return(defer.succeed('foo'))
+        builder.should_receive('create_archive').once().and_return('foo')
+        client.should_receive('task_log')
 
         client.should_receive('build_image').with_args('foo', ticket_id=123123).and_return(defer.succeed('baz'))
 
@@ -0,0 +1,94 @@
+from flexmock import flexmock
+from mcloud.container import PrebuiltImageBuilder
+from mcloud.images import ImageIndex, split_image_name
+import pytest
+from twisted.internet import defer
+
+
+IMAGES = [
+    {'Id': 'id1', 'RepoTags': ['ubuntu:14.04', 'ubuntu:latest'], 'RepoDigests': ['ubuntu@sha256:abc']},
+    {'Id': 'id2', 'RepoTags': ['localhost:5000/foo/bar:1.0']},
+    {'Id': 'id3', 'RepoTags': ['<none>:<none>']},
+]
+
+
+def test_split_image_name():
+    assert split_image_name('ubuntu') == ('ubuntu', None, None)
+    assert split_image_name('ubuntu:14.04') == ('ubuntu', '14.04', None)
+    assert split_image_name('localhost:5000/foo/bar') == ('localhost:5000/foo/bar', None, None)
+    assert split_image_name('localhost:5000/foo/bar:1.0') == ('localhost:5000/foo/bar', '1.0', None)
+    assert split_image_name('ubuntu@sha256:abc') == ('ubuntu', None, 'sha256:abc')
+
+
+@pytest.inlineCallbacks
+def test_index_lookup():
+    client = flexmock()
+    client.should_receive('images').once().and_return(defer.succeed(IMAGES))
+
+    index = ImageIndex(client)
+
+    assert (yield index.find('ubuntu:14.04')) == 'id1'
+    assert (yield index.find('ubuntu')) == 'id1'
+    assert (yield index.find('ubuntu:12.04')) is None
+    assert (yield index.find('ubuntu@sha256:abc')) == 'id1'
+    assert (yield index.find('localhost:5000/foo/bar:1.0')) == 'id2'
+    assert (yield index.find('localhost:5000/foo/bar')) == 'id2'
+    assert (yield index.find('<none>')) is None
+
+
+def test_concurrent_loads_share_listing():
+    client = flexmock()
+    listing = defer.Deferred()
+    client.should_receive('images').once().and_return(listing)
+
+    index = ImageIndex(client)
+
+    d1 = index.find('ubuntu')
+    d2 = index.find('ubuntu:14.04')
+
+    listing.callback(IMAGES)
+
+    assert d1.result == 'id1'
+    assert d2.result == 'id1'
+
+
+def test_image_event_reloads_index():
+    client = flexmock()
+    client.should_receive('images').twice().and_return(defer.succeed(IMAGES))
+
+    index = ImageIndex(client)
+    index.find('ubuntu')
+
+    index.on_event({'id': 'id4', 'status': 'start'})
+    assert index.ready
+
+    index.on_event({'id': 'ubuntu:14.04', 'status': 'untag'})
+    assert not index.ready
+
+    index.find('ubuntu')
+    assert index.ready
+
+
+def test_event_during_load():
+    client = flexmock()
+    listing = defer.Deferred()
+    client.should_receive('images').and_return(listing)
+
+    index = ImageIndex(client)
+    index.load()
+
+    index.on_event({'id': 'ubuntu:14.04', 'status': 'pull'})
+    listing.callback(IMAGES)
+
+    assert not index.ready
+
+
+@pytest.inlineCallbacks
+def test_prebuilt_builder_uses_index():
+    client = flexmock(image_index=flexmock())
+    client.image_index.should_receive('find').with_args('foo/bar:1.0').and_return(defer.succeed(None))
+    client.should_receive('images').never()
+    client.should_receive('pull').with_args('foo/bar', 123123, '1.0').once().and_return(defer.succeed(True))
+
+    result = yield PrebuiltImageBuilder('foo/bar:1.0').build_image(ticket_id=123123, service=flexmock(client=client))
+    assert result == 'foo/bar:1.0'
@@ -0,0 +1,141 @@
+from flexmock import flexmock
+from mcloud.loghub import LogHub
+from twisted.internet import defer
+
+
+def stamped(second, line):
+    return '2015-06-01T10:00:%02d.000000000Z %s' % (second, line)
+
+
+def make_hub(history=3):
+    client = flexmock()
+    streams = []
+
+    def logs(ref, on_log, tail=0, follow=True, timestamps=False):
+        assert timestamps
+        d = defer.Deferred()
+        streams.append((ref, on_log, tail, d, follow))
+        return d
+
+    client.logs = logs
+
+    return LogHub(client, history=history), streams
+
+
+def test_one_upstream_for_all_subscribers():
+    hub, streams = make_hub()
+
+    foo = []
+    bar = []
+    hub.subscribe('foo.app', lambda line, stream: foo.append(line), tail=100)
+    hub.subscribe('foo.app', lambda line, stream: bar.append(line))
+
+    # follow stream and history
+    assert [(tail, follow) for ref, on_log, tail, d, follow in streams] == [(0, True), (3, False)]
+    streams[1][3].callback(None)
+
+    streams[0][1](stamped(1, 'hello'), 'stdout')
+
+    assert foo == ['hello']
+    assert bar == ['hello']
+
+
+def test_new_subscriber_gets_tail():
+    hub, streams = make_hub()
+
+    hub.subscribe('foo.app', lambda line, stream: None)
+    streams[1][3].callback(None)
+
+    for n, line in enumerate(('a', 'b', 'c', 'd')):
+        streams[0][1](stamped(n, line), 'stdout')
+
+    lines = []
+    hub.subscribe('foo.app', lambda line, stream: lines.append(line), tail=2)
+    assert lines == ['c', 'd']
+
+    lines = []
+    hub.subscribe('foo.app', lambda line, stream: lines.append(line), tail=100)
+    assert lines == ['b', 'c', 'd']
+
+    assert len(streams) == 2
+
+
+def test_tail_after_subscriber_without_tail():
+    hub, streams = make_hub()
+
+    first = []
+    hub.subscribe('foo.app', lambda line, stream: first.append(line), tail=0)
+
+    second = []
+    hub.subscribe('foo.app', lambda line, stream: second.append(line), tail=2)
+
+    # line, that was written while history was loading, comes in both
+    streams[0][1](stamped(3, 'c'), 'stdout')
+
+    history, follow = streams[1][1], streams[1][3]
+    for n, line in ((1, 'a'), (2, 'b'), (3, 'c')):
+        history(stamped(n, line), 'stdout')
+    follow.callback(None)
+
+    assert first == ['c']
+    assert second == ['b', 'c']
+
+    third = []
+    hub.subscribe('foo.app', lambda line, stream: third.append(line), tail=3)
+    assert third == ['a', 'b', 'c']
+
+    streams[0][1](stamped(4, 'd'), 'stdout')
+
+    assert first == ['c', 'd']
+    assert second == ['b', 'c', 'd']
+    assert third == ['a', 'b', 'c', 'd']
+    assert len(streams) == 2
+
+
+def test_same_line_written_twice_is_kept():
+    hub, streams = make_hub()
+
+    hub.subscribe('foo.app', lambda line, stream: None)
+
+    # line was written before follow stream was opened and once again after
+    streams[0][1](stamped(2, 'ping'), 'stdout')
+
+    history, follow = streams[1][1], streams[1][3]
+    history(stamped(1, 'ping'), 'stdout')
+    history(stamped(2, 'ping'), 'stdout')
+    follow.callback(None)
+
+    lines = []
+    hub.subscribe('foo.app', lambda line, stream: lines.append(line), tail=3)
+    assert lines == ['ping', 'ping']
+
+
+def test_upstream_closed_with_last_subscriber():
+    hub, streams = make_hub()
+
+    d1 = hub.subscribe('foo.app', lambda line, stream: None)
+    d2 = hub.subscribe('foo.app', lambda line, stream: None)
+    d1.addErrback(lambda failure: None)
+    d2.addErrback(lambda failure: None)
+
+    d1.cancel()
+    assert not streams[0][3].called
+    assert hub.stats() == {'foo.app': 1}
+
+    d2.cancel()
+    assert streams[0][3].called
+    assert hub.stats() == {}
+
+    hub.subscribe('foo.app', lambda line, stream: None)
+    assert len(streams) == 4
+
+
+def test_subscribers_notified_when_log_is_over():
+    hub, streams = make_hub()
+
+    d = hub.subscribe('foo.app', lambda line, stream: None)
+
+    streams[0][3].callback(None)
+
+    assert d.called
+    assert hub.stats() == {}
@@ -0,0 +1,190 @@
+from mcloud.outbox import Outbox
+from twisted.internet.task import Clock
+
+
+class Protocol(object):
+    def __init__(self):
+        self.messages = []
+        self.frames = []
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+    def sendMessage(self, frame, isBinary=False):
+        self.frames.append(frame)
+
+    def dropConnection(self, abort=False):
+        self.dropped = True
+
+
+def progress(n):
+    return {'type': 'event', 'name': 'task.progress.1', 'data': n}
+
+
+def test_messages_batched_per_tick():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, batching=True, clock=clock)
+
+    outbox.push_message(progress(1), 1)
+    outbox.push_message(progress(2), 1)
+
+    assert protocol.messages == []
+
+    clock.advance(0)
+
+    assert protocol.messages == [{'type': 'batch', 'messages': [progress(1), progress(2)]}]
+    assert outbox.stats()['queued'] == 0
+
+
+def test_frames_keep_order():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, batching=False, clock=clock)
+
+    outbox.push_message(progress(1), 1)
+    outbox.push_frame('\x01raw')
+    outbox.push_message(progress(2), 1)
+
+    clock.advance(0)
+
+    assert protocol.messages == [progress(1), progress(2)]
+    assert protocol.frames == ['\x01raw']
+
+
+def test_paused_by_transport():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, clock=clock)
+
+    outbox.pauseProducing()
+    outbox.push_message(progress(1), 1)
+    clock.advance(0)
+
+    assert protocol.messages == []
+    assert outbox.stats()['paused'] is True
+    assert len(outbox) == 1
+
+    outbox.resumeProducing()
+    clock.advance(0)
+
+    assert protocol.messages == [progress(1)]
+
+
+def test_overflow_drop():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, limit=2, policy='drop', clock=clock)
+
+    outbox.pauseProducing()
+    for n in range(5):
+        outbox.push_message(progress(n), 1)
+
+    result = {'type': 'event', 'name': 'task.success.1', 'data': 'ok'}
+    outbox.push_message(result)
+
+    outbox.resumeProducing()
+    clock.advance(0)
+
+    assert protocol.messages == [
+        progress(0),
+        progress(1),
+        {'type': 'event', 'name': 'task.progress.1', 'data': '[3 messages skipped, connection is too slow]'},
+        result,
+    ]
+    assert outbox.stats()['dropped'] == 3
+
+
+def test_overflow_compact():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, limit=4, policy='compact', clock=clock)
+
+    outbox.pauseProducing()
+    result = {'type': 'response', 'id': 1, 'success': True, 'response': 'pong'}
+    outbox.push_message(result)
+
+    for n in range(5):
+        outbox.push_message(progress(n), 1)
+
+    outbox.resumeProducing()
+    clock.advance(0)
+
+    # older half is replaced with a note, newest messages and response stay
+    assert protocol.messages == [
+        result,
+        {'type': 'event', 'name': 'task.progress.1', 'data': '[2 messages skipped, connection is too slow]'},
+        progress(2),
+        progress(3),
+        progress(4),
+    ]
+
+
+def test_stop_producing():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, clock=clock)
+
+    outbox.push_message(progress(1), 1)
+    outbox.stopProducing()
+    clock.advance(0)
+
+    assert protocol.messages == []
+    assert len(outbox) == 0
+
+
+class Producer(object):
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+def test_upstream_paused_while_client_does_not_keep_up():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, limit=4, clock=clock)
+
+    attach = Producer()
+    outbox.add_producer(attach)
+
+    # transport buffer is full
+    outbox.pauseProducing()
+    assert attach.paused
+
+    outbox.resumeProducing()
+    assert not attach.paused
+
+    # queue is over the limit
+    for n in range(4):
+        outbox.push_frame('\x01%s' % n)
+    assert attach.paused
+
+    clock.advance(0)
+    assert len(protocol.frames) == 4
+    assert not attach.paused
+
+    outbox.pauseProducing()
+    outbox.stopProducing()
+    assert not attach.paused
+
+
+def test_hard_limit_disconnects_client():
+    clock = Clock()
+    protocol = Protocol()
+    outbox = Outbox(protocol, limit=2, hard_limit=3, clock=clock)
+
+    outbox.pauseProducing()
+    for n in range(3):
+        outbox.push_message({'type': 'event', 'name': 'task.stdout.1', 'data': n})
+
+    assert not hasattr(protocol, 'dropped')
+
+    outbox.push_frame('\x01')
+
+    assert protocol.dropped
+    assert outbox.stopped
+    assert len(outbox) == 0
@@ -0,0 +1,59 @@
+from mcloud.progress import ProgressAggregator
+from twisted.internet.task import Clock
+
+
+def make_aggregator():
+    records = []
+    clock = Clock()
+    return ProgressAggregator(records.append, interval=0.5, clock=clock), records, clock
+
+
+def downloading(layer, progress):
+    return {'id': layer, 'status': 'Downloading', 'progress': progress}
+
+
+def test_progress_coalesced_per_layer():
+    progress, records, clock = make_aggregator()
+
+    for i in range(100):
+        progress.feed(downloading('a', '%s/100' % i))
+        progress.feed(downloading('b', '%s/100' % i))
+
+    assert records == []
+
+    clock.advance(0.5)
+
+    assert records == [downloading('a', '99/100'), downloading('b', '99/100')]
+    assert progress.received == 200
+    assert progress.emitted == 2
+
+
+def test_status_change_passes_immediately():
+    progress, records, clock = make_aggregator()
+
+    progress.feed(downloading('a', '1/100'))
+    progress.feed({'id': 'a', 'status': 'Pull complete'})
+
+    assert records == [{'id': 'a', 'status': 'Pull complete'}]
+
+    clock.advance(0.5)
+    assert records == [{'id': 'a', 'status': 'Pull complete'}]
+
+
+def test_error_flushes_pending():
+    progress, records, clock = make_aggregator()
+
+    progress.feed(downloading('a', '1/100'))
+    progress.feed({'error': 'boom', 'errorDetail': {'message': 'boom'}})
+
+    assert records == [downloading('a', '1/100'), {'error': 'boom', 'errorDetail': {'message': 'boom'}}]
+
+
+def test_close_flushes_pending():
+    progress, records, clock = make_aggregator()
+
+    progress.feed(downloading('a', '1/100'))
+    progress.close()
+
+    assert records == [downloading('a', '1/100')]
+    assert not clock.getDelayedCalls()
@@ -0,0 +1,74 @@
+from flexmock import flexmock
+from mcloud.pulls import PullCoordinator
+from mcloud.txdocker import CommandFailed
+import pytest
+from twisted.internet import defer
+
+
+def make_coordinator(limit=3):
+    client = flexmock()
+    pulls = []
+
+    def pull_image(name, tag, on_record, on_text=None, ticket_id=None):
+        d = defer.Deferred()
+        pulls.append((name, tag, on_record, d))
+        return d
+
+    client.pull_image = pull_image
+
+    return PullCoordinator(client, limit=limit), client, pulls
+
+
+def test_same_image_joins_pull():
+    coordinator, client, pulls = make_coordinator()
+
+    logs = []
+    client.task_log = lambda ticket_id, message: logs.append((ticket_id, message))
+
+    d1 = coordinator.pull('ubuntu', 1, '14.04')
+    d2 = coordinator.pull('ubuntu', 2, '14.04')
+
+    assert len(pulls) == 1
+    assert coordinator.stats() == {'active': 1, 'queued': 0, 'joined': 1}
+
+    pulls[0][2]({'status': 'Downloading'})
+    assert (1, '{"status": "Downloading"}') in logs
+    assert (2, '{"status": "Downloading"}') in logs
+
+    pulls[0][3].callback(True)
+
+    assert d1.result is True
+    assert d2.result is True
+    assert coordinator.pulls == {}
+
+
+def test_failure_goes_to_every_waiter():
+    coordinator, client, pulls = make_coordinator()
+    client.should_receive('task_log')
+
+    d1 = coordinator.pull('ubuntu', 1)
+    d2 = coordinator.pull('ubuntu', 2, 'latest')
+
+    assert len(pulls) == 1
+
+    pulls[0][3].errback(CommandFailed('no such image'))
+
+    for d in (d1, d2):
+        with pytest.raises(CommandFailed):
+            d.result.raiseException()
+        d.addErrback(lambda failure: None)
+
+
+def test_parallel_limit():
+    coordinator, client, pulls = make_coordinator(limit=2)
+
+    coordinator.pull('ubuntu', 1)
+    coordinator.pull('debian', 1)
+    coordinator.pull('centos', 1)
+
+    assert [x[0] for x in pulls] == ['ubuntu', 'debian']
+    assert coordinator.stats()['queued'] == 1
+
+    pulls[0][3].callback(True)
+
+    assert [x[0] for x in pulls] == ['ubuntu', 'debian', 'centos']
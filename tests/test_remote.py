@@ -1,3 +1,5 @@
+from fnmatch import fnmatch
+import json
 import sys
 from flexmock import flexmock
 import inject
@@ -7,7 +9,8 @@ from mcloud.util import txtimeout
 
 import pytest
 
-from mcloud.remote import Server, Client, ApiError, Task, ApiRpcServer
+from mcloud.remote import Server, Client, ApiError, Task, ApiRpcServer, Session, pack_stream_frame, unpack_stream_frame, \
+    STREAM_STDIN, ReplayBuffer
 from twisted.internet import reactor, defer
 from twisted.python import log
 
@@ -34,6 +37,18 @@ def sleep(secs):
     return d
 
 
+def redis_mock():
+    """
+    Redis, that accepts writes of task queue and ticket log.
+    """
+    rc = flexmock()
+
+    for command in ('hset', 'hdel', 'rpush', 'ltrim', 'expire', 'setex'):
+        rc.should_receive(command)
+
+    return rc
+
+
 #@pytest.inlineCallbacks
 #def test_exchange():
 #    inject.clear()
@@ -311,4 +326,529 @@ def test_task_terminate():
     client.shutdown()
     server.shutdown()
 
-    yield sleep(0.1)
\ No newline at end of file
+    yield sleep(0.1)
+
+def test_stream_frame():
+    frame = pack_stream_frame(STREAM_STDIN, 123, '\x00\xffdata')
+
+    assert unpack_stream_frame(frame) == (STREAM_STDIN, 123, '\x00\xffdata')
+
+
+def test_task_stdout_fallback_to_json():
+    inject.clear()
+
+    eb = flexmock()
+    eb.should_receive('on')
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, redis_mock())
+        binder.bind('settings', None)
+    inject.configure(my_config)
+
+    api = ApiRpcServer()
+
+    client = flexmock(binary_streams=False)
+    client.should_receive('send_event').with_args('task.stdout.5', 'AP8=', seq=1).once()
+    api.ticket_map[5] = client
+
+    api.task_stdout('\x00\xff', 5)
+
+    # input for session attached to other process goes through event bus
+    eb.should_receive('fire_event').with_args('task.stdin.5', 'AP8=').once()
+
+    api.task_stdin(5, '\x00\xff')
+
+
+@pytest.inlineCallbacks
+def test_binary_streams():
+    inject.clear()
+
+    eb = flexmock()
+    eb.should_receive('on')
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, redis_mock())
+        binder.bind('settings', None)
+    inject.configure(my_config)
+
+    server = Server(port=9995, no_ssl=True)
+    server.bind()
+
+    client = Client(port=9995, no_ssl=True)
+    yield client.connect()
+
+    enabled = yield client.enable_binary_streams()
+    assert enabled is True
+
+    api = server.rpc_server
+
+    # stdin is delivered right to the attached session
+    received = []
+    api.stdin_handlers[7] = received.append
+
+    yield client.task_stdin(7, '\x00\x1b[Araw')
+    yield sleep(0.1)
+
+    assert received == ['\x00\x1b[Araw']
+
+    # stdout comes as binary frame
+    task = Task('baz')
+    task.id = 7
+    task.on_stdout = received.append
+    client.task_map[7] = task
+    api.ticket_map[7] = server.clients[0]
+
+    api.task_stdout('\xfe\xffout', 7)
+    yield sleep(0.1)
+
+    assert received == ['\x00\x1b[Araw', '\xfe\xffout']
+
+    # outbound queue of each client is exposed
+    clients = yield client.call_sync('clients')
+    assert len(clients) == 1
+    assert clients[0]['queued'] == 0
+    assert clients[0]['sent'] > 0
+    assert server.clients[0].transport.producer is server.clients[0].outbox
+
+    client.shutdown()
+    server.shutdown()
+
+    yield sleep(0.1)
+
+
+@pytest.inlineCallbacks
+def test_session():
+    inject.clear()
+
+    ids = iter(range(1, 100))
+
+    rc = redis_mock()
+    rc.should_receive('incr').replace_with(lambda key: defer.succeed(next(ids)))
+
+    eb = flexmock()
+    eb.should_receive('on')
+    eb.should_receive('fire_event')
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, rc)
+        binder.bind('settings', None)
+    inject.configure(my_config)
+
+    api = inject.instance(ApiRpcServer)
+
+    slow = defer.Deferred()
+    api.tasks['slow'] = lambda ticket_id: slow
+    api.tasks['fast'] = lambda ticket_id, value: defer.succeed(value * 2)
+
+    server = Server(port=9994, no_ssl=True)
+    server.bind()
+
+    session = Session(port=9994, no_ssl=True)
+
+    # tasks run concurrently over single connection
+    d = session.call(Task('slow'))
+    result = yield session.call(Task('fast'), 21)
+
+    assert result == 42
+    assert len(server.clients) == 1
+    assert not d.called
+
+    slow.callback('done')
+    result = yield d
+
+    assert result == 'done'
+    assert session.client.task_map == {}
+
+    # connection is opened again after it's lost
+    server.shutdown()
+    yield sleep(0.1)
+
+    assert not session.connected
+
+    result = yield session.call(Task('fast'), 1)
+    assert result == 2
+    assert len(server.clients) == 1
+
+    yield session.close()
+    server.shutdown()
+
+    yield sleep(0.1)
+
+
+def test_sessions_are_kept_per_detach_mode():
+    Session.sessions = {}
+
+    attached = Session.get('example.com', '7080')
+    detached = Session.get('example.com', 7080, detach=True)
+
+    assert Session.get('example.com', 7080) is attached
+    assert Session.get('example.com', 7080, detach=True) is detached
+    assert not attached.detach
+    assert detached.detach
+
+    Session.sessions = {}
+
+
+class RecordingClient(object):
+    def __init__(self):
+        self.events = []
+
+    def send_event(self, name, data=None, ticket_id=None, seq=None):
+        self.events.append((name, data))
+
+
+def make_api():
+    inject.clear()
+
+    ids = iter(range(1, 100))
+
+    rc = redis_mock()
+    rc.should_receive('incr').replace_with(lambda key: defer.succeed(next(ids)))
+
+    eb = flexmock()
+    eb.should_receive('on')
+    eb.should_receive('fire_event')
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, rc)
+        binder.bind('settings', flexmock(task_limits={'rebuild': 1}))
+    inject.configure(my_config)
+
+    return ApiRpcServer(), rc
+
+
+@pytest.inlineCallbacks
+def test_scheduler_limits_and_fairness():
+    api, rc = make_api()
+
+    started = {}
+
+    def rebuild(ticket_id, ref):
+        started[ref] = defer.Deferred()
+        return started[ref]
+
+    api.tasks['rebuild'] = rebuild
+    api.tasks['inspect'] = lambda ticket_id: defer.succeed('ok')
+
+    alice = RecordingClient()
+    bob = RecordingClient()
+
+    yield api.task_start(alice, 'rebuild', 'a1')
+    yield api.task_start(alice, 'rebuild', 'a2')
+    yield api.task_start(bob, 'rebuild', 'b1')
+    yield sleep(0.01)
+
+    assert started.keys() == ['a1']
+
+    # clients take turns
+    assert api.scheduler.order() == [3, 2]
+    assert ('task.progress.3', 'Waiting in queue, position 1\n') in bob.events
+    assert ('task.progress.2', 'Waiting in queue, position 2\n') in alice.events
+
+    # interactive tasks are not queued
+    result = yield api.task_start(bob, 'inspect')
+    yield sleep(0.01)
+    assert ('task.success.%s' % result['id'], 'ok') in bob.events
+
+    started['a1'].callback('done')
+    yield sleep(0.01)
+
+    assert sorted(started.keys()) == ['a1', 'b1']
+    assert ('task.progress.2', 'Waiting in queue, position 1\n') in alice.events
+
+    # waiting task may be killed
+    assert api.task_kill(2) is True
+    assert ('task.failure.2', 'Terminated.') in alice.events
+    assert api.scheduler.stats() == {'waiting': 0, 'running': {'rebuild': 1}}
+
+
+@pytest.inlineCallbacks
+def test_scheduler_keeps_order_of_client_tasks():
+    api, rc = make_api()
+
+    started = []
+
+    def run(name):
+        def task(ticket_id, ref):
+            started.append((name, ref))
+            return defer.Deferred()
+        return task
+
+    api.tasks['rebuild'] = run('rebuild')
+    api.tasks['sync'] = run('sync')
+
+    alice = RecordingClient()
+    bob = RecordingClient()
+
+    yield api.task_start(alice, 'rebuild', 'a1')
+    yield api.task_start(alice, 'rebuild', 'a2')
+    yield api.task_start(alice, 'sync', 'a3')
+    yield api.task_start(bob, 'sync', 'b1')
+    yield sleep(0.01)
+
+    # a3 has a slot, but waits for a2, other clients are not held up
+    assert started == [('rebuild', 'a1'), ('sync', 'b1')]
+    assert sorted(api.scheduler.waiting) == [2, 3]
+
+    api.tasks_running[1]['defered'].callback('done')
+    yield sleep(0.01)
+
+    assert started[2:] == [('rebuild', 'a2'), ('sync', 'a3')]
+
+
+@pytest.inlineCallbacks
+def test_scheduler_restores_queue():
+    api, rc = make_api()
+
+    rc.should_receive('hgetall').with_args('mcloud-task-running').and_return(defer.succeed({
+        '5': json.dumps({'ticket_id': 5, 'name': 'rebuild', 'args': ['bar'], 'kwargs': {}, 'node': api.node}),
+    }))
+    rc.should_receive('hgetall').with_args('mcloud-task-queue').and_return(defer.succeed({
+        '7': json.dumps({'ticket_id': 7, 'name': 'rebuild', 'args': ['foo'], 'kwargs': {}, 'priority': 2,
+                         'client': 123}),
+        '8': json.dumps({'ticket_id': 8, 'name': 'rebuild', 'args': ['baz'], 'kwargs': {}, 'priority': 2,
+                         'client': 123, 'node': 'other:7080'}),
+    }))
+    rc.should_receive('hdel').with_args('mcloud-task-running', '5').once()
+
+    started = []
+    api.tasks['rebuild'] = lambda ticket_id, ref: started.append((ticket_id, ref)) or defer.succeed(None)
+
+    yield api.scheduler.restore()
+
+    assert started == [(7, 'foo')]
+    assert api.tasks_running == {}
+
+
+class LocalBus(object):
+    """
+    Event bus shared by server processes, delivers like redis pub/sub.
+    """
+    def __init__(self):
+        self.handlers = []
+
+    def on(self, pattern, callback):
+        self.handlers.append((pattern, callback))
+
+    def fire_event(self, name, data=None):
+        message = json.loads(json.dumps(data))
+
+        for pattern, callback in list(self.handlers):
+            if fnmatch(name, pattern):
+                callback(name, message)
+
+        return defer.succeed(1)
+
+
+class FakeRedis(object):
+    """
+    Commands of redis, that task queue and ticket log use.
+    """
+    def __init__(self):
+        self.store = {}
+        self.ttl = {}
+
+    def incr(self, key):
+        self.store[key] = self.store.get(key, 0) + 1
+        return defer.succeed(self.store[key])
+
+    def hset(self, key, field, value):
+        self.store.setdefault(key, {})[str(field)] = value
+
+    def hdel(self, key, field):
+        self.store.get(key, {}).pop(str(field), None)
+
+    def hexists(self, key, field):
+        return defer.succeed(str(field) in self.store.get(key, {}))
+
+    def hgetall(self, key):
+        return defer.succeed(dict(self.store.get(key, {})))
+
+    def rpush(self, key, value):
+        self.store.setdefault(key, []).append(value)
+
+    def ltrim(self, key, start, end):
+        self.store[key] = self.store[key][start:][:end + 1 or None]
+
+    def lrange(self, key, start, end):
+        return defer.succeed(self.store.get(key, [])[start:][:end + 1 or None])
+
+    def expire(self, key, seconds):
+        self.ttl[key] = seconds
+
+    def setex(self, key, seconds, value):
+        self.store[key] = value
+        self.ttl[key] = seconds
+
+    def get(self, key):
+        return defer.succeed(self.store.get(key))
+
+
+def make_cluster():
+    inject.clear()
+
+    eb = LocalBus()
+    rc = FakeRedis()
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, rc)
+        binder.bind('settings', None)
+    inject.configure(my_config)
+
+    return eb, rc
+
+
+@pytest.inlineCallbacks
+def test_routing_between_server_processes():
+    make_cluster()
+
+    first = ApiRpcServer()
+    first.node = 'first:7080'
+    second = ApiRpcServer()
+    second.node = 'second:7080'
+
+    done = defer.Deferred()
+    first.tasks['rebuild'] = lambda ticket_id, ref: done
+
+    client = RecordingClient()
+
+    result = yield first.task_start(client, 'rebuild', 'foo')
+    ticket_id = result['id']
+    yield sleep(0.01)
+
+    # tasks of all processes are listed
+    tasks = yield second.cluster_task_list()
+    assert tasks == [{'id': ticket_id, 'name': 'rebuild', 'args': ['foo'], 'kwargs': {}, 'node': 'first:7080'}]
+
+    # client moved to second process, events follow it
+    first.ticket_map.pop(ticket_id)
+    second.ticket_map[ticket_id] = client
+
+    first.task_progress('Building', ticket_id)
+    assert client.events[-1] == ('task.progress.%s' % ticket_id, 'Building')
+
+    # kill is passed to the process running the task
+    killed = yield second.task_kill(ticket_id)
+    assert killed is True
+    assert client.events[-1] == ('task.failure.%s' % ticket_id, 'Terminated.')
+
+    tasks = yield second.cluster_task_list()
+    assert tasks == []
+
+    killed = yield second.task_kill(ticket_id)
+    assert killed is False
+
+
+@pytest.inlineCallbacks
+def test_reattach_to_ticket():
+    eb, rc = make_cluster()
+
+    first = ApiRpcServer()
+    first.node = 'first:7080'
+    second = ApiRpcServer()
+    second.node = 'second:7080'
+
+    first.ticket_log.TRIM_EVERY = 1
+    first.ticket_log.limit = 3
+
+    done = defer.Deferred()
+    first.tasks['rebuild'] = lambda ticket_id, ref: done
+
+    resynced = []
+
+    client = RecordingClient()
+    client.detach_on_disconnect = True
+
+    result = yield first.task_start(client, 'rebuild', 'foo')
+    ticket_id = result['id']
+    yield sleep(0.01)
+
+    first.task_progress('one', ticket_id)
+    first.task_stdout('\x00\xff', ticket_id)
+
+    # client is gone, task goes on
+    first.kill_client_tasks(client)
+    assert ticket_id in first.tasks_running
+
+    first.task_progress('three', ticket_id)
+    first.task_progress('four', ticket_id)
+
+    # log is capped
+    entries = yield first.ticket_log.read(ticket_id)
+    assert [entry['seq'] for entry in entries] == [2, 3, 4]
+    assert rc.ttl['mcloud-ticket-%s-log' % ticket_id] == 86400
+
+    # client comes back to other process, entries it has not seen are replayed
+    client = RecordingClient()
+
+    first.attach_handlers[ticket_id] = lambda: resynced.append(ticket_id)
+
+    result = yield second.task_attach(client, ticket_id, offset=2)
+    assert result == {'id': ticket_id, 'running': True}
+
+    # task is told, that client is back
+    assert resynced == [ticket_id]
+
+    first.task_progress('five', ticket_id)
+    done.callback('built')
+
+    assert client.events == [
+        ('task.progress.%s' % ticket_id, 'three'),
+        ('task.progress.%s' % ticket_id, 'four'),
+        ('task.progress.%s' % ticket_id, 'five'),
+        ('task.success.%s' % ticket_id, 'built'),
+    ]
+
+    # result is kept
+    completed = yield second.xmlrpc_is_completed(ticket_id)
+    assert completed is True
+
+    result = yield second.xmlrpc_get_result(ticket_id)
+    assert result == {'success': True, 'result': 'built'}
+
+    # late client gets output and result from the log
+    client = RecordingClient()
+
+    result = yield second.task_attach(client, ticket_id, offset=4)
+    assert result == {'id': ticket_id, 'running': False}
+    assert client.events == [
+        ('task.progress.%s' % ticket_id, 'five'),
+        ('task.success.%s' % ticket_id, 'built'),
+    ]
+    assert ticket_id not in second.ticket_map
+
+    # client, that is behind the capped log, is told what it has missed
+    client = RecordingClient()
+
+    yield second.task_attach(client, ticket_id, offset=1)
+    assert client.events == [
+        ('task.progress.%s' % ticket_id, '[2 entries were trimmed]'),
+        ('task.progress.%s' % ticket_id, 'four'),
+        ('task.progress.%s' % ticket_id, 'five'),
+        ('task.success.%s' % ticket_id, 'built'),
+    ]
+
+    with pytest.raises(ApiError):
+        yield second.task_attach(client, 12345)
+
+
+def test_replay_buffer_skips_replayed_events():
+    client = flexmock()
+    client.should_receive('send_event').with_args('task.progress.1', 'two', seq=2).once().ordered()
+    client.should_receive('send_event').with_args('task.progress.1', 'three', seq=3).once().ordered()
+    client.should_receive('send_event').with_args('task.progress.1', 'Waiting', seq=None).once().ordered()
+
+    replay = ReplayBuffer(client)
+
+    # live events, that came while log was read
+    replay.send_event('task.progress.1', 'three', ticket_id=1, seq=3)
+    replay.send_event('task.progress.1', 'Waiting', seq=None)
+
+    replay.send_entry(1, {'seq': 2, 'type': 'progress', 'data': 'two'})
+    replay.send_entry(1, {'seq': 3, 'type': 'progress', 'data': 'three'})
+    replay.release(3)
@@ -0,0 +1,156 @@
+from flexmock import flexmock
+from mcloud.state import ContainerStateCache
+import pytest
+from twisted.internet import defer
+
+
+@pytest.fixture
+def cache():
+    client = flexmock(url='unix://var/run/docker.sock/')
+    client.should_receive('events').and_return(defer.Deferred())
+    client.should_receive('list').with_args(all=True).and_return(defer.succeed([
+        {'Id': 'id1', 'Names': ['/foo.app']},
+        {'Id': 'id2', 'Names': ['/bar.app']},
+    ]))
+
+    cache = ContainerStateCache(client)
+    cache.start()
+    return cache
+
+
+def test_not_ready_goes_to_docker():
+    client = flexmock()
+    client.should_receive('inspect').with_args('foo.app').once().and_return(defer.succeed({'Id': 'id1'}))
+
+    cache = ContainerStateCache(client)
+
+    assert cache.inspect('foo.app').result == {'Id': 'id1'}
+
+
+def test_seed(cache):
+    assert cache.ready is True
+    assert cache.names == {'foo.app': 'id1', 'bar.app': 'id2'}
+
+
+@pytest.inlineCallbacks
+def test_inspect_cached(cache):
+    cache.client.should_receive('inspect').with_args('foo.app').once().and_return(
+        defer.succeed({'Id': 'id1', 'Name': '/foo.app'}))
+
+    r = yield cache.inspect('foo.app')
+    assert r == {'Id': 'id1', 'Name': '/foo.app'}
+
+    r = yield cache.inspect('foo.app')
+    assert r == {'Id': 'id1', 'Name': '/foo.app'}
+
+
+@pytest.inlineCallbacks
+def test_inspect_unknown_container(cache):
+    cache.client.should_receive('inspect').never()
+
+    r = yield cache.inspect('baz.app')
+    assert r is None
+
+
+@pytest.inlineCallbacks
+def test_event_makes_container_dirty(cache):
+    cache.client.should_receive('inspect').with_args('foo.app').twice().and_return(
+        defer.succeed({'Id': 'id1', 'Name': '/foo.app'}))
+
+    yield cache.inspect('foo.app')
+
+    cache.on_event({'id': 'id1', 'status': 'die'})
+    assert 'id1' in cache.dirty
+
+    yield cache.inspect('foo.app')
+    assert not 'id1' in cache.dirty
+
+
+def test_event_destroy(cache):
+    cache.on_event({'id': 'id1', 'status': 'destroy'})
+
+    assert cache.names == {'bar.app': 'id2'}
+
+
+def test_event_create_learns_name(cache):
+    cache.client.should_receive('inspect').with_args('id3').once().and_return(
+        defer.succeed({'Id': 'id3', 'Name': '/baz.app'}))
+
+    cache.on_event({'id': 'id3', 'status': 'create'})
+
+    assert cache.names['baz.app'] == 'id3'
+    assert cache.data['id3'] == {'Id': 'id3', 'Name': '/baz.app'}
+
+
+@pytest.inlineCallbacks
+def test_invalidate_unknown_name(cache):
+    cache.client.should_receive('inspect').with_args('baz.app').once().and_return(
+        defer.succeed({'Id': 'id3', 'Name': '/baz.app'}))
+
+    cache.invalidate('baz.app')
+
+    r = yield cache.inspect('baz.app')
+    assert r['Id'] == 'id3'
+    assert cache.names['baz.app'] == 'id3'
+
+
+def test_image_events_ignored(cache):
+    cache.client.should_receive('inspect').never()
+
+    cache.on_event({'id': 'ubuntu:14.04', 'status': 'untag'})
+
+
+def test_listeners(cache):
+    events = []
+    cache.listeners.append(events.append)
+
+    cache.on_event({'id': 'id1', 'status': 'start'})
+
+    assert events == [{'id': 'id1', 'status': 'start'}]
+
+
+def test_events_during_seeding_applied_after_seed():
+    listing = defer.Deferred()
+
+    client = flexmock(url='unix://var/run/docker.sock/')
+    client.should_receive('events').and_return(defer.Deferred())
+    client.should_receive('list').with_args(all=True).and_return(listing)
+    client.should_receive('inspect').with_args('id3').once().and_return(
+        defer.succeed({'Id': 'id3', 'Name': '/baz.app'}))
+
+    cache = ContainerStateCache(client)
+    cache.start()
+
+    # list was requested before these happened, it does not have them
+    cache.on_event({'id': 'id1', 'status': 'destroy'})
+    cache.on_event({'id': 'id3', 'status': 'create'})
+
+    listing.callback([
+        {'Id': 'id1', 'Names': ['/foo.app']},
+        {'Id': 'id2', 'Names': ['/bar.app']},
+    ])
+
+    assert cache.ready is True
+    assert cache.names == {'bar.app': 'id2', 'baz.app': 'id3'}
+    assert cache.pending == []
+
+
+@pytest.inlineCallbacks
+def test_event_during_inspect_keeps_container_dirty(cache):
+    first = defer.Deferred()
+    cache.client.should_receive('inspect').with_args('foo.app').and_return(first).and_return(
+        defer.succeed({'Id': 'id1', 'Name': '/foo.app', 'State': 'stopped'})).one_by_one()
+
+    d = cache.inspect('foo.app')
+
+    # container stops while it's being inspected
+    cache.on_event({'id': 'id1', 'status': 'die'})
+    first.callback({'Id': 'id1', 'Name': '/foo.app', 'State': 'running'})
+
+    r = yield d
+    assert r['State'] == 'running'
+    assert 'id1' in cache.dirty
+
+    r = yield cache.inspect('foo.app')
+    assert r['State'] == 'stopped'
+    assert not 'id1' in cache.dirty
@@ -0,0 +1,83 @@
+from flexmock import flexmock
+from mcloud.stats import StatsRing, StatsCollector, derive_stats, parse_sample, sample_stats
+import pytest
+from twisted.internet import defer
+
+
+def docker_stats(cpu, system, memory=100, rx=1000, tx=2000):
+    return {
+        'cpu_stats': {
+            'cpu_usage': {'total_usage': cpu, 'percpu_usage': [0, 0]},
+            'system_cpu_usage': system,
+        },
+        'memory_stats': {'usage': memory, 'limit': 1000},
+        'network': {'rx_bytes': rx, 'tx_bytes': tx},
+    }
+
+
+def test_ring_wraps():
+    ring = StatsRing(size=3)
+
+    for i in range(5):
+        ring.append([i] * len(StatsRing.FIELDS))
+
+    assert len(ring) == 3
+    assert ring.get(0)[0] == 4
+    assert ring.get(2)[0] == 2
+
+    with pytest.raises(IndexError):
+        ring.get(3)
+
+
+def test_derive_stats_from_deltas():
+    previous = parse_sample(docker_stats(100, 1000, memory=100, rx=1000), time=10)
+    newest = parse_sample(docker_stats(150, 1200, memory=300, rx=3000), time=12)
+
+    stats = derive_stats(newest, previous)
+
+    # 50 of 200 system ticks on 2 cpus
+    assert stats['cpu_usage'] == 50.0
+    assert stats['memory_usage'] == 300
+    assert stats['memory_rate'] == 100.0
+    assert stats['net_rx'] == 3000
+    assert stats['net_rx_rate'] == 1000.0
+
+
+def test_derive_stats_single_sample():
+    stats = derive_stats(parse_sample(docker_stats(100, 1000), time=10))
+
+    assert stats['cpu_usage'] == 0.0
+    assert stats['memory_usage'] == 100
+
+
+def test_sample_stats_precpu():
+    data = docker_stats(150, 1200)
+    data['precpu_stats'] = docker_stats(100, 1000)['cpu_stats']
+
+    assert sample_stats(data)['cpu_usage'] == 50.0
+
+
+def test_collector_stream():
+    client = flexmock()
+    stream = defer.Deferred()
+
+    chunks = []
+    client.should_receive('stats_stream').with_args('id1', object).once().replace_with(
+        lambda id_, on_chunk: chunks.append(on_chunk) or stream)
+
+    collector = StatsCollector(client, history=10)
+    collector.watch('id1')
+    collector.watch('id1')
+
+    assert collector.stats('id1') is None
+
+    chunks[0](docker_stats(100, 1000))
+    chunks[0](docker_stats(150, 1200))
+
+    assert collector.stats('id1')['cpu_usage'] == 50.0
+    assert collector.history('id1') == [50.0]
+
+    stream.callback(None)
+
+    assert collector.stats('id1') is None
+    assert not 'id1' in collector.streams
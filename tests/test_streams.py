@@ -0,0 +1,114 @@
+import json
+import struct
+from mcloud.streams import JsonStreamDecoder, LogStreamDemultiplexer
+
+
+def decode(chunks):
+    records = []
+    text = []
+
+    decoder = JsonStreamDecoder(records.append, text.append)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    decoder.flush()
+
+    return records, text
+
+
+def test_newline_separated():
+    records, text = decode(['{"status": "a"}\r\n{"status": "b"}\r\n'])
+
+    assert records == [{'status': 'a'}, {'status': 'b'}]
+    assert text == []
+
+
+def test_concatenated():
+    records, text = decode(['{"status": "a"}{"status": "b"}'])
+
+    assert records == [{'status': 'a'}, {'status': 'b'}]
+
+
+def test_record_split_between_chunks():
+    data = json.dumps({'status': 'Downloading', 'progressDetail': {'current': 1, 'total': 2}, 'id': 'abc'}) + '\r\n'
+
+    chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+    records, text = decode(chunks + ['{"error": "boo"}'])
+
+    assert records == [
+        {'status': 'Downloading', 'progressDetail': {'current': 1, 'total': 2}, 'id': 'abc'},
+        {'error': 'boo'}
+    ]
+
+
+def test_record_kept_until_complete():
+    records = []
+
+    decoder = JsonStreamDecoder(records.append)
+    decoder.feed('{"stream": "Step 1 : FROM ubuntu"')
+
+    assert records == []
+    assert decoder.pending == ['{"stream": "Step 1 : FROM ubuntu"']
+
+    decoder.feed('}\n')
+
+    assert records == [{'stream': 'Step 1 : FROM ubuntu'}]
+    assert decoder.pending == []
+
+
+def test_plain_text():
+    records, text = decode(['{"status": "a"}\nno such image\n', '{"status": "b"}', 'tail'])
+
+    assert records == [{'status': 'a'}, {'status': 'b'}]
+    assert text == ['no such image', 'tail']
+
+
+def test_broken_line_skipped():
+    records, text = decode(['{"status": \n{"status": "b"}\n'])
+
+    assert records == [{'status': 'b'}]
+    assert text == ['{"status": ']
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+def test_demux_frames():
+    lines = []
+    demux = LogStreamDemultiplexer(lambda line, stream: lines.append((stream, line)))
+
+    demux.feed(frame(1, 'foo\nbar\n') + frame(2, 'error\n'))
+
+    assert lines == [('stdout', 'foo'), ('stdout', 'bar'), ('stderr', 'error')]
+
+
+def test_demux_byte_by_byte():
+    lines = []
+    demux = LogStreamDemultiplexer(lambda line, stream: lines.append((stream, line)))
+
+    data = frame(1, 'foo\nba') + frame(2, 'err') + frame(1, 'r\n') + frame(2, 'or\n')
+    for c in data:
+        demux.feed(c)
+
+    assert lines == [('stdout', 'foo'), ('stdout', 'bar'), ('stderr', 'error')]
+
+
+def test_demux_line_across_frames_and_flush():
+    lines = []
+    demux = LogStreamDemultiplexer(lambda line, stream: lines.append((stream, line)))
+
+    demux.feed(frame(1, 'foo') + frame(1, 'bar\nbaz'))
+    assert lines == [('stdout', 'foobar')]
+
+    demux.flush()
+    assert lines == [('stdout', 'foobar'), ('stdout', 'baz')]
+
+
+def test_demux_tty_stream():
+    lines = []
+    demux = LogStreamDemultiplexer(lambda line, stream: lines.append((stream, line)))
+
+    demux.feed('hello ')
+    demux.feed('world\n@mcloud ready in 5s\n')
+
+    assert lines == [('stdout', 'hello world'), ('stdout', '@mcloud ready in 5s')]
@@ -1,7 +1,9 @@
+from StringIO import StringIO
+import tarfile
 from flexmock import flexmock
 from mcloud import txhttp
 from mcloud.test_utils import real_docker, mock_docker
-from mcloud.txdocker import DockerTwistedClient, DockerConnectionFailed
+from mcloud.txdocker import DockerTwistedClient, DockerConnectionFailed, RequestLimiter, NotFound
 import pytest
 from twisted.internet import defer
 
@@ -57,3 +59,212 @@ def test_delete(client):
 
     assert client._delete('foo', foo='bar') == 'baz'
 
+
+
+def test_coalescing_shares_request(client):
+    flexmock(client)
+    client.enable_coalescing()
+
+    response = defer.Deferred()
+    client.should_receive('_inspect').with_args('foo').once().and_return(response)
+
+    d1 = client.inspect('foo')
+    d2 = client.inspect('foo')
+
+    results = []
+    d1.addCallback(results.append)
+    d2.addCallback(results.append)
+
+    response.callback({'Id': 'foo'})
+
+    assert results == [{'Id': 'foo'}, {'Id': 'foo'}]
+    assert client.coalescer.stats() == {'inspect': {'hits': 1, 'misses': 1}}
+    assert client.coalescer.in_flight == {}
+
+
+def test_coalescing_shares_failure(client):
+    flexmock(client)
+    client.enable_coalescing()
+
+    response = defer.Deferred()
+    client.should_receive('_inspect_image').with_args('foo').once().and_return(response)
+
+    d1 = client.inspect_image('foo')
+    d2 = client.inspect_image('foo')
+
+    failures = []
+    d1.addErrback(failures.append)
+    d2.addErrback(failures.append)
+
+    response.errback(DockerConnectionFailed('boo'))
+
+    assert len(failures) == 2
+
+
+def test_coalescing_different_args(client):
+    flexmock(client)
+    client.enable_coalescing()
+
+    client.should_receive('_images').with_args('foo').once().and_return(defer.Deferred())
+    client.should_receive('_images').with_args('bar').once().and_return(defer.Deferred())
+
+    client.images(name='foo')
+    client.images(name='bar')
+
+    assert client.coalescer.stats() == {'images': {'hits': 0, 'misses': 2}}
+
+
+def test_limiter_bounds_concurrency():
+    limiter = RequestLimiter(limit=2, interactive_reserve=1)
+
+    responses = [defer.Deferred() for _ in range(3)]
+    calls = []
+
+    def request(i):
+        calls.append(i)
+        return responses[i]
+
+    for i in range(3):
+        limiter.run(RequestLimiter.INTERACTIVE, request, i)
+
+    assert calls == [0, 1]
+    assert limiter.stats()['interactive']['queued'] == 1
+
+    responses[0].callback(None)
+
+    assert calls == [0, 1, 2]
+    assert limiter.active == 2
+
+
+def test_limiter_interactive_first():
+    limiter = RequestLimiter(limit=2, interactive_reserve=1)
+
+    responses = []
+    calls = []
+
+    def request(name):
+        calls.append(name)
+        d = defer.Deferred()
+        responses.append(d)
+        return d
+
+    limiter.run(RequestLimiter.BULK, request, 'bulk1')
+
+    # last slot is reserved for interactive requests
+    limiter.run(RequestLimiter.BULK, request, 'bulk2')
+    limiter.run(RequestLimiter.INTERACTIVE, request, 'run1')
+    limiter.run(RequestLimiter.INTERACTIVE, request, 'run2')
+
+    assert calls == ['bulk1', 'run1']
+
+    responses[0].callback(None)
+
+    assert calls == ['bulk1', 'run1', 'run2']
+
+    responses[1].callback(None)
+    responses[2].callback(None)
+
+    assert calls == ['bulk1', 'run1', 'run2', 'bulk2']
+    assert limiter.stats()['bulk']['served'] == 2
+
+
+def test_limiter_cancel_queued():
+    limiter = RequestLimiter(limit=1, interactive_reserve=0)
+
+    limiter.run(RequestLimiter.INTERACTIVE, lambda: defer.Deferred())
+    d = limiter.run(RequestLimiter.INTERACTIVE, lambda: defer.Deferred())
+    d.addErrback(lambda failure: None)
+
+    d.cancel()
+
+    assert limiter.stats()['interactive']['queued'] == 0
+
+
+@pytest.inlineCallbacks
+def test_put_files_single_request(client):
+    uploads = []
+
+    def request(url, method, data, api_version, **kwargs):
+        uploads.append((url, method, data, api_version))
+        return defer.succeed(flexmock(code=200))
+
+    flexmock(client)
+    client._request = request
+    flexmock(txhttp).should_receive('content').and_return(defer.succeed(''))
+
+    yield client.put_files('123', {'/usr/bin/@me': '#!/bin/sh', '/etc/foo.conf': 'foo=bar'}, mode=0755)
+
+    assert len(uploads) == 1
+
+    url, method, data, api_version = uploads[0]
+    assert url == 'containers/123/archive?path=%2F'
+    assert method == txhttp.put
+    assert api_version == 'v1.20'
+
+    t = tarfile.open(fileobj=StringIO(data))
+    assert t.getnames() == ['etc/foo.conf', 'usr/bin/@me']
+    assert t.getmember('usr/bin/@me').mode == 0755
+    assert t.extractfile('usr/bin/@me').read() == '#!/bin/sh'
+
+
+@pytest.inlineCallbacks
+def test_put_archive_not_found(client):
+    flexmock(client)
+    client.should_receive('_request').and_return(defer.succeed(flexmock(code=404)))
+    flexmock(txhttp).should_receive('content').and_return(defer.succeed('no such id: 123'))
+
+    with pytest.raises(NotFound):
+        yield client.put_archive('123', '/', 'data')
+
+
+@pytest.inlineCallbacks
+def test_put_files_falls_back_to_exec(client):
+    requests = []
+
+    def request(url, method, **kwargs):
+        requests.append(url)
+
+        if 'archive' in url:
+            return defer.succeed(flexmock(code=404))
+        return defer.succeed(flexmock(code=201))
+
+    flexmock(client)
+    client._request = request
+    client.should_receive('_exec_put_file').with_args('123', '/etc/foo.conf', 'foo=bar', 0644, ticket_id=None)\
+        .twice().and_return(defer.succeed(None))
+    flexmock(txhttp).should_receive('content').and_return(
+        defer.succeed('client is newer than server (client API version: 1.20, server API version: 1.19)'))
+
+    yield client.put_files('123', {'/etc/foo.conf': 'foo=bar'})
+    assert client.archive_supported is False
+
+    # archive is not tried again
+    yield client.put_files('123', {'/etc/foo.conf': 'foo=bar'})
+    assert len(requests) == 1
+
+
+@pytest.inlineCallbacks
+def test_streams_are_not_buffered(client):
+    from treq.client import _BufferedResponse
+    from twisted.web.http_headers import Headers
+
+    class Agent(object):
+        def request(self, method, uri, headers=None, bodyProducer=None):
+            return defer.succeed(flexmock(code=200, headers=Headers({}), length=None))
+
+    client.agent = Agent()
+
+    responses = []
+
+    flexmock(client)
+    client.should_receive('collect_json_stream').replace_with(
+        lambda response, on_record, on_text=None: responses.append(response))
+    client.should_receive('collect_log_stream').replace_with(lambda response, on_line: responses.append(response))
+
+    yield client.stats_stream('123', lambda data: None)
+    yield client.events(lambda event: None)
+    yield client.logs('123', lambda line, stream: None, follow=True)
+
+    assert len(responses) == 3
+    for response in responses:
+        assert not isinstance(response.original, _BufferedResponse)
@@ -55,14 +55,7 @@ def test_build(client):
 
     builder = DockerfileImageBuilder(os.path.join(os.path.dirname(__file__), '_files/ct_bash'))
 
-    d = builder.create_archive()
-
-    def build_image(docker_file):
-        return client.build_image(docker_file, ticket_id=123123)
-
-    d.addCallback(build_image)
-
-    result = yield d
+    result = yield client.build_image(builder.create_archive(), ticket_id=123123)
 
     assert re.match('^[0-9a-f]+$', result)
 
@@ -12,3 +12,43 @@ def test_basic_connect():
     assert r.code == 200
 
 
+
+
+def _self_signed():
+    from OpenSSL import crypto
+
+    pkey = crypto.PKey()
+    pkey.generate_key(crypto.TYPE_RSA, 1024)
+
+    cert = crypto.X509()
+    cert.get_subject().CN = 'foo'
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(pkey)
+    cert.sign(pkey, 'sha256')
+
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey), crypto.dump_certificate(crypto.FILETYPE_PEM, cert)
+
+
+def test_tls_policy_caches_creators():
+    key, crt = _self_signed()
+
+    policy = txhttp.BrowserLikeTLSPolicyForHTTPS(key, crt, crt)
+
+    creator = policy.creatorForNetloc('foo', 2376)
+
+    assert isinstance(creator, txhttp.ResumingClientConnectionCreator)
+    assert policy.creatorForNetloc('foo', 2376) is creator
+    assert policy.creatorForNetloc('bar', 2376) is not creator
+
+
+def test_tls_policy_parses_material_once():
+    key, crt = _self_signed()
+
+    policy = txhttp.BrowserLikeTLSPolicyForHTTPS(key, crt, crt)
+
+    trust_root, cert = policy._load_material()
+
+    assert policy._load_material()[1] is cert
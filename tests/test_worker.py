@@ -0,0 +1,290 @@
+from base64 import b64encode
+import json
+import os
+
+from flexmock import flexmock
+import inject
+from mcloud.events import EventBus
+from mcloud.plugin import IMcloudPlugin, enumerate_plugins, load_plugins
+from mcloud.plugins import Plugin
+from mcloud.remote import ApiRpcServer
+from mcloud.service import IServiceLifecycleListener
+from mcloud.worker import WorkerRpcServer, TaskWorker, WorkerPool, worker_id
+import pkg_resources
+import pytest
+from twisted.internet import defer, reactor
+import txredisapi as redis
+from zope.interface import implements
+
+
+def sleep(secs):
+    d = defer.Deferred()
+    reactor.callLater(secs, d.callback, None)
+    return d
+
+
+class RecordingClient(object):
+    def __init__(self):
+        self.events = []
+
+    def send_event(self, name, data=None, ticket_id=None, seq=None):
+        self.events.append((name, data))
+
+
+class RecordingBus(object):
+    def __init__(self):
+        self.fired = []
+        self.handlers = {}
+
+    def on(self, pattern, callback):
+        self.handlers[pattern] = callback
+
+    def fire_event(self, name, data=None):
+        self.fired.append((name, data))
+        return defer.succeed(1)
+
+    def deliver(self, channel, message):
+        """
+        Pass message to handler, as redis would, json round trip included.
+        """
+        pattern = '.'.join(channel.split('.')[:-1]) + '.*'
+        self.handlers[pattern](channel, json.loads(json.dumps(message)))
+
+
+def configure(workers=0, worker=False, plugins=None):
+    inject.clear()
+
+    ids = iter(range(1, 100))
+    jobs = []
+
+    rc = flexmock()
+    rc.should_receive('incr').replace_with(lambda key: defer.succeed(next(ids)))
+    for command in ('hset', 'hdel', 'rpush', 'ltrim', 'expire', 'setex'):
+        rc.should_receive(command)
+    rc.should_receive('lpush').replace_with(lambda key, value: jobs.append(json.loads(value)) or defer.succeed(1))
+
+    eb = RecordingBus()
+
+    def my_config(binder):
+        binder.bind(EventBus, eb)
+        binder.bind(redis.Connection, rc)
+        binder.bind('settings', flexmock(task_limits={}, workers=workers))
+
+        if plugins is not None:
+            binder.bind('plugins', plugins)
+
+        if worker:
+            binder.bind_to_constructor(ApiRpcServer, WorkerRpcServer)
+    inject.configure(my_config)
+
+    return eb, jobs
+
+
+@pytest.inlineCallbacks
+def test_server_passes_tasks_to_workers():
+    eb, jobs = configure(workers=2)
+
+    api = ApiRpcServer()
+    api.tasks['rebuild'] = lambda ticket_id, ref: pytest.fail('Task must run in worker')
+
+    client = RecordingClient()
+
+    result = yield api.task_start(client, 'rebuild', 'foo')
+    yield sleep(0.01)
+
+    assert jobs == [{'ticket_id': result['id'], 'name': 'rebuild', 'args': ['foo'], 'kwargs': {}}]
+    assert api.scheduler.stats() == {'waiting': 0, 'running': {'rebuild': 1}}
+    assert api.task_list()[0]['name'] == 'rebuild'
+
+    eb.deliver('task.progress.1', {'data': 'Building', 'droppable': True, 'seq': 1})
+    eb.deliver('task.stdout.1', {'data': b64encode('\x00\xff'), 'seq': 2})
+    eb.deliver('task.result.1', {'success': True, 'result': 'done', 'seq': 3})
+
+    assert client.events == [
+        ('task.progress.1', 'Building'),
+        ('task.stdout.1', b64encode('\x00\xff')),
+        ('task.success.1', 'done'),
+    ]
+    assert api.scheduler.stats() == {'waiting': 0, 'running': {}}
+    assert api.tasks_running == {}
+
+
+@pytest.inlineCallbacks
+def test_server_runs_local_tasks_itself():
+    eb, jobs = configure(workers=2)
+
+    api = ApiRpcServer()
+    api.tasks['list_follow'] = lambda ticket_id: defer.Deferred()
+
+    client = RecordingClient()
+
+    result = yield api.task_start(client, 'list_follow')
+    yield sleep(0.01)
+
+    assert jobs == []
+    assert result['id'] in api.tasks_running
+    assert result['id'] not in api.remote_tasks
+
+
+@pytest.inlineCallbacks
+def test_server_kills_and_fails_remote_tasks():
+    eb, jobs = configure(workers=2)
+
+    api = ApiRpcServer()
+    client = RecordingClient()
+
+    yield api.task_start(client, 'inspect', 'foo')
+    yield api.task_start(client, 'inspect', 'bar')
+    yield sleep(0.01)
+
+    assert api.task_kill(1) is True
+    assert ('task.kill.1', 1) in eb.fired
+    assert ('task.failure.1', 'Terminated.') in client.events
+
+    # late result of killed task is ignored
+    eb.deliver('task.result.1', {'success': True, 'result': 'done'})
+    assert ('task.success.1', 'done') not in client.events
+
+    eb.deliver('task.accepted.2', {'worker': 'host:123'})
+    eb.handlers['worker.lost']('worker.lost', 'host:123')
+
+    assert ('task.failure.2', 'Worker process has exited') in client.events
+    assert api.tasks_running == {}
+
+
+@pytest.inlineCallbacks
+def test_worker_runs_tasks_and_publishes_events():
+    eb, jobs = configure(worker=True)
+
+    api = inject.instance(ApiRpcServer)
+    assert sorted(eb.handlers.keys()) == ['task.attached.*', 'task.kill.*']
+
+    done = defer.Deferred()
+
+    def rebuild(ticket_id, ref):
+        api.task_progress('Building %s' % ref, ticket_id)
+        api.task_stdout('\x00\xff', ticket_id)
+        return done
+
+    api.tasks['rebuild'] = rebuild
+    api.tasks['broken'] = lambda ticket_id: defer.fail(ValueError('Boom'))
+    api.tasks['endless'] = lambda ticket_id: defer.Deferred()
+
+    jobs = [json.dumps({'ticket_id': 5, 'name': 'rebuild', 'args': ['foo'], 'kwargs': {}}),
+            json.dumps({'ticket_id': 6, 'name': 'broken', 'args': [], 'kwargs': {}}),
+            json.dumps({'ticket_id': 7, 'name': 'endless', 'args': [], 'kwargs': {}})]
+    processing = []
+
+    def brpoplpush(source, destination, timeout=0):
+        assert (source, destination) == ('mcloud-task-jobs', 'mcloud-task-jobs-%s' % worker_id(os.getpid()))
+        if not jobs:
+            return defer.Deferred()
+        processing.append(jobs.pop(0))
+        return defer.succeed(processing[-1])
+
+    queue = flexmock(brpoplpush=brpoplpush, lrem=lambda key, count, value: processing.remove(value))
+
+    worker = TaskWorker(queue, concurrency=2)
+    worker.start()
+    yield sleep(0.01)
+
+    # two tasks run, third waits for free slot
+    assert worker.active == set([5, 7])
+
+    # job leaves processing list, when it's accepted
+    assert processing == []
+
+    done.callback('built')
+    assert worker.active == set([7])
+
+    worker.stop()
+
+    eb.handlers['task.kill.*']('task.kill.7', 7)
+    assert worker.active == set()
+
+    fired = [(name, data) for name, data in eb.fired if name != 'task.start']
+    assert fired == [
+        ('task.accepted.5', {'worker': fired[0][1]['worker']}),
+        ('task.progress.5', {'data': 'Building foo', 'droppable': True, 'seq': 1}),
+        ('task.stdout.5', {'data': b64encode('\x00\xff'), 'seq': 2}),
+        ('task.accepted.6', {'worker': fired[0][1]['worker']}),
+        ('task.result.6', {'success': False, 'cancelled': False, 'error': 'Boom', 'seq': 1}),
+        ('task.accepted.7', {'worker': fired[0][1]['worker']}),
+        ('task.result.5', {'success': True, 'result': 'built', 'seq': 3}),
+        ('task.result.7', {'success': False, 'cancelled': True, 'error': 'Terminated.', 'seq': 1}),
+    ]
+
+
+@pytest.inlineCallbacks
+def test_worker_runs_plugin_hooks():
+    started = []
+
+    class StartListener(Plugin):
+        implements(IMcloudPlugin, IServiceLifecycleListener)
+
+        def on_service_start(self, service, ticket_id=None):
+            started.append((service, ticket_id))
+
+        def setup(self):
+            pytest.fail('Setup is done by server process')
+
+    class EventsWatcher(Plugin):
+        implements(IMcloudPlugin)
+
+        server_only = True
+
+        def setup(self):
+            pass
+
+    flexmock(pkg_resources).should_receive('iter_entry_points').with_args(group='mcloud_plugins').and_return([
+        flexmock(load=lambda: StartListener),
+        flexmock(load=lambda: EventsWatcher),
+    ])
+
+    plugins = []
+    eb, jobs = configure(worker=True, plugins=plugins)
+
+    yield load_plugins(plugins, worker=True)
+    assert [plugin.__class__ for plugin in plugins] == [StartListener]
+
+    def start(ticket_id, name):
+        # as Service.start does
+        for plugin in enumerate_plugins(IServiceLifecycleListener):
+            plugin.on_service_start(name, ticket_id=ticket_id)
+        return defer.succeed(True)
+
+    api = inject.instance(ApiRpcServer)
+    api.tasks['start'] = start
+
+    worker = TaskWorker(flexmock())
+    yield worker.run({'ticket_id': 5, 'name': 'start', 'args': ['foo'], 'kwargs': {}})
+
+    assert started == [('foo', 5)]
+
+
+@pytest.inlineCallbacks
+def test_pool_requeues_jobs_of_lost_worker():
+    eb, jobs = configure(workers=2)
+
+    queues = {
+        'mcloud-task-jobs': ['{"ticket_id": 3}'],
+        'mcloud-task-jobs-host:123': ['{"ticket_id": 2}', '{"ticket_id": 1}'],
+    }
+
+    def rpoplpush(source, destination):
+        if not queues[source]:
+            return defer.succeed(None)
+        item = queues[source].pop()
+        queues[destination].insert(0, item)
+        return defer.succeed(item)
+
+    rc = inject.instance(redis.Connection)
+    rc.should_receive('rpoplpush').replace_with(rpoplpush)
+
+    pool = WorkerPool(2, [])
+    yield pool.requeue('host:123')
+
+    assert queues == {
+        'mcloud-task-jobs': ['{"ticket_id": 2}', '{"ticket_id": 1}', '{"ticket_id": 3}'],
+        'mcloud-task-jobs-host:123': [],
+    }